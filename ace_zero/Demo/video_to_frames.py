@@ -0,0 +1,18 @@
+from ace_zero.Method.video import videoToFrames
+
+def demo():
+    video_file_path = '/home/lichanghao/chLi/Dataset/GS/haizei_1.MOV'
+    down_sample_scale = 1
+    scale = 1
+    image_resolution = 480
+    print_progress = True
+
+    for image_idx, frame in videoToFrames(
+        video_file_path,
+        down_sample_scale,
+        scale,
+        image_resolution,
+        print_progress,
+    ):
+        pass
+    return True
@@ -0,0 +1,66 @@
+"""Check the attention implementations of the BEiT backbone against each other.
+
+Runs the backbone with random weights on random input for every attention mode (see
+midas.backbones.beit.ATTENTION_MODE) and reports the maximum deviation of the backbone features from the
+"naive" mode, and the mean run time of num_runs forwards after a warm-up forward.
+"""
+import argparse
+import time
+
+import timm
+import torch
+
+from midas.backbones import beit
+
+
+def run(model_name, heights, width, batch_size, chunk_size, tolerance, num_runs):
+    torch.manual_seed(0)
+    model = timm.create_model(model_name, pretrained=False)
+    backbone = beit._make_beit_backbone(model, hooks=[0, 1, 2, 3], vit_features=model.embed_dim).eval()
+
+    beit.ATTENTION_CHUNK_SIZE = chunk_size
+    success = True
+
+    for height in heights:
+        x = torch.randn(batch_size, 3, height, width)
+        reference = None
+
+        for mode in ["naive", "sdpa", "chunked"]:
+            beit.ATTENTION_MODE = mode
+
+            with torch.no_grad():
+                # the warm-up forward fills the relative position bias cache (if enabled) and the allocator
+                features = beit.forward_beit(backbone, x)
+                start = time.time()
+                for _ in range(num_runs):
+                    beit.forward_beit(backbone, x)
+                elapsed = (time.time() - start) / num_runs
+
+            if reference is None:
+                reference = features
+                max_diff = 0.0
+            else:
+                max_diff = max((f - r).abs().max().item() for f, r in zip(features, reference))
+
+            ok = max_diff <= tolerance
+            success &= ok
+            print(f"{height}x{width} {mode:>8}: {elapsed * 1000:8.1f} ms, max diff {max_diff:.2e} "
+                  f"{'ok' if ok else 'FAILED'}")
+
+    beit.ATTENTION_MODE = "naive"
+    return success
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default='beit_base_patch16_384', help='timm BEiT model')
+    parser.add_argument('--heights', type=int, nargs='+', default=[384, 256], help='input heights')
+    parser.add_argument('--width', type=int, default=384, help='input width')
+    parser.add_argument('--batch_size', type=int, default=1, help='batch size')
+    parser.add_argument('--chunk_size', type=int, default=128, help='queries per chunk of the chunked mode')
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='maximum allowed absolute deviation')
+    parser.add_argument('--num_runs', type=int, default=3, help='timed forwards per mode, after one warm-up forward')
+    args = parser.parse_args()
+
+    if not run(args.model, args.heights, args.width, args.batch_size, args.chunk_size, args.tolerance, args.num_runs):
+        exit(1)
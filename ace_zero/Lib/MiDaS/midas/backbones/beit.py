@@ -1,3 +1,4 @@
+import math
 import timm
 import torch
 import types
@@ -6,11 +7,24 @@ import numpy as np
 import torch.nn.functional as F
 
 from .utils import forward_adapted_unflatten, make_backbone_default
+from collections import OrderedDict
 from timm.models.beit import gen_relative_position_index
 from torch.utils.checkpoint import checkpoint
 from typing import Optional
 
 
+# Number of window sizes per attention block for which the relative position bias is kept, 0 (the default) disables
+# caching. Opt-in, because every cached bias stays resident: it takes num_heads * (Wh*Ww+1)^2 floats, about 38 MB per
+# block for ZoeDepth's 384x512 input and 64 MB per block (1.5 GB for all 24 blocks) for beitl16_512.
+REL_POS_BIAS_CACHE_SIZE = 0
+
+# Attention implementation: "naive" materializes the full attention matrix per block, "sdpa" uses
+# torch.nn.functional.scaled_dot_product_attention (PyTorch >= 2.0) with the bias as attn_mask, "chunked" processes
+# ATTENTION_CHUNK_SIZE queries at a time to bound peak memory.
+ATTENTION_MODE = "naive"
+ATTENTION_CHUNK_SIZE = 256
+
+
 def forward_beit(pretrained, x):
     return forward_adapted_unflatten(pretrained, x, "forward_features")
 
@@ -29,6 +43,37 @@ def patch_embed_forward(self, x):
 def _get_rel_pos_bias(self, window_size):
     """
     Modification of timm.models.beit.py: Attention._get_rel_pos_bias to support arbitrary window sizes.
+
+    If REL_POS_BIAS_CACHE_SIZE > 0, the interpolated bias is cached per window size (LRU) when no gradient
+    is needed. Entries are invalidated when the bias table is modified in-place (e.g. load_state_dict,
+    optimizer step) or moved to another device or dtype.
+    """
+    table = self.relative_position_bias_table
+    use_cache = REL_POS_BIAS_CACHE_SIZE > 0 and not (torch.is_grad_enabled() and table.requires_grad)
+
+    cache_key = (tuple(window_size), table.device, table.dtype)
+    table_state = (table._version, table.data_ptr())
+
+    if use_cache and cache_key in self.relative_position_bias_cache:
+        cached_state, cached_bias = self.relative_position_bias_cache[cache_key]
+        if cached_state == table_state:
+            self.relative_position_bias_cache.move_to_end(cache_key)
+            return cached_bias
+        del self.relative_position_bias_cache[cache_key]
+
+    relative_position_bias = _interpolate_rel_pos_bias(self, window_size)
+
+    if use_cache:
+        self.relative_position_bias_cache[cache_key] = (table_state, relative_position_bias)
+        while len(self.relative_position_bias_cache) > REL_POS_BIAS_CACHE_SIZE:
+            self.relative_position_bias_cache.popitem(last=False)
+
+    return relative_position_bias
+
+
+def _interpolate_rel_pos_bias(self, window_size):
+    """
+    Interpolate the relative position bias table to the given window size and gather the bias per token pair.
     """
     old_height = 2 * self.window_size[0] - 1
     old_width = 2 * self.window_size[1] - 1
@@ -73,24 +118,73 @@ def attention_forward(self, x, resolution, shared_rel_pos_bias: Optional[torch.T
     qkv = qkv.reshape(B, N, 3, self.num_heads, -1).permute(2, 0, 3, 1, 4)
     q, k, v = qkv.unbind(0)  # make torchscript happy (cannot use tensor as tuple)
 
-    q = q * self.scale
-    attn = (q @ k.transpose(-2, -1))
-
+    attn_bias = None
     if self.relative_position_bias_table is not None:
         window_size = tuple(np.array(resolution) // 16)
-        attn = attn + self._get_rel_pos_bias(window_size)
+        attn_bias = self._get_rel_pos_bias(window_size)
     if shared_rel_pos_bias is not None:
-        attn = attn + shared_rel_pos_bias
+        attn_bias = shared_rel_pos_bias if attn_bias is None else attn_bias + shared_rel_pos_bias
+
+    if ATTENTION_MODE == "sdpa" and hasattr(F, "scaled_dot_product_attention"):
+        x = _sdpa_attention(self, q, k, v, attn_bias)
+    elif ATTENTION_MODE == "chunked":
+        x = _chunked_attention(self, q, k, v, attn_bias)
+    else:
+        q = q * self.scale
+        attn = (q @ k.transpose(-2, -1))
 
-    attn = attn.softmax(dim=-1)
-    attn = self.attn_drop(attn)
+        if attn_bias is not None:
+            attn = attn + attn_bias
 
-    x = (attn @ v).transpose(1, 2).reshape(B, N, -1)
+        attn = attn.softmax(dim=-1)
+        attn = self.attn_drop(attn)
+
+        x = attn @ v
+
+    x = x.transpose(1, 2).reshape(B, N, -1)
     x = self.proj(x)
     x = self.proj_drop(x)
     return x
 
 
+def _sdpa_attention(self, q, k, v, attn_bias):
+    """
+    Attention with torch.nn.functional.scaled_dot_product_attention, the bias is passed as additive mask.
+    """
+    # scaled_dot_product_attention scales by 1 / sqrt(head_dim), rescale q if the block uses another scale
+    rescale = self.scale * math.sqrt(q.shape[-1])
+    if rescale != 1:
+        q = q * rescale
+
+    if attn_bias is not None:
+        attn_bias = attn_bias.to(q.dtype)
+
+    dropout_p = self.attn_drop.p if self.training else 0.0
+    return F.scaled_dot_product_attention(q, k, v, attn_mask=attn_bias, dropout_p=dropout_p)
+
+
+def _chunked_attention(self, q, k, v, attn_bias):
+    """
+    Attention over chunks of ATTENTION_CHUNK_SIZE queries, only a slice of the attention matrix exists at a time.
+    """
+    q = q * self.scale
+    k_t = k.transpose(-2, -1)
+
+    out = []
+    for start in range(0, q.shape[-2], ATTENTION_CHUNK_SIZE):
+        end = start + ATTENTION_CHUNK_SIZE
+
+        attn = q[..., start:end, :] @ k_t
+        if attn_bias is not None:
+            attn = attn + attn_bias[..., start:end, :]
+
+        attn = attn.softmax(dim=-1)
+        attn = self.attn_drop(attn)
+        out.append(attn @ v)
+
+    return torch.cat(out, dim=-2)
+
+
 def block_forward(self, x, resolution, shared_rel_pos_bias: Optional[torch.Tensor] = None):
     """
     Modification of timm.models.beit.py: Block.forward to support arbitrary window sizes.
@@ -148,6 +242,7 @@ def _make_beit_backbone(
         attn._get_rel_pos_bias = types.MethodType(_get_rel_pos_bias, attn)
         attn.forward = types.MethodType(attention_forward, attn)
         attn.relative_position_indices = {}
+        attn.relative_position_bias_cache = OrderedDict()
 
         block.forward = types.MethodType(block_forward, block)
 
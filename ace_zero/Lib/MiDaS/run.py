@@ -10,6 +10,8 @@ import time
 
 import numpy as np
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from imutils.video import VideoStream
 from midas.model_loader import default_models, load_model
 
@@ -102,8 +104,195 @@ def create_side_by_side(image, depth, grayscale):
         return np.concatenate((image, right_side), axis=1)
 
 
+def write_output(output_path, image_name, model_type, original_image_rgb, prediction, side, grayscale):
+    """
+    Write the depth map of an image as PNG (or RGB and depth side by side) and PFM.
+
+    Args:
+        output_path: the output folder
+        image_name: path of the input image
+        model_type: the type of the model, appended to the file name
+        original_image_rgb: the input image, RGB in [0, 1]
+        prediction: the depth map
+        side: RGB and depth side by side in output images?
+        grayscale: use a grayscale colormap?
+    """
+    filename = os.path.join(
+        output_path, os.path.splitext(os.path.basename(image_name))[0] + '-' + model_type
+    )
+    if not side:
+        utils.write_depth(filename, prediction, grayscale, bits=2)
+    else:
+        original_image_bgr = np.flip(original_image_rgb, 2)
+        content = create_side_by_side(original_image_bgr*255, prediction, grayscale)
+        cv2.imwrite(filename + ".png", content)
+    utils.write_pfm(filename + ".pfm", prediction.astype(np.float32))
+
+
+def load_image(image_name, transform):
+    """
+    Read an image and transform it into the network input.
+
+    Args:
+        image_name: path of the image
+        transform: the input transformation of the model
+
+    Returns:
+        the image name, the image (RGB in [0, 1]) and the network input
+    """
+    original_image_rgb = utils.read_image(image_name, np.float32)  # in [0, 1]
+    image = transform({"image": original_image_rgb})["image"]
+    return image_name, original_image_rgb, image
+
+
+def prefetch_images(image_names, transform, num_workers, prefetch):
+    """
+    Read and transform images in a thread pool, in input order.
+
+    Args:
+        image_names: paths of the images
+        transform: the input transformation of the model
+        num_workers: number of reader threads
+        prefetch: maximum number of images read ahead
+
+    Yields:
+        the image name, the image (RGB in [0, 1]) and the network input
+    """
+    with ThreadPoolExecutor(num_workers) as executor:
+        pending = deque()
+        for image_name in image_names:
+            pending.append(executor.submit(load_image, image_name, transform))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batch_by_size(samples, batch_size, max_buffered=None):
+    """
+    Group images into batches of equal input and output size.
+
+    Args:
+        samples: the image name, image and network input of each image
+        batch_size: maximum number of images per batch
+        max_buffered: maximum number of images held back in partial batches, the oldest partial batch is yielded
+            when there are more. None for no limit
+
+    Yields:
+        lists of samples, full batches as soon as they are complete, partial batches when too many images are
+        buffered and the remaining ones at the end
+    """
+    buckets = {}  # insertion ordered, the first bucket is the oldest
+    num_buffered = 0
+    for sample in samples:
+        key = (sample[1].shape, sample[2].shape)
+        bucket = buckets.setdefault(key, [])
+        bucket.append(sample)
+        num_buffered += 1
+        if len(bucket) == batch_size:
+            num_buffered -= batch_size
+            yield buckets.pop(key)
+        elif max_buffered is not None and num_buffered > max_buffered:
+            oldest = buckets.pop(next(iter(buckets)))
+            num_buffered -= len(oldest)
+            yield oldest
+    yield from buckets.values()
+
+
+def process_batch(device, model, images, target_size, optimize):
+    """
+    Run the inference on a batch of images of equal size and interpolate.
+
+    Args:
+        device (torch.device): the torch device used
+        model: the model used for inference
+        images: the images fed into the neural network
+        target_size: the size (width, height) the neural network output is interpolated to
+        optimize: optimize the model to half-floats on CUDA?
+
+    Returns:
+        the predictions
+    """
+    sample = torch.from_numpy(np.stack(images)).to(device)
+
+    if optimize and device == torch.device("cuda"):
+        sample = sample.to(memory_format=torch.channels_last)
+        sample = sample.half()
+
+    prediction = model.forward(sample)
+    prediction = (
+        torch.nn.functional.interpolate(
+            prediction.unsqueeze(1),
+            size=target_size[::-1],
+            mode="bicubic",
+            align_corners=False,
+        )
+        .squeeze(1)
+        .float()
+        .cpu()
+        .numpy()
+    )
+
+    return list(prediction)
+
+
+def run_batched(device, model, model_type, transform, image_names, output_path, optimize, side, grayscale,
+                batch_size, num_workers):
+    """
+    Compute depth maps for a list of images in batches. Images are read and transformed by a thread pool ahead of
+    the inference, and outputs are written by background threads.
+
+    Args:
+        device (torch.device): the torch device used
+        model: the model used for inference
+        model_type: the type of the model
+        transform: the input transformation of the model
+        image_names: paths of the input images
+        output_path: the output folder, or None to not store the depth maps
+        optimize: optimize the model to half-floats on CUDA?
+        side: RGB and depth side by side in output images?
+        grayscale: use a grayscale colormap?
+        batch_size: maximum number of images per batch, only images of equal size are batched
+        num_workers: number of reader threads and of writer threads
+    """
+    num_images = len(image_names)
+    num_done = 0
+    time_start = time.time()
+
+    samples = prefetch_images(image_names, transform, num_workers, 2 * batch_size)
+
+    with ThreadPoolExecutor(num_workers) as writer:
+        pending_writes = deque()
+
+        for batch in batch_by_size(samples, batch_size, max_buffered=batch_size * num_workers):
+            names, originals, images = zip(*batch)
+
+            with torch.no_grad():
+                predictions = process_batch(device, model, images, originals[0].shape[1::-1], optimize)
+
+            if output_path is not None:
+                for image_name, original_image_rgb, prediction in zip(names, originals, predictions):
+                    pending_writes.append(writer.submit(write_output, output_path, image_name, model_type,
+                                                        original_image_rgb, prediction, side, grayscale))
+
+                # bound the number of depth maps waiting to be written
+                while len(pending_writes) > 2 * batch_size:
+                    pending_writes.popleft().result()
+
+            num_done += len(batch)
+            print("  Processed {}/{} images ({:.2f} images/sec)".format(
+                num_done, num_images, num_done / (time.time() - time_start)))
+
+        while pending_writes:
+            pending_writes.popleft().result()
+
+    time_total = time.time() - time_start
+    print("Processed {} images in {:.2f}s ({:.2f} images/sec)".format(
+        num_images, time_total, num_images / max(time_total, 1e-9)))
+
+
 def run(input_path, output_path, model_path, model_type="dpt_beit_large_512", optimize=False, side=False, height=None,
-        square=False, grayscale=False):
+        square=False, grayscale=False, batch_size=1, num_workers=4):
     """Run MonoDepthNN to compute depth maps.
 
     Args:
@@ -116,6 +305,8 @@ def run(input_path, output_path, model_path, model_type="dpt_beit_large_512", op
         height (int): inference encoder image height
         square (bool): resize to a square resolution?
         grayscale (bool): use a grayscale colormap?
+        batch_size (int): number of images of equal size processed at once (folder input only)
+        num_workers (int): number of reader and writer threads if batch_size > 1
     """
     print("Initialize")
 
@@ -141,6 +332,11 @@ def run(input_path, output_path, model_path, model_type="dpt_beit_large_512", op
     if input_path is not None:
         if output_path is None:
             print("Warning: No output path specified. Images will be processed but not shown or stored anywhere.")
+
+    if input_path is not None and batch_size > 1 and "openvino" not in model_type:
+        run_batched(device, model, model_type, transform, image_names, output_path, optimize, side, grayscale,
+                    batch_size, num_workers)
+    elif input_path is not None:
         for index, image_name in enumerate(image_names):
 
             print("  Processing {} ({}/{})".format(image_name, index + 1, num_images))
@@ -156,16 +352,7 @@ def run(input_path, output_path, model_path, model_type="dpt_beit_large_512", op
 
             # output
             if output_path is not None:
-                filename = os.path.join(
-                    output_path, os.path.splitext(os.path.basename(image_name))[0] + '-' + model_type
-                )
-                if not side:
-                    utils.write_depth(filename, prediction, grayscale, bits=2)
-                else:
-                    original_image_bgr = np.flip(original_image_rgb, 2)
-                    content = create_side_by_side(original_image_bgr*255, prediction, grayscale)
-                    cv2.imwrite(filename + ".png", content)
-                utils.write_pfm(filename + ".pfm", prediction.astype(np.float32))
+                write_output(output_path, image_name, model_type, original_image_rgb, prediction, side, grayscale)
 
     else:
         with torch.no_grad():
@@ -262,6 +449,16 @@ if __name__ == "__main__":
                              'colormap.'
                         )
 
+    parser.add_argument('--batch_size',
+                        type=int, default=1,
+                        help='Number of images processed at once. Only images of equal size are batched. With a batch '
+                             'size larger than 1, images are read ahead and outputs are written by background threads.'
+                        )
+    parser.add_argument('--num_workers',
+                        type=int, default=4,
+                        help='Number of threads reading and writing images if the batch size is larger than 1'
+                        )
+
     args = parser.parse_args()
 
 
@@ -274,4 +471,4 @@ if __name__ == "__main__":
 
     # compute depth maps
     run(args.input_path, args.output_path, args.model_weights, args.model_type, args.optimize, args.side, args.height,
-        args.square, args.grayscale)
+        args.square, args.grayscale, args.batch_size, args.num_workers)
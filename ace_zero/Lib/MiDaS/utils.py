@@ -95,11 +95,12 @@ def write_pfm(path, image, scale=1):
         image.tofile(file)
 
 
-def read_image(path):
+def read_image(path, dtype=np.float64):
     """Read image and output RGB image (0-1).
 
     Args:
         path (str): path to file
+        dtype (type): floating point type of the output
 
     Returns:
         array: RGB image (0-1)
@@ -109,7 +110,7 @@ def read_image(path):
     if img.ndim == 2:
         img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
 
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB) / 255.0
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(dtype) / 255.0
 
     return img
 
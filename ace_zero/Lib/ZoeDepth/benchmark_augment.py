@@ -0,0 +1,97 @@
+# MIT License
+
+# Copyright (c) 2022 Intelligent Systems Lab Org
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Benchmark the training augmentation of DataLoadPreprocess, legacy float path against the fused uint8 path.
+
+Both paths get the same samples and random seeds. Throughput is measured in a single process, which is what every
+DataLoader worker sees. Samples are NYU sized synthetic images unless a glob of RGB and depth images is given.
+"""
+
+import argparse
+import glob
+import random
+import time
+
+import numpy as np
+from PIL import Image
+
+from zoedepth.data.data_mono import DataLoadPreprocess
+from zoedepth.utils.easydict import EasyDict as edict
+
+
+def make_dataset(fused_aug, dataset="nyu", do_random_rotate=True, random_crop=False, random_translate=False,
+                 input_height=480, input_width=640):
+    """DataLoadPreprocess with just the config the augmentation needs, no file list is read."""
+    ds = DataLoadPreprocess.__new__(DataLoadPreprocess)
+    ds.config = edict(fused_aug=fused_aug, dataset=dataset, aug=True, do_random_rotate=do_random_rotate, degree=2.5,
+                      random_crop=random_crop, random_translate=random_translate, translate_prob=0.2,
+                      max_translation=100, input_height=input_height, input_width=input_width)
+    return ds
+
+
+def benchmark(ds, samples, num_iters, seed=0):
+    """Run the augmentation of ds on the samples and return samples/sec and the outputs of the first pass."""
+    random.seed(seed)
+    np.random.seed(seed)
+    outputs = []
+    augment = ds.train_augment_fused if ds.config.fused_aug else ds.train_augment
+    start = time.time()
+    for i in range(num_iters):
+        image, depth = samples[i % len(samples)]
+        out = augment(image, depth)
+        if i < len(samples):
+            outputs.append(out)
+    return num_iters / (time.time() - start), outputs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=str, default=None, help="glob of RGB images")
+    parser.add_argument("--depths", type=str, default=None, help="glob of the matching depth images")
+    parser.add_argument("-n", "--num_iters", type=int, default=200, help="number of augmented samples")
+    parser.add_argument("--random_crop", action="store_true", help="crop to input_height x input_width")
+    parser.add_argument("--random_translate", action="store_true", help="enable random translation")
+    parser.add_argument("--no_rotate", action="store_true", help="disable random rotation")
+    args = parser.parse_args()
+
+    if args.images is not None:
+        samples = [(Image.open(i).convert("RGB"), Image.open(d))
+                   for i, d in zip(sorted(glob.glob(args.images)), sorted(glob.glob(args.depths)))]
+    else:
+        rng = np.random.default_rng(0)
+        samples = [(Image.fromarray(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)),
+                    Image.fromarray(rng.integers(0, 10000, (480, 640), dtype=np.uint16))) for _ in range(8)]
+    for image, depth in samples:
+        image.load()
+        depth.load()
+
+    kwargs = dict(do_random_rotate=not args.no_rotate, random_crop=args.random_crop,
+                  random_translate=args.random_translate, input_height=416, input_width=544)
+    legacy_rate, legacy_out = benchmark(make_dataset(False, **kwargs), samples, args.num_iters)
+    fused_rate, fused_out = benchmark(make_dataset(True, **kwargs), samples, args.num_iters)
+
+    image_diff = max(np.abs(a[0] - b[0]).mean() for a, b in zip(legacy_out, fused_out))
+    depth_diff = max(np.mean(a[1] != b[1]) for a, b in zip(legacy_out, fused_out))
+    print(f"legacy: {legacy_rate:.1f} samples/sec per worker")
+    print(f"fused:  {fused_rate:.1f} samples/sec per worker ({fused_rate / legacy_rate:.2f}x)")
+    print(f"max mean abs image difference {image_diff:.2e}, max fraction of differing depth pixels {depth_diff:.2e}")
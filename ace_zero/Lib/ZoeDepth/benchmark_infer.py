@@ -0,0 +1,120 @@
+# MIT License
+
+# Copyright (c) 2022 Intelligent Systems Lab Org
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Measure the accuracy / latency trade-off of the inference tiers on a local set of images.
+
+Every tier in DepthModel INFER_MODES is run on the same images. The latency is the mean time per image after
+warm-up. The accuracy is the agreement with the "accurate" tier (padding + flip augmentation), which is the
+reference because ground truth is usually not available for local images.
+"""
+
+import argparse
+import glob
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from zoedepth.models.builder import build_model
+from zoedepth.models.depth_model import INFER_MODES
+from zoedepth.utils.config import get_config
+
+
+def sync(device):
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+
+@torch.no_grad()
+def benchmark_modes(model, images, device, modes=tuple(INFER_MODES.keys()), num_warmup=1):
+    """
+    Run every inference tier on a set of images
+    Args:
+        model (DepthModel): depth model in eval mode
+        images (list): list of PIL images
+        device (str): device of the model
+        modes (tuple, optional): tiers to compare, the first one is the reference. Defaults to all tiers.
+        num_warmup (int, optional): number of untimed forwards per tier. Defaults to 1.
+    Returns:
+        dict: mode -> dict of ms_per_image, speedup, abs_rel, rmse and delta1 with respect to the reference tier
+    """
+    inputs = [transforms.ToTensor()(img).unsqueeze(0).to(device) for img in images]
+
+    preds = {}
+    times = {}
+    for mode in modes:
+        for x in inputs[:num_warmup]:
+            model.infer(x, mode=mode)
+
+        preds[mode] = []
+        elapsed = 0
+        for x in inputs:
+            sync(device)
+            start = time.time()
+            pred = model.infer(x, mode=mode)
+            sync(device)
+            elapsed += time.time() - start
+            preds[mode].append(pred.squeeze().cpu().numpy())
+        times[mode] = 1000 * elapsed / len(inputs)
+
+    reference = modes[0]
+    report = {}
+    for mode in modes:
+        abs_rel, rmse, delta1 = [], [], []
+        for pred, ref in zip(preds[mode], preds[reference]):
+            valid = ref > 0
+            pred, ref = pred[valid], ref[valid]
+            abs_rel.append(np.mean(np.abs(pred - ref) / ref))
+            rmse.append(np.sqrt(np.mean((pred - ref) ** 2)))
+            delta1.append(np.mean(np.maximum(pred / ref, ref / pred) < 1.25))
+        report[mode] = dict(ms_per_image=times[mode], speedup=times[reference] / times[mode],
+                            abs_rel=float(np.mean(abs_rel)), rmse=float(np.mean(rmse)), delta1=float(np.mean(delta1)))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-i", "--images", type=str, required=True, help="glob of RGB images, e.g. 'frames/*.png'")
+    parser.add_argument("-m", "--model", type=str, default="zoedepth", help="name of the model: zoedepth or zoedepth_nk")
+    parser.add_argument("--pretrained_resource", type=str, default=None,
+                        help="pretrained resource to load, defaults to the one of the model config")
+    parser.add_argument("-n", "--num_images", type=int, default=20, help="maximum number of images to use")
+    args = parser.parse_args()
+
+    overwrite = {} if args.pretrained_resource is None else {"pretrained_resource": args.pretrained_resource}
+    config = get_config(args.model, "infer", **overwrite)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = build_model(config).to(device)
+    model.eval()
+
+    image_paths = sorted(glob.glob(args.images))[:args.num_images]
+    images = [Image.open(image_path).convert("RGB") for image_path in image_paths]
+
+    report = benchmark_modes(model, images, device)
+
+    print(f"{len(images)} images on {device}, accuracy is measured against the 'accurate' tier")
+    print(f"{'mode':<10} {'ms/image':>10} {'speedup':>8} {'abs_rel':>8} {'rmse':>8} {'delta1':>8}")
+    for mode, r in report.items():
+        print(f"{mode:<10} {r['ms_per_image']:>10.1f} {r['speedup']:>7.2f}x {r['abs_rel']:>8.4f} {r['rmse']:>8.4f} {r['delta1']:>8.4f}")
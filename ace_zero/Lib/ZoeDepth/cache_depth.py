@@ -0,0 +1,87 @@
+# MIT License
+
+# Copyright (c) 2022 Intelligent Systems Lab Org
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Fill the depth cache for a set of RGB images.
+
+Images whose depth map is cached already (same content, model, model input size and inference settings) are
+skipped, so the cache can be filled incrementally. Use the same cache directory and model with
+DepthModel.infer_pil(..., cache=DepthCache(...)) to read the depth maps.
+"""
+
+import argparse
+import glob
+import time
+
+import torch
+from PIL import Image
+
+from zoedepth.models.builder import build_model
+from zoedepth.utils.config import get_config
+from zoedepth.utils.depth_cache import DepthCache
+
+
+def fill_cache(image_paths, cache, model, pad_input, with_flip_aug):
+    num_cached = 0
+    num_computed = 0
+    start = time.time()
+
+    for i, image_path in enumerate(image_paths):
+        img = Image.open(image_path).convert("RGB")
+        key = model.get_cache_key(cache, img, pad_input, with_flip_aug)
+
+        if key in cache:
+            num_cached += 1
+            continue
+
+        cache.put(key, model.infer_pil(img, pad_input=pad_input, with_flip_aug=with_flip_aug))
+        num_computed += 1
+        print(f"[{i + 1}/{len(image_paths)}] {image_path} ({num_computed / (time.time() - start):.2f} images/sec)")
+
+    print(f"Done: {num_computed} computed, {num_cached} already cached, {time.time() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-i", "--images", type=str, required=True, help="glob of RGB images, e.g. 'frames/*.png'")
+    parser.add_argument("-c", "--cache_dir", type=str, required=True, help="directory of the depth cache")
+    parser.add_argument("-m", "--model", type=str, default="zoedepth", help="name of the model: zoedepth or zoedepth_nk")
+    parser.add_argument("--pretrained_resource", type=str, default=None,
+                        help="pretrained resource to load, defaults to the one of the model config")
+    parser.add_argument("--max_gb", type=float, default=None, help="maximum size of the cache, LRU entries are evicted")
+    parser.add_argument("--no_pad", action="store_true", help="disable padding augmentation")
+    parser.add_argument("--no_flip", action="store_true", help="disable flip augmentation")
+    args = parser.parse_args()
+
+    overwrite = {} if args.pretrained_resource is None else {"pretrained_resource": args.pretrained_resource}
+    config = get_config(args.model, "infer", **overwrite)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = build_model(config).to(device)
+    model.eval()
+
+    # depth maps of different weights must not share cache entries
+    model_type = f"{args.model}:{config.get('pretrained_resource', '')}"
+    max_bytes = None if args.max_gb is None else int(args.max_gb * 1024 ** 3)
+    cache = DepthCache(args.cache_dir, model_type, max_bytes)
+
+    image_paths = sorted(glob.glob(args.images))
+    fill_cache(image_paths, cache, model, not args.no_pad, not args.no_flip)
@@ -33,13 +33,16 @@ from zoedepth.data.data_mono import DepthDataLoader
 from zoedepth.models.builder import build_model
 from zoedepth.utils.arg_utils import parse_unknown
 from zoedepth.utils.config import change_dataset, get_config, ALL_EVAL_DATASETS, ALL_INDOOR, ALL_OUTDOOR
-from zoedepth.utils.misc import (RunningAverageDict, colors, compute_metrics,
-                        count_parameters)
+from zoedepth.utils.misc import (DepthMetrics, colors, count_parameters)
 
 
 @torch.no_grad()
-def infer(model, images, **kwargs):
-    """Inference with flip augmentation"""
+def infer(model, images, batch_flip=False, **kwargs):
+    """Inference with flip augmentation
+
+    With batch_flip the images and their flipped copies are run as one batch, so the model is called once. Faster, but
+    needs twice the activation memory.
+    """
     # images.shape = N, C, H, W
     def get_depth_from_prediction(pred):
         if isinstance(pred, torch.Tensor):
@@ -52,11 +55,15 @@ def infer(model, images, **kwargs):
             raise NotImplementedError(f"Unknown output type {type(pred)}")
         return pred
 
-    pred1 = model(images, **kwargs)
-    pred1 = get_depth_from_prediction(pred1)
+    if batch_flip:
+        pred = model(torch.cat([images, torch.flip(images, [3])]), **kwargs)
+        pred1, pred2 = get_depth_from_prediction(pred).chunk(2)
+    else:
+        pred1 = model(images, **kwargs)
+        pred1 = get_depth_from_prediction(pred1)
 
-    pred2 = model(torch.flip(images, [3]), **kwargs)
-    pred2 = get_depth_from_prediction(pred2)
+        pred2 = model(torch.flip(images, [3]), **kwargs)
+        pred2 = get_depth_from_prediction(pred2)
     pred2 = torch.flip(pred2, [3])
 
     mean_pred = 0.5 * (pred1 + pred2)
@@ -67,7 +74,7 @@ def infer(model, images, **kwargs):
 @torch.no_grad()
 def evaluate(model, test_loader, config, round_vals=True, round_precision=3):
     model.eval()
-    metrics = RunningAverageDict()
+    metrics = DepthMetrics()
     for i, sample in tqdm(enumerate(test_loader), total=len(test_loader)):
         if 'has_valid_depth' in sample:
             if not sample['has_valid_depth']:
@@ -77,7 +84,7 @@ def evaluate(model, test_loader, config, round_vals=True, round_precision=3):
         depth = depth.squeeze().unsqueeze(0).unsqueeze(0)
         focal = sample.get('focal', torch.Tensor(
             [715.0873]).cuda())  # This magic number (focal) is only used for evaluating BTS model
-        pred = infer(model, image, dataset=sample['dataset'][0], focal=focal)
+        pred = infer(model, image, batch_flip=config.get("batch_flip", False), dataset=sample['dataset'][0], focal=focal)
 
         # Save image, depth, pred for visualization
         if "save_images" in config and config.save_images:
@@ -99,7 +106,7 @@ def evaluate(model, test_loader, config, round_vals=True, round_precision=3):
 
 
         # print(depth.shape, pred.shape)
-        metrics.update(compute_metrics(depth, pred, config=config))
+        metrics.update(depth, pred, config=config)
 
     if round_vals:
         def r(m): return round(m, round_precision)
@@ -140,9 +147,13 @@ if __name__ == '__main__':
                         required=False, default=None, help="Pretrained resource to use for fetching weights. If not set, default resource from model config is used,  Refer models.model_io.load_state_from_resource for more details.")
     parser.add_argument("-d", "--dataset", type=str, required=False,
                         default='nyu', help="Dataset to evaluate on")
+    parser.add_argument("--batch_flip", action="store_true",
+                        help="run images and their flipped copies as one batch, faster but needs twice the activation memory")
 
     args, unknown_args = parser.parse_known_args()
     overwrite_kwargs = parse_unknown(unknown_args)
+    if args.batch_flip:
+        overwrite_kwargs["batch_flip"] = True
 
     if "ALL_INDOOR" in args.dataset:
         datasets = ALL_INDOOR
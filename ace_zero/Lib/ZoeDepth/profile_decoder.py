@@ -0,0 +1,110 @@
+# MIT License
+
+# Copyright (c) 2022 Intelligent Systems Lab Org
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Profile the stages of ZoeDepth.forward and ZoeDepthNK.forward.
+
+The stages are labelled with torch.profiler.record_function in the forward of the models: the MiDaS core, the seed bin
+regressor, every attractor layer, the relative depth conditioning (ZoeDepth), the domain classifier (ZoeDepthNK), the
+conditional log binomial and the final depth.
+The report lists the mean time per forward and the share of every stage.
+"""
+
+import argparse
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+from zoedepth.models.builder import build_model
+from zoedepth.utils.config import get_config
+
+
+@torch.no_grad()
+def profile_stages(model, x, num_iters=5, num_warmup=2):
+    """
+    Profile the labelled stages of a forward pass
+    Args:
+        model (ZoeDepth or ZoeDepthNK): model in eval mode
+        x (torch.Tensor): input of shape (b, 3, h, w)
+        num_iters (int, optional): number of profiled forwards. Defaults to 5.
+        num_warmup (int, optional): number of forwards before profiling. Defaults to 2.
+    Returns:
+        dict: stage -> mean milliseconds per forward, on the GPU if the model is on it, on the CPU otherwise
+    """
+    for _ in range(num_warmup):
+        model(x)
+
+    use_cuda = x.is_cuda
+    activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if use_cuda else [])
+    with profile(activities=activities) as prof:
+        for _ in range(num_iters):
+            model(x)
+        if use_cuda:
+            torch.cuda.synchronize()
+
+    report = {}
+    for event in prof.key_averages():
+        if event.key.startswith("zoedepth::"):
+            if use_cuda:
+                # device_time_total replaced cuda_time_total in newer torch releases
+                total_us = getattr(event, "device_time_total", None)
+                if total_us is None:
+                    total_us = event.cuda_time_total
+            else:
+                total_us = event.cpu_time_total
+            report[event.key[len("zoedepth::"):]] = total_us / 1000 / num_iters
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-m", "--model", type=str, default="zoedepth", help="name of the model")
+    parser.add_argument("--pretrained_resource", type=str, default=None,
+                        help="pretrained resource to load, defaults to the one of the model config")
+    parser.add_argument("--random_weights", action="store_true",
+                        help="do not load any weights, the timings do not depend on them")
+    parser.add_argument("--height", type=int, default=384, help="input height")
+    parser.add_argument("--width", type=int, default=512, help="input width")
+    parser.add_argument("-b", "--batch_size", type=int, default=1, help="batch size")
+    parser.add_argument("-n", "--num_iters", type=int, default=5, help="number of profiled forwards")
+    args = parser.parse_args()
+
+    overwrite = {} if args.pretrained_resource is None else {"pretrained_resource": args.pretrained_resource}
+    if args.random_weights:
+        overwrite = {"pretrained_resource": "", "use_pretrained_midas": False}
+    config = get_config(args.model, "infer", **overwrite)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = build_model(config).to(device)
+    model.eval()
+
+    x = torch.rand(args.batch_size, 3, args.height, args.width, device=device)
+    report = profile_stages(model, x, args.num_iters)
+
+    if not report:
+        raise SystemExit(f"{args.model} has no labelled stages, only ZoeDepth and ZoeDepthNK are supported")
+    total = sum(report.values())
+    print(f"{args.model} on {device}, input {args.batch_size}x3x{args.height}x{args.width}")
+    print(f"{'stage':<14} {'ms':>10} {'share':>7}")
+    for stage, ms in report.items():
+        print(f"{stage:<14} {ms:>10.2f} {100 * ms / total:>6.1f}%")
+    print(f"{'total':<14} {total:>10.2f}")
@@ -0,0 +1,116 @@
+# MIT License
+
+# Copyright (c) 2022 Intelligent Systems Lab Org
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""uint8 native building blocks of the fused training augmentation, see DataLoadPreprocess.train_augment_fused."""
+
+import cv2
+import numpy as np
+
+_identity_lut = np.tile(np.arange(256, dtype=np.float32) / 255.0, (3, 1))
+
+
+def color_lut(gamma=1.0, brightness=1.0, colors=(1.0, 1.0, 1.0)):
+    """Per channel lookup table of the gamma, brightness and color augmentation.
+
+    Computes the same values as DataLoadPreprocess.augment_image for all 256 input levels: clip(((v / 255) ** gamma) * brightness * colors[c], 0, 1).
+
+    Args:
+        gamma (float, optional): gamma. Defaults to 1.0.
+        brightness (float, optional): brightness factor. Defaults to 1.0.
+        colors (tuple, optional): per channel factors. Defaults to (1.0, 1.0, 1.0).
+
+    Returns:
+        np.ndarray - shape(3, 256): float32 table
+    """
+    if gamma == 1.0 and brightness == 1.0 and tuple(colors) == (1.0, 1.0, 1.0):
+        return _identity_lut
+    levels = np.arange(256, dtype=np.float32) / 255.0
+    levels = (levels ** gamma) * brightness
+    lut = levels[None, :] * np.asarray(colors, dtype=np.float64)[:, None]
+    return np.clip(lut, 0, 1).astype(np.float32)
+
+
+def apply_lut(image, lut):
+    """Convert a uint8 image to float32 through a per channel lookup table.
+
+    Args:
+        image (np.ndarray - shape(H, W, 3)): uint8 image
+        lut (np.ndarray - shape(3, 256)): float32 table, see color_lut
+
+    Returns:
+        np.ndarray - shape(H, W, 3): float32 image
+    """
+    out = np.empty(image.shape, dtype=np.float32)
+    for c in range(image.shape[2]):
+        np.take(lut[c], image[..., c], out=out[..., c])
+    return out
+
+
+def rotation_matrix(angle, width, height):
+    """3x3 rotation by angle degrees (counter clockwise) around the image center, like PIL.Image.rotate."""
+    M = np.eye(3)
+    M[:2] = cv2.getRotationMatrix2D(((width - 1) / 2, (height - 1) / 2), angle, 1.0)
+    return M
+
+
+def translation_matrix(x, y):
+    """3x3 translation of the image content by (x, y) pixels."""
+    M = np.eye(3)
+    M[0, 2] = x
+    M[1, 2] = y
+    return M
+
+
+def hflip_matrix(width):
+    """3x3 horizontal flip of an image of the given width."""
+    M = np.eye(3)
+    M[0, 0] = -1
+    M[0, 2] = width - 1
+    return M
+
+
+def warp(image, M, size, interpolation):
+    """Apply a 3x3 affine matrix with zero borders, or crop if it is an integer translation.
+
+    Args:
+        image (np.ndarray): image of shape (h, w) or (h, w, c)
+        M (np.ndarray): 3x3 affine matrix, mapping input to output pixels
+        size (tuple): output (width, height)
+        interpolation (int): cv2 interpolation flag, used for non integer transforms
+
+    Returns:
+        np.ndarray: warped image of shape (height, width) or (height, width, c)
+    """
+    width, height = size
+    if np.array_equal(M[:2, :2], np.eye(2)) and np.all(np.mod(M[:2, 2], 1) == 0):
+        x, y = int(-M[0, 2]), int(-M[1, 2])
+        if 0 <= x and x + width <= image.shape[1] and 0 <= y and y + height <= image.shape[0]:
+            # plain crop, no copy
+            return image[y:y + height, x:x + width]
+        interpolation = cv2.INTER_NEAREST
+
+    out = cv2.warpAffine(image, M[:2], (width, height), flags=interpolation,
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    if image.ndim == 3 and out.ndim == 2:
+        out = out[..., None]  # affine warp removes single channel dims
+    return out
@@ -0,0 +1,114 @@
+# MIT License
+
+# Copyright (c) 2022 Intelligent Systems Lab Org
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Batched rotation, flip and color augmentation of training batches on the training device."""
+
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugment:
+    """Rotation, horizontal flip and gamma / brightness / color augmentation of a whole batch at once.
+
+    Used with config.gpu_aug: the DataLoader workers only crop and translate (DataLoadPreprocess.train_augment_fused with
+    deferred=True) and deliver uint8 images, which are augmented here on the device of the batch. The augmentation of
+    every sample is drawn from its own generator seeded with the sample's 'aug_seed', so it does not depend on the
+    batch composition or the device. The distributions are those of DataLoadPreprocess.train_augment.
+
+    Rotation is applied to the crop instead of the full image, so rotated crops have black corners.
+    """
+
+    def __init__(self, config):
+        self.aug = config.aug
+        self.do_random_rotate = config.do_random_rotate
+        self.degree = config.degree
+        self.min_depth = config.min_depth
+        self.max_depth = config.max_depth
+
+    def sample_params(self, seeds, datasets):
+        """Per sample augmentation parameters.
+
+        Args:
+            seeds (torch.Tensor - shape(B,)): per sample seeds
+            datasets (list): per sample dataset names, the brightness range of 'nyu' is wider
+
+        Returns:
+            dict: angle (degrees), flip, gamma, brightness and colors (B, 3) tensors on the cpu. Samples without color augmentation get factors of 1
+        """
+        u = torch.stack([torch.rand(8, generator=torch.Generator().manual_seed(int(seed)), dtype=torch.float64)
+                         for seed in seeds])
+        do_color = u[:, 2] > 0.5
+        brightness_range = torch.tensor([0.25 if dataset == 'nyu' else 0.1 for dataset in datasets], dtype=torch.float64)
+        ones = torch.ones_like(u[:, 0])
+        return dict(
+            angle=(u[:, 0] - 0.5) * 2 * self.degree,
+            flip=u[:, 1] > 0.5,
+            gamma=torch.where(do_color, 0.9 + 0.2 * u[:, 3], ones),
+            brightness=torch.where(do_color, 1 - brightness_range + 2 * brightness_range * u[:, 4], ones),
+            colors=torch.where(do_color[:, None], 0.9 + 0.2 * u[:, 5:8], torch.ones_like(u[:, 5:8])),
+        )
+
+    @staticmethod
+    def rotation_grid(angle, height, width, device):
+        """Sampling grid of a rotation by angle degrees (counter clockwise) around the image center, see PIL.Image.rotate."""
+        a = angle * (math.pi / 180)
+        c, s = torch.cos(a), torch.sin(a)
+        zeros = torch.zeros_like(c)
+        # output to input pixels in normalized coordinates, corrected for the aspect ratio
+        theta = torch.stack([torch.stack([c, -s * height / width, zeros], -1),
+                             torch.stack([s * width / height, c, zeros], -1)], 1)
+        return F.affine_grid(theta.float().to(device), (len(angle), 1, height, width), align_corners=False)
+
+    def __call__(self, image, depth, seeds, datasets):
+        """
+        Args:
+            image (torch.Tensor - shape(B, 3, H, W)): uint8 images
+            depth (torch.Tensor - shape(B, 1, H, W)): depth in meters
+            seeds (torch.Tensor - shape(B,)): per sample seeds
+            datasets (list): per sample dataset names
+
+        Returns:
+            tuple(torch.Tensor, torch.Tensor, torch.Tensor): float images in [0, 1], depth and valid depth mask, all (B, c, H, W)
+        """
+        image = image.float() / 255.0
+        if self.aug:
+            params = {k: v.to(image.device) for k, v in self.sample_params(seeds, datasets).items()}
+            b, _, h, w = image.shape
+
+            if self.do_random_rotate:
+                grid = self.rotation_grid(params['angle'], h, w, image.device)
+                image = F.grid_sample(image, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+                depth = F.grid_sample(depth, grid, mode='nearest', padding_mode='zeros', align_corners=False)
+
+            flip = params['flip'].view(b, 1, 1, 1)
+            image = torch.where(flip, image.flip(-1), image)
+            depth = torch.where(flip, depth.flip(-1), depth)
+
+            scale = (params['brightness'][:, None] * params['colors']).view(b, 3, 1, 1).to(image.dtype)
+            image = (image ** params['gamma'].view(b, 1, 1, 1).to(image.dtype)) * scale
+            image = image.clamp(0, 1)
+
+        mask = torch.logical_and(depth > self.min_depth, depth < self.max_depth)
+        return image, depth, mask
@@ -50,6 +50,8 @@ from .sun_rgbd_loader import get_sunrgbd_loader
 from .vkitti import get_vkitti_loader
 from .vkitti2 import get_vkitti2_loader
 
+from .augment import apply_lut, color_lut, hflip_matrix, rotation_matrix, translation_matrix, warp
+from .image_cache import SharedImageCache
 from .preprocess import CropParams, get_white_border, get_black_border
 
 
@@ -67,6 +69,22 @@ def preprocessing_transforms(mode, **kwargs):
     ])
 
 
+class DistributedEvalSampler(torch.utils.data.distributed.DistributedSampler):
+    """Shards a dataset over the processes without padding, so that every sample is evaluated exactly once.
+
+    DistributedSampler repeats samples to give all processes the same number of them, which would bias the metrics.
+    Here the shards differ in length by at most one sample.
+    """
+
+    def __init__(self, dataset, **kwargs):
+        super().__init__(dataset, shuffle=False, **kwargs)
+        self.num_samples = len(range(self.rank, len(self.dataset), self.num_replicas))
+        self.total_size = len(self.dataset)
+
+    def __iter__(self):
+        return iter(range(self.rank, len(self.dataset), self.num_replicas))
+
+
 class DepthDataLoader(object):
     def __init__(self, config, mode, device='cpu', transform=None, **kwargs):
         """
@@ -156,9 +174,9 @@ class DepthDataLoader(object):
         elif mode == 'online_eval':
             self.testing_samples = DataLoadPreprocess(
                 config, mode, transform=transform)
-            if config.distributed:  # redundant. here only for readability and to be more explicit
-                # Give whole test set to all processes (and report evaluation only on one) regardless
-                self.eval_sampler = None
+            if config.distributed:
+                # every process evaluates its shard, the trainer all-reduces the metric statistics
+                self.eval_sampler = DistributedEvalSampler(self.testing_samples)
             else:
                 self.eval_sampler = None
             self.data = DataLoader(self.testing_samples, 1,
@@ -245,13 +263,22 @@ def remove_leading_slash(s):
 
 
 class CachedReader:
-    def __init__(self, shared_dict=None):
+    def __init__(self, shared_dict=None, image_cache=None):
+        """
+        Args:
+            shared_dict (dict, optional): cache of opened images shared by the workers. Defaults to None (per process dict).
+            image_cache (SharedImageCache, optional): bounded cache of decoded images in shared memory. Used instead of the dict if given. Defaults to None.
+        """
+        self.image_cache = image_cache
         if shared_dict:
             self._cache = shared_dict
         else:
             self._cache = {}
 
     def open(self, fpath):
+        if self.image_cache is not None:
+            return self.image_cache.open(fpath)
+
         im = self._cache.get(fpath, None)
         if im is None:
             im = self._cache[fpath] = Image.open(fpath)
@@ -281,7 +308,12 @@ class DataLoadPreprocess(Dataset):
         self.transform = transform
         self.to_tensor = ToTensor(mode)
         self.is_for_online_eval = is_for_online_eval
-        if config.use_shared_dict:
+        image_cache_gb = config.get("image_cache_gb", 0)
+        if mode == 'train' and image_cache_gb > 0:
+            image_cache = SharedImageCache(int(image_cache_gb * 1024 ** 3),
+                                           int(config.get("image_cache_slot_mb", 2) * 1024 ** 2))
+            self.reader = CachedReader(image_cache=image_cache)
+        elif config.use_shared_dict:
             self.reader = CachedReader(config.shared_dict)
         else:
             self.reader = ImReader()
@@ -340,30 +372,14 @@ class DataLoadPreprocess(Dataset):
                 depth_gt = Image.fromarray(depth_gt)
 
 
-            if self.config.do_random_rotate and (self.config.aug):
-                random_angle = (random.random() - 0.5) * 2 * self.config.degree
-                image = self.rotate_image(image, random_angle)
-                depth_gt = self.rotate_image(
-                    depth_gt, random_angle, flag=Image.NEAREST)
-
-            image = np.asarray(image, dtype=np.float32) / 255.0
-            depth_gt = np.asarray(depth_gt, dtype=np.float32)
-            depth_gt = np.expand_dims(depth_gt, axis=2)
-
-            if self.config.dataset == 'nyu':
-                depth_gt = depth_gt / 1000.0
+            if self.config.get("gpu_aug", False):
+                image, depth_gt = self.train_augment_fused(image, depth_gt, deferred=True)
+                # seeds the augmentation of this sample in BatchAugment
+                sample['aug_seed'] = random.getrandbits(31)
+            elif self.config.get("fused_aug", False):
+                image, depth_gt = self.train_augment_fused(image, depth_gt)
             else:
-                depth_gt = depth_gt / 256.0
-
-            if self.config.aug and (self.config.random_crop):
-                image, depth_gt = self.random_crop(
-                    image, depth_gt, self.config.input_height, self.config.input_width)
-            
-            if self.config.aug and self.config.random_translate:
-                # print("Random Translation!")
-                image, depth_gt = self.random_translate(image, depth_gt, self.config.max_translation)
-
-            image, depth_gt = self.train_preprocess(image, depth_gt)
+                image, depth_gt = self.train_augment(image, depth_gt)
             mask = np.logical_and(depth_gt > self.config.min_depth,
                                   depth_gt < self.config.max_depth).squeeze()[None, ...]
             sample = {'image': image, 'depth': depth_gt, 'focal': focal,
@@ -437,6 +453,116 @@ class DataLoadPreprocess(Dataset):
 
         return sample
 
+    def train_augment(self, image, depth_gt):
+        """Rotate, convert, crop, translate, flip and color augment a training sample.
+
+        Args:
+            image (PIL.Image.Image): RGB image
+            depth_gt (PIL.Image.Image): depth map
+
+        Returns:
+            tuple(np.ndarray, np.ndarray): float32 image in [0, 1] of shape (H, W, 3) and depth in meters of shape (H, W, 1)
+        """
+        if self.config.do_random_rotate and (self.config.aug):
+            random_angle = (random.random() - 0.5) * 2 * self.config.degree
+            image = self.rotate_image(image, random_angle)
+            depth_gt = self.rotate_image(
+                depth_gt, random_angle, flag=Image.NEAREST)
+
+        image = np.asarray(image, dtype=np.float32) / 255.0
+        depth_gt = np.asarray(depth_gt, dtype=np.float32)
+        depth_gt = np.expand_dims(depth_gt, axis=2)
+
+        if self.config.dataset == 'nyu':
+            depth_gt = depth_gt / 1000.0
+        else:
+            depth_gt = depth_gt / 256.0
+
+        if self.config.aug and (self.config.random_crop):
+            image, depth_gt = self.random_crop(
+                image, depth_gt, self.config.input_height, self.config.input_width)
+        
+        if self.config.aug and self.config.random_translate:
+            # print("Random Translation!")
+            image, depth_gt = self.random_translate(image, depth_gt, self.config.max_translation)
+
+        return self.train_preprocess(image, depth_gt)
+
+    def train_augment_fused(self, image, depth_gt, deferred=False):
+        """Same augmentations and random draws as train_augment, but rotation, crop, translation and flip are composed into one affine warp
+        applied to the uint8 image, and the conversion to float is fused with the gamma, brightness and color augmentation into a lookup table.
+
+        Integer transforms (everything but rotation) give the same result as train_augment. Rotations are interpolated by OpenCV instead of PIL.
+
+        If deferred, only crop and translation are applied and the image stays uint8. Rotation, flip and color augmentation are
+        left to zoedepth.data.batch_augment.BatchAugment, which runs on whole batches in the trainer.
+        """
+        image = np.asarray(image)
+        depth_gt = np.asarray(depth_gt)
+        if depth_gt.dtype not in (np.uint16, np.float32):
+            depth_gt = depth_gt.astype(np.float32)
+        height, width = image.shape[:2]
+        out_width, out_height = width, height
+        M = np.eye(3)
+        interpolation = cv2.INTER_NEAREST
+
+        if self.config.do_random_rotate and (self.config.aug) and not deferred:
+            random_angle = (random.random() - 0.5) * 2 * self.config.degree
+            M = rotation_matrix(random_angle, width, height) @ M
+            interpolation = cv2.INTER_LINEAR
+
+        if self.config.aug and (self.config.random_crop):
+            out_height, out_width = self.config.input_height, self.config.input_width
+            assert height >= out_height
+            assert width >= out_width
+            x = random.randint(0, width - out_width)
+            y = random.randint(0, height - out_height)
+            M = translation_matrix(-x, -y) @ M
+
+        # the translation shifts in zeros, not the pixels around the crop. x0, x1, y0, y1 is the output region with image content
+        x0, x1, y0, y1 = 0, out_width, 0, out_height
+        if self.config.aug and self.config.random_translate and random.random() <= self.config.translate_prob:
+            x = random.randint(-self.config.max_translation, self.config.max_translation)
+            y = random.randint(-self.config.max_translation, self.config.max_translation)
+            M = translation_matrix(x, y) @ M
+            x0, x1 = max(0, x), min(out_width, out_width + x)
+            y0, y1 = max(0, y), min(out_height, out_height + y)
+
+        lut = color_lut()
+        if self.config.aug and not deferred:
+            if random.random() > 0.5:
+                M = hflip_matrix(out_width) @ M
+                x0, x1 = out_width - x1, out_width - x0
+            if random.random() > 0.5:
+                gamma = random.uniform(0.9, 1.1)
+                if self.config.dataset == 'nyu':
+                    brightness = random.uniform(0.75, 1.25)
+                else:
+                    brightness = random.uniform(0.9, 1.1)
+                lut = color_lut(gamma, brightness, np.random.uniform(0.9, 1.1, size=3))
+
+        image = warp(image, M, (out_width, out_height), interpolation)
+        depth_gt = warp(depth_gt, M, (out_width, out_height), cv2.INTER_NEAREST)
+        if (x0, x1, y0, y1) != (0, out_width, 0, out_height):
+            # the warp may return a read-only view of the input
+            image, depth_gt = np.array(image), np.array(depth_gt)
+            for im in (image, depth_gt):
+                im[:y0] = 0
+                im[y1:] = 0
+                im[:, :x0] = 0
+                im[:, x1:] = 0
+
+        if not deferred:
+            image = apply_lut(image, lut)
+        elif not image.flags.writeable:
+            image = image.copy()  # crops are views of the decoded image, which torch can not share
+        depth_gt = depth_gt.astype(np.float32)[..., None]
+        if self.config.dataset == 'nyu':
+            depth_gt = depth_gt / 1000.0
+        else:
+            depth_gt = depth_gt / 256.0
+        return image, depth_gt
+
     def rotate_image(self, image, angle, flag=Image.BILINEAR):
         result = image.rotate(angle, resample=flag)
         return result
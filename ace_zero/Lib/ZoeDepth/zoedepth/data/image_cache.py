@@ -0,0 +1,196 @@
+# MIT License
+
+# Copyright (c) 2022 Intelligent Systems Lab Org
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Decoded image cache in shared memory, shared by all DataLoader workers."""
+
+import hashlib
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+# dtypes of the decoded images that can be cached, PIL modes whose arrays have other dtypes are not cached
+DTYPES = (np.uint8, np.uint16, np.int32, np.float32)
+# PIL modes that np.asarray / Image.fromarray convert without loss
+CACHEABLE_MODES = ("L", "RGB", "RGBA", "I", "I;16", "F")
+
+# columns of the slot table
+KEY, TICK, HEIGHT, WIDTH, CHANNELS, DTYPE = range(6)
+NUM_COLUMNS = 6
+
+EMPTY = 0
+
+
+def path_key(fpath):
+    """Stable 63 bit key of a file path, the same in every process. 0 marks empty slots."""
+    key = int.from_bytes(hashlib.blake2b(fpath.encode(), digest_size=8).digest(), "little") >> 1
+    return key or 1
+
+
+class SharedImageCache:
+    """Fixed size cache of decoded images in shared memory.
+
+    The memory is one preallocated arena of num_slots slots of slot_bytes bytes each, plus a table with the key
+    (a hash of the file path), the shape, the dtype and the last use of every slot. Both are created in the main
+    process and attached by the DataLoader workers when the dataset is pickled (spawn) or inherited (fork), so an
+    image decoded by one worker is served to all of them. When all slots are used, the least recently used image is
+    evicted. Images larger than a slot are not cached.
+
+    Access is serialized by a lock. Lookups scan the key column, which takes microseconds for thousands of slots.
+    """
+
+    def __init__(self, capacity_bytes, slot_bytes=2 * 1024 ** 2):
+        """
+        Args:
+            capacity_bytes (int): size of the arena, the cache uses at most this much shared memory for the images
+            slot_bytes (int, optional): size of one slot, must fit the largest decoded image. Defaults to 2 MiB.
+        """
+        self.slot_bytes = int(slot_bytes)
+        self.num_slots = max(1, int(capacity_bytes) // self.slot_bytes)
+        self.lock = mp.Lock()
+
+        self._arena = shared_memory.SharedMemory(create=True, size=self.num_slots * self.slot_bytes)
+        self._table = shared_memory.SharedMemory(create=True, size=(self.num_slots * NUM_COLUMNS + 1) * 8)
+        # forked workers inherit this object as is, only the creating process unlinks the memory
+        self._owner_pid = os.getpid()
+        self._attach()
+        self.table[:] = EMPTY
+        self.clock[0] = 0
+
+    def _attach(self):
+        self.arena = np.ndarray((self.num_slots, self.slot_bytes), dtype=np.uint8, buffer=self._arena.buf)
+        table = np.ndarray((self.num_slots * NUM_COLUMNS + 1,), dtype=np.int64, buffer=self._table.buf)
+        self.table = table[1:].reshape(self.num_slots, NUM_COLUMNS)
+        self.clock = table[:1]
+        self._warned = False
+
+    def __getstate__(self):
+        return dict(slot_bytes=self.slot_bytes, num_slots=self.num_slots, lock=self.lock,
+                    arena_name=self._arena.name, table_name=self._table.name)
+
+    def __setstate__(self, state):
+        self.slot_bytes = state["slot_bytes"]
+        self.num_slots = state["num_slots"]
+        self.lock = state["lock"]
+        # workers share the resource tracker of the main process, which keeps the memory registered until it is unlinked
+        self._arena = shared_memory.SharedMemory(name=state["arena_name"])
+        self._table = shared_memory.SharedMemory(name=state["table_name"])
+        self._owner_pid = None
+        self._attach()
+
+    def _tick(self):
+        self.clock[0] += 1
+        return self.clock[0]
+
+    def get(self, fpath):
+        """Look up a decoded image.
+
+        Args:
+            fpath (str): image path
+
+        Returns:
+            np.ndarray: copy of the decoded image, or None if it is not cached
+        """
+        key = path_key(fpath)
+        with self.lock:
+            slots = np.flatnonzero(self.table[:, KEY] == key)
+            if len(slots) == 0:
+                return None
+            slot = slots[0]
+            row = self.table[slot]
+            row[TICK] = self._tick()
+            dtype = np.dtype(DTYPES[row[DTYPE]])
+            shape = (row[HEIGHT], row[WIDTH]) if row[CHANNELS] == 0 else (row[HEIGHT], row[WIDTH], row[CHANNELS])
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            return self.arena[slot, :nbytes].view(dtype).reshape(shape).copy()
+
+    def put(self, fpath, image):
+        """Store a decoded image, evicting the least recently used one if the cache is full.
+
+        Args:
+            fpath (str): image path
+            image (np.ndarray): decoded image of shape (h, w) or (h, w, c) with a dtype in DTYPES
+
+        Returns:
+            bool: whether the image was cached
+        """
+        image = np.ascontiguousarray(image)
+        if image.dtype not in DTYPES or image.ndim not in (2, 3):
+            return False
+        if image.nbytes > self.slot_bytes:
+            if not self._warned:
+                print(f"Image {fpath} ({image.nbytes} bytes) does not fit into the image cache slots of {self.slot_bytes} bytes, not caching it")
+                self._warned = True
+            return False
+
+        key = path_key(fpath)
+        with self.lock:
+            if np.any(self.table[:, KEY] == key):
+                return True  # cached by another worker in the meantime
+            # empty slots have tick 0, so they are used before any image is evicted
+            slot = int(np.argmin(self.table[:, TICK]))
+            row = self.table[slot]
+            self.arena[slot, :image.nbytes] = image.reshape(-1).view(np.uint8)
+            row[KEY] = key
+            row[TICK] = self._tick()
+            row[HEIGHT], row[WIDTH] = image.shape[:2]
+            row[CHANNELS] = image.shape[2] if image.ndim == 3 else 0
+            row[DTYPE] = [np.dtype(d) for d in DTYPES].index(image.dtype)
+        return True
+
+    def open(self, fpath):
+        """Decoded image of a file, read from the cache or decoded and cached.
+
+        Args:
+            fpath (str): image path
+
+        Returns:
+            PIL.Image.Image: decoded image
+        """
+        image = self.get(fpath)
+        if image is not None:
+            return Image.fromarray(image)
+
+        im = Image.open(fpath)
+        if im.mode not in CACHEABLE_MODES:
+            return im
+        image = np.asarray(im)
+        self.put(fpath, image)
+        return Image.fromarray(image)
+
+    def close(self):
+        # the views must be released before the memory can be closed
+        self.arena = self.table = self.clock = None
+        self._arena.close()
+        self._table.close()
+        if self._owner_pid == os.getpid():
+            self._arena.unlink()
+            self._table.unlink()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
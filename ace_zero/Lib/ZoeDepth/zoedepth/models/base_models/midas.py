@@ -22,12 +22,15 @@
 
 # File author: Shariq Farooq Bhat
 
+import os
+
 import torch
 import torch.nn as nn
 import numpy as np
 from torchvision.transforms import Normalize
 
 from ace_zero.Lib.MiDaS.midas.dpt_depth import DPTDepthModel
+from zoedepth.models.model_io import load_checkpoint
 
 
 def denormalize(x):
@@ -332,10 +335,41 @@ class MidasCore(nn.Module):
         self.output_channels = MIDAS_SETTINGS[model_type]
 
     @staticmethod
-    def build(midas_model_type="DPT_BEiT_L_384", train_midas=False, use_pretrained_midas=True, fetch_features=False, freeze_bn=True, force_keep_ar=False, force_reload=False, **kwargs):
+    def load_midas_weights(midas, midas_model_type, midas_weights_path=None):
+        """Load pretrained MiDaS weights into a midas model.
+
+        Args:
+            midas (torch.nn.Module): Midas model built for midas_model_type.
+            midas_model_type (str): Midas model type, see MIDAS_WEIGHTS.
+            midas_weights_path (str, optional): Weights file (.pt or .safetensors). Defaults to None, in which case the
+                registry file name is looked up in MIDAS_WEIGHTS_DIR.
+        """
+        if midas_weights_path is None:
+            weights_dir = os.environ.get("MIDAS_WEIGHTS_DIR", MIDAS_WEIGHTS_DIR)
+            midas_weights_path = os.path.join(weights_dir, MIDAS_WEIGHTS[midas_model_type]["weights"])
+            # prefer a safetensors copy of the weights if there is one
+            safetensors_path = os.path.splitext(midas_weights_path)[0] + ".safetensors"
+            if os.path.exists(safetensors_path):
+                midas_weights_path = safetensors_path
+
+        print(f"Loading MiDaS weights from {midas_weights_path}")
+        state_dict = load_checkpoint(midas_weights_path)
+        if "optimizer" in state_dict:
+            state_dict = state_dict["model"]
+
+        # the relative position indices of the BEiT backbone are recomputed by the model
+        state_dict = {key: value for key, value in state_dict.items() if 'relative_position_index' not in key}
+        midas.load_state_dict(state_dict)
+        return midas
+
+    @staticmethod
+    def build(midas_model_type="DPT_BEiT_L_384", train_midas=False, use_pretrained_midas=True, fetch_features=False, freeze_bn=True, force_keep_ar=False, force_reload=False, midas_weights_path=None, **kwargs):
         if midas_model_type not in MIDAS_SETTINGS:
             raise ValueError(
                 f"Invalid model type: {midas_model_type}. Must be one of {list(MIDAS_SETTINGS.keys())}")
+        if midas_model_type not in MIDAS_WEIGHTS:
+            raise ValueError(
+                f"Model type {midas_model_type} is not available locally. Must be one of {list(MIDAS_WEIGHTS.keys())}")
         if "img_size" in kwargs:
             kwargs = MidasCore.parse_img_size(kwargs)
         img_size = kwargs.pop("img_size", [384, 384])
@@ -343,20 +377,9 @@ class MidasCore(nn.Module):
         #midas = torch.hub.load("intel-isl/MiDaS", midas_model_type,
         #                       pretrained=use_pretrained_midas, force_reload=force_reload)
 
-        dpt_depth_model_file_path = '/home/chli/chLi/Model/MiDaS/dpt_beit_large_512.pt'
-        midas = DPTDepthModel(path=None, backbone="beitl16_512", non_negative=True)
-        state_dict = torch.load(dpt_depth_model_file_path, map_location='cpu')
-
-        valid_state_dict = {}
-        for key, value in state_dict.items():
-            if 'relative_position_index' in key:
-                continue
-                new_key = key.replace('relative_position_index', 'relative_position_indices')
-                valid_state_dict[new_key] = value
-            else:
-                valid_state_dict[key] = value
-
-        midas.load_state_dict(valid_state_dict)
+        midas = DPTDepthModel(path=None, backbone=MIDAS_WEIGHTS[midas_model_type]["backbone"], non_negative=True)
+        if use_pretrained_midas:
+            MidasCore.load_midas_weights(midas, midas_model_type, midas_weights_path)
 
         kwargs.update({'keep_aspect_ratio': force_keep_ar})
         midas_core = MidasCore(midas, trainable=train_midas, fetch_features=fetch_features,
@@ -393,3 +416,18 @@ nchannels2models = {
 MIDAS_SETTINGS = {m: k for k, v in nchannels2models.items()
                   for m in v
                   }
+
+# Directory of the pretrained MiDaS weights, can be overridden with the MIDAS_WEIGHTS_DIR environment variable
+MIDAS_WEIGHTS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../../MiDaS/weights"))
+
+# Model name to DPT backbone and weights file name (as released in https://github.com/isl-org/MiDaS)
+MIDAS_WEIGHTS = {
+    "DPT_BEiT_L_512": {"backbone": "beitl16_512", "weights": "dpt_beit_large_512.pt"},
+    "DPT_BEiT_L_384": {"backbone": "beitl16_384", "weights": "dpt_beit_large_384.pt"},
+    "DPT_BEiT_B_384": {"backbone": "beitb16_384", "weights": "dpt_beit_base_384.pt"},
+    "DPT_SwinV2_L_384": {"backbone": "swin2l24_384", "weights": "dpt_swin2_large_384.pt"},
+    "DPT_SwinV2_B_384": {"backbone": "swin2b24_384", "weights": "dpt_swin2_base_384.pt"},
+    "DPT_SwinV2_T_256": {"backbone": "swin2t16_256", "weights": "dpt_swin2_tiny_256.pt"},
+    "DPT_Large": {"backbone": "vitl16_384", "weights": "dpt_large_384.pt"},
+    "DPT_Hybrid": {"backbone": "vitb_rn50_384", "weights": "dpt_hybrid_384.pt"},
+}
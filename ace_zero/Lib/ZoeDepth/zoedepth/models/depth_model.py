@@ -22,6 +22,8 @@
 
 # File author: Shariq Farooq Bhat
 
+import inspect
+
 import numpy as np
 import torch
 import torch.nn as nn
@@ -31,6 +33,33 @@ import PIL.Image
 from PIL import Image
 from typing import Union
 
+from zoedepth.utils.depth_cache import hash_image
+
+# Inference tiers, from the most accurate to the fastest. Every forward pass runs the full model, so the cost is
+# roughly proportional to the number of forwards times the (padded) input area:
+#   accurate: padding + flip augmentation, two sequential forwards on a padded input (the default of infer)
+#   fast:     flip augmentation without padding, image and flipped copy are run as one batch in a single forward
+#   fastest:  a single forward on the unpadded input
+# Use benchmark_infer.py to measure the accuracy / latency trade-off of the tiers on your own images.
+INFER_MODES = {
+    "accurate": dict(pad_input=True, with_flip_aug=True, batch_flip=False),
+    "fast": dict(pad_input=False, with_flip_aug=True, batch_flip=True),
+    "fastest": dict(pad_input=False, with_flip_aug=False, batch_flip=False),
+}
+
+
+def get_infer_settings(mode):
+    """
+    Augmentation settings of an inference tier
+    Args:
+        mode (str): one of INFER_MODES
+    Returns:
+        dict: pad_input, with_flip_aug and batch_flip settings
+    """
+    if mode not in INFER_MODES:
+        raise ValueError(f"Unknown inference mode {mode}. Supported values are {list(INFER_MODES.keys())}")
+    return dict(INFER_MODES[mode])
+
 
 class DepthModel(nn.Module):
     def __init__(self):
@@ -96,39 +125,91 @@ class DepthModel(nn.Module):
                 out = out[:, :, :, pad_w:-pad_w]
         return out
     
-    def infer_with_flip_aug(self, x, pad_input: bool=True, **kwargs) -> torch.Tensor:
+    def infer_with_flip_aug(self, x, pad_input: bool=True, batch_flip: bool=False, **kwargs) -> torch.Tensor:
         """
         Inference interface for the model with horizontal flip augmentation
         Horizontal flip augmentation improves the accuracy of the model by averaging the output of the model with and without horizontal flip.
         Args:
             x (torch.Tensor): input tensor of shape (b, c, h, w)
             pad_input (bool, optional): whether to use padding augmentation. Defaults to True.
+            batch_flip (bool, optional): run the input and its flipped copy as one batch of size 2b instead of two forwards. Faster, but needs twice the activation memory. Defaults to False.
         Returns:
             torch.Tensor: output tensor of shape (b, 1, h, w)
         """
         # infer with horizontal flip and average
-        out = self._infer_with_pad_aug(x, pad_input=pad_input, **kwargs)
-        out_flip = self._infer_with_pad_aug(torch.flip(x, dims=[3]), pad_input=pad_input, **kwargs)
+        if batch_flip:
+            out, out_flip = self._infer_with_pad_aug(torch.cat([x, torch.flip(x, dims=[3])]), pad_input=pad_input, **kwargs).chunk(2)
+        else:
+            out = self._infer_with_pad_aug(x, pad_input=pad_input, **kwargs)
+            out_flip = self._infer_with_pad_aug(torch.flip(x, dims=[3]), pad_input=pad_input, **kwargs)
         out = (out + torch.flip(out_flip, dims=[3])) / 2
         return out
     
-    def infer(self, x, pad_input: bool=True, with_flip_aug: bool=True, **kwargs) -> torch.Tensor:
+    def infer(self, x, pad_input: bool=True, with_flip_aug: bool=True, batch_flip: bool=False, mode: str=None, **kwargs) -> torch.Tensor:
         """
         Inference interface for the model
         Args:
             x (torch.Tensor): input tensor of shape (b, c, h, w)
             pad_input (bool, optional): whether to use padding augmentation. Defaults to True.
             with_flip_aug (bool, optional): whether to use horizontal flip augmentation. Defaults to True.
+            batch_flip (bool, optional): run the flip augmentation in a single batched forward. Defaults to False.
+            mode (str, optional): inference tier, one of INFER_MODES. Overrides pad_input, with_flip_aug and batch_flip if set. Defaults to None.
         Returns:
             torch.Tensor: output tensor of shape (b, 1, h, w)
         """
+        if mode is not None:
+            settings = get_infer_settings(mode)
+            pad_input, with_flip_aug, batch_flip = settings["pad_input"], settings["with_flip_aug"], settings["batch_flip"]
+
         if with_flip_aug:
-            return self.infer_with_flip_aug(x, pad_input=pad_input, **kwargs)
+            return self.infer_with_flip_aug(x, pad_input=pad_input, batch_flip=batch_flip, **kwargs)
         else:
             return self._infer_with_pad_aug(x, pad_input=pad_input, **kwargs)
     
+    def get_input_size(self, width, height):
+        """
+        Size the network runs at for an input of the given size
+        Args:
+            width (int): input width
+            height (int): input height
+        Returns:
+            tuple: (width, height) after the resizing of the model (e.g. MiDaS img_size and keep_aspect_ratio)
+        """
+        resizer = getattr(getattr(getattr(self, "core", None), "prep", None), "resizer", None)
+        if hasattr(resizer, "get_size"):
+            return tuple(int(v) for v in resizer.get_size(width, height))
+        return width, height
+
+    def get_cache_key(self, cache, pil_img, pad_input: bool=True, with_flip_aug: bool=True, **kwargs) -> str:
+        """
+        Key of the depth map of an image in a depth cache, covering everything that changes the output of infer
+        Args:
+            cache (zoedepth.utils.depth_cache.DepthCache): depth cache
+            pil_img (PIL.Image.Image): input PIL image
+            pad_input (bool, optional): whether padding augmentation is used. Defaults to True.
+            with_flip_aug (bool, optional): whether flip augmentation is used. Defaults to True.
+            kwargs: further arguments of infer, e.g. fh, fw, padding_mode and upsampling_mode
+        Returns:
+            str: cache key
+        """
+        params = inspect.signature(self._infer_with_pad_aug).parameters
+        settings = {k: p.default for k, p in params.items() if p.default is not inspect.Parameter.empty}
+        settings.update(kwargs)
+        settings.pop("pad_input")
+        settings.pop("batch_flip", None)  # same output, batched or not
+        if not pad_input:
+            for k in ("fh", "fw", "padding_mode"):
+                settings.pop(k)
+
+        width, height = pil_img.size
+        if pad_input:
+            # same padding as _infer_with_pad_aug
+            width += 2 * int(np.sqrt(width / 2) * settings["fw"])
+            height += 2 * int(np.sqrt(height / 2) * settings["fh"])
+        return cache.make_key(hash_image(pil_img), self.get_input_size(width, height), pad_input, with_flip_aug, **settings)
+
     @torch.no_grad()
-    def infer_pil(self, pil_img, pad_input: bool=True, with_flip_aug: bool=True, output_type: str="numpy", **kwargs) -> Union[np.ndarray, PIL.Image.Image, torch.Tensor]:
+    def infer_pil(self, pil_img, pad_input: bool=True, with_flip_aug: bool=True, output_type: str="numpy", cache=None, mode: str=None, **kwargs) -> Union[np.ndarray, PIL.Image.Image, torch.Tensor]:
         """
         Inference interface for the model for PIL image
         Args:
@@ -136,9 +217,26 @@ class DepthModel(nn.Module):
             pad_input (bool, optional): whether to use padding augmentation. Defaults to True.
             with_flip_aug (bool, optional): whether to use horizontal flip augmentation. Defaults to True.
             output_type (str, optional): output type. Supported values are 'numpy', 'pil' and 'tensor'. Defaults to "numpy".
+            cache (zoedepth.utils.depth_cache.DepthCache, optional): look up the depth map in this cache, and store it there if it is missing. Cached depth maps are float16. Defaults to None.
+            mode (str, optional): inference tier, one of INFER_MODES. Overrides pad_input and with_flip_aug if set. Defaults to None.
         """
-        x = transforms.ToTensor()(pil_img).unsqueeze(0).to(self.device)
-        out_tensor = self.infer(x, pad_input=pad_input, with_flip_aug=with_flip_aug, **kwargs)
+        if mode is not None:
+            settings = get_infer_settings(mode)
+            pad_input, with_flip_aug = settings["pad_input"], settings["with_flip_aug"]
+            kwargs["batch_flip"] = settings["batch_flip"]
+
+        out_tensor = None
+        if cache is not None:
+            cache_key = self.get_cache_key(cache, pil_img, pad_input, with_flip_aug, **kwargs)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                out_tensor = torch.from_numpy(np.asarray(cached, dtype=np.float32)).to(self.device)
+
+        if out_tensor is None:
+            x = transforms.ToTensor()(pil_img).unsqueeze(0).to(self.device)
+            out_tensor = self.infer(x, pad_input=pad_input, with_flip_aug=with_flip_aug, **kwargs)
+            if cache is not None:
+                cache.put(cache_key, out_tensor.squeeze().cpu().numpy())
         if output_type == "numpy":
             return out_tensor.squeeze().cpu().numpy()
         elif output_type == "pil":
@@ -57,11 +57,43 @@ def inv_attractor(dx, alpha: float = 300, gamma: int = 2):
     return dx.div(1+alpha*dx.pow(gamma))
 
 
+@torch.jit.script
+def attractor_update(A, b_centers, kind: str = 'sum', attractor_type: str = 'exp'):
+    """Summed (or averaged) shift of the bin centers by all attractors, dc = sum_i dist(A_i - c).
+
+    The shifts are accumulated one attractor at a time, so the (n, n_attractors, n_bins, h, w) tensor of the
+    broadcasted difference is never built and the peak memory is two bin center tensors, independent of the number
+    of attractors. TorchScript fuses the elementwise ops of every step into one kernel.
+
+    Args:
+        A (torch.Tensor): Attractor points; shape - n, n_attractors, h, w
+        b_centers (torch.Tensor): Bin centers; shape - n, n_bins, h, w
+        kind (str, optional): Reduction over the attractors, 'sum' or 'mean'. Defaults to 'sum'.
+        attractor_type (str, optional): 'exp' for exp_attractor, inv_attractor otherwise. Defaults to 'exp'.
+
+    Returns:
+        torch.Tensor: Delta shifts - dc; shape - n, n_bins, h, w
+    """
+    n_attractors = A.shape[1]
+    delta_c = torch.zeros_like(b_centers)
+    for i in range(n_attractors):
+        dx = A[:, i:i + 1] - b_centers
+        if attractor_type == 'exp':
+            delta_c += exp_attractor(dx)
+        else:
+            delta_c += inv_attractor(dx)
+
+    if kind == 'mean':
+        delta_c = delta_c / n_attractors
+    return delta_c
+
+
 class AttractorLayer(nn.Module):
     def __init__(self, in_features, n_bins, n_attractors=16, mlp_dim=128, min_depth=1e-3, max_depth=10,
                  alpha=300, gamma=2, kind='sum', attractor_type='exp', memory_efficient=False):
         """
         Attractor layer for bin centers. Bin centers are bounded on the interval (min_depth, max_depth)
+        The bin center update is always memory efficient (see attractor_update), memory_efficient is kept for config compatibility.
         """
         super().__init__()
 
@@ -82,14 +114,15 @@ class AttractorLayer(nn.Module):
             nn.ReLU(inplace=True)
         )
 
-    def forward(self, x, b_prev, prev_b_embedding=None, interpolate=True, is_for_query=False):
+    def forward(self, x, b_prev, prev_b_embedding=None, interpolate=True, is_for_query=False, return_centers=True):
         """
         Args:
             x (torch.Tensor) : feature block; shape - n, c, h, w
             b_prev (torch.Tensor) : previous bin centers normed; shape - n, prev_nbins, h, w
+            return_centers (bool, optional) : compute the sorted, scaled bin centers. Only the last attractor layer's centers are used, the sort can be skipped for the others. Defaults to True.
         
         Returns:
-            tuple(torch.Tensor,torch.Tensor) : new bin centers normed and scaled; shape - n, nbins, h, w
+            tuple(torch.Tensor,torch.Tensor) : new bin centers normed and scaled; shape - n, nbins, h, w. The scaled centers are None if return_centers is False
         """
         if prev_b_embedding is not None:
             if interpolate:
@@ -109,26 +142,13 @@ class AttractorLayer(nn.Module):
             b_prev, (h, w), mode='bilinear', align_corners=True)
         b_centers = b_prev
 
-        if self.attractor_type == 'exp':
-            dist = exp_attractor
-        else:
-            dist = inv_attractor
-
-        if not self.memory_efficient:
-            func = {'mean': torch.mean, 'sum': torch.sum}[self.kind]
-            # .shape N, nbins, h, w
-            delta_c = func(dist(A_normed.unsqueeze(
-                2) - b_centers.unsqueeze(1)), dim=1)
-        else:
-            delta_c = torch.zeros_like(b_centers, device=b_centers.device)
-            for i in range(self.n_attractors):
-                # .shape N, nbins, h, w
-                delta_c += dist(A_normed[:, i, ...].unsqueeze(1) - b_centers)
-
-            if self.kind == 'mean':
-                delta_c = delta_c / self.n_attractors
+        # .shape N, nbins, h, w
+        delta_c = attractor_update(A_normed, b_centers, self.kind, self.attractor_type)
 
         b_new_centers = b_centers + delta_c
+        if not return_centers:
+            return b_new_centers, None
+
         B_centers = (self.max_depth - self.min_depth) * \
             b_new_centers + self.min_depth
         B_centers, _ = torch.sort(B_centers, dim=1)
@@ -141,6 +161,7 @@ class AttractorLayerUnnormed(nn.Module):
                  alpha=300, gamma=2, kind='sum', attractor_type='exp', memory_efficient=False):
         """
         Attractor layer for bin centers. Bin centers are unbounded
+        The bin center update is always memory efficient (see attractor_update), memory_efficient is kept for config compatibility.
         """
         super().__init__()
 
@@ -161,11 +182,12 @@ class AttractorLayerUnnormed(nn.Module):
             nn.Softplus()
         )
 
-    def forward(self, x, b_prev, prev_b_embedding=None, interpolate=True, is_for_query=False):
+    def forward(self, x, b_prev, prev_b_embedding=None, interpolate=True, is_for_query=False, return_centers=True):
         """
         Args:
             x (torch.Tensor) : feature block; shape - n, c, h, w
             b_prev (torch.Tensor) : previous bin centers normed; shape - n, prev_nbins, h, w
+            return_centers (bool, optional) : unused, the bin centers are not post-processed. Keeps the API consistent with the normed version
         
         Returns:
             tuple(torch.Tensor,torch.Tensor) : new bin centers unbounded; shape - n, nbins, h, w. Two outputs just to keep the API consistent with the normed version
@@ -183,24 +205,8 @@ class AttractorLayerUnnormed(nn.Module):
             b_prev, (h, w), mode='bilinear', align_corners=True)
         b_centers = b_prev
 
-        if self.attractor_type == 'exp':
-            dist = exp_attractor
-        else:
-            dist = inv_attractor
-
-        if not self.memory_efficient:
-            func = {'mean': torch.mean, 'sum': torch.sum}[self.kind]
-            # .shape N, nbins, h, w
-            delta_c = func(
-                dist(A.unsqueeze(2) - b_centers.unsqueeze(1)), dim=1)
-        else:
-            delta_c = torch.zeros_like(b_centers, device=b_centers.device)
-            for i in range(self.n_attractors):
-                delta_c += dist(A[:, i, ...].unsqueeze(1) -
-                                b_centers)  # .shape N, nbins, h, w
-
-            if self.kind == 'mean':
-                delta_c = delta_c / self.n_attractors
+        # .shape N, nbins, h, w
+        delta_c = attractor_update(A, b_centers, self.kind, self.attractor_type)
 
         b_new_centers = b_centers + delta_c
         B_centers = b_new_centers
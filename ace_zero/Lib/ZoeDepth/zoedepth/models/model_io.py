@@ -51,8 +51,31 @@ def load_state_dict(model, state_dict):
     return model
 
 
+def load_checkpoint(checkpoint_path):
+    """Load a checkpoint file to cpu without reading it fully into memory.
+
+    .safetensors files are loaded with safetensors, other files with torch.load(mmap=True), so the tensors are backed by
+    the page cache instead of a private copy of the file. Checkpoints in the legacy (non zip) format can not be mapped and
+    are read normally.
+
+    Args:
+        checkpoint_path (str): path of the checkpoint file
+
+    Returns:
+        dict: loaded checkpoint
+    """
+    if checkpoint_path.endswith('.safetensors'):
+        from safetensors.torch import load_file
+        return load_file(checkpoint_path, device='cpu')
+
+    try:
+        return torch.load(checkpoint_path, map_location='cpu', mmap=True)
+    except RuntimeError:
+        return torch.load(checkpoint_path, map_location='cpu')
+
+
 def load_wts(model, checkpoint_path):
-    ckpt = torch.load(checkpoint_path, map_location='cpu')
+    ckpt = load_checkpoint(checkpoint_path)
     return load_state_dict(model, ckpt)
 
 
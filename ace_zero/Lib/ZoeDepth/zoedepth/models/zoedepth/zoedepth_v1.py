@@ -26,6 +26,7 @@ import itertools
 
 import torch
 import torch.nn as nn
+from torch.profiler import record_function
 from zoedepth.models.depth_model import DepthModel
 from zoedepth.models.base_models.midas import MidasCore
 from zoedepth.models.layers.attractor import AttractorLayer, AttractorLayerUnnormed
@@ -141,55 +142,64 @@ class ZoeDepth(DepthModel):
         # print("input shape ", x.shape)
         self.orig_input_width = w
         self.orig_input_height = h
-        rel_depth, out = self.core(x, denorm=denorm, return_rel_depth=True)
+        # the stages are labelled for torch.profiler, see profile_decoder.py
+        with record_function("zoedepth::core"):
+            rel_depth, out = self.core(x, denorm=denorm, return_rel_depth=True)
         # print("output shapes", rel_depth.shape, out.shape)
 
         outconv_activation = out[0]
         btlnck = out[1]
         x_blocks = out[2:]
 
-        x_d0 = self.conv2(btlnck)
-        x = x_d0
-        _, seed_b_centers = self.seed_bin_regressor(x)
-
-        if self.bin_centers_type == 'normed' or self.bin_centers_type == 'hybrid2':
-            b_prev = (seed_b_centers - self.min_depth) / \
-                (self.max_depth - self.min_depth)
-        else:
-            b_prev = seed_b_centers
-
-        prev_b_embedding = self.seed_projector(x)
-
-        # unroll this loop for better performance
-        for projector, attractor, x in zip(self.projectors, self.attractors, x_blocks):
-            b_embedding = projector(x)
-            b, b_centers = attractor(
-                b_embedding, b_prev, prev_b_embedding, interpolate=True)
-            b_prev = b.clone()
-            prev_b_embedding = b_embedding.clone()
+        with record_function("zoedepth::seed"):
+            x_d0 = self.conv2(btlnck)
+            x = x_d0
+            _, seed_b_centers = self.seed_bin_regressor(x)
+
+            if self.bin_centers_type == 'normed' or self.bin_centers_type == 'hybrid2':
+                b_prev = (seed_b_centers - self.min_depth) / \
+                    (self.max_depth - self.min_depth)
+            else:
+                b_prev = seed_b_centers
+
+            prev_b_embedding = self.seed_projector(x)
+
+        # the attractors never modify their inputs in place, so the outputs are passed on without copies.
+        # Only the bin centers of the last attractor are used, the others skip sorting them
+        last_index = len(self.attractors) - 1
+        for i, (projector, attractor, x) in enumerate(zip(self.projectors, self.attractors, x_blocks)):
+            with record_function(f"zoedepth::attractor{i}"):
+                b_embedding = projector(x)
+                b, b_centers = attractor(
+                    b_embedding, b_prev, prev_b_embedding, interpolate=True, return_centers=i == last_index)
+                b_prev = b
+                prev_b_embedding = b_embedding
 
         last = outconv_activation
 
-        if self.inverse_midas:
-            # invert depth followed by normalization
-            rel_depth = 1.0 / (rel_depth + 1e-6)
-            rel_depth = (rel_depth - rel_depth.min()) / \
-                (rel_depth.max() - rel_depth.min())
-        # concat rel depth with last. First interpolate rel depth to last size
-        rel_cond = rel_depth.unsqueeze(1)
-        rel_cond = nn.functional.interpolate(
-            rel_cond, size=last.shape[2:], mode='bilinear', align_corners=True)
-        last = torch.cat([last, rel_cond], dim=1)
-
-        b_embedding = nn.functional.interpolate(
-            b_embedding, last.shape[-2:], mode='bilinear', align_corners=True)
-        x = self.conditional_log_binomial(last, b_embedding)
-
-        # Now depth value is Sum px * cx , where cx are bin_centers from the last bin tensor
-        # print(x.shape, b_centers.shape)
-        b_centers = nn.functional.interpolate(
-            b_centers, x.shape[-2:], mode='bilinear', align_corners=True)
-        out = torch.sum(x * b_centers, dim=1, keepdim=True)
+        with record_function("zoedepth::rel_cond"):
+            if self.inverse_midas:
+                # invert depth followed by normalization
+                rel_depth = 1.0 / (rel_depth + 1e-6)
+                rel_depth = (rel_depth - rel_depth.min()) / \
+                    (rel_depth.max() - rel_depth.min())
+            # concat rel depth with last. First interpolate rel depth to last size
+            rel_cond = rel_depth.unsqueeze(1)
+            rel_cond = nn.functional.interpolate(
+                rel_cond, size=last.shape[2:], mode='bilinear', align_corners=True)
+            last = torch.cat([last, rel_cond], dim=1)
+
+        with record_function("zoedepth::log_binomial"):
+            b_embedding = nn.functional.interpolate(
+                b_embedding, last.shape[-2:], mode='bilinear', align_corners=True)
+            x = self.conditional_log_binomial(last, b_embedding)
+
+        with record_function("zoedepth::depth"):
+            # Now depth value is Sum px * cx , where cx are bin_centers from the last bin tensor
+            # print(x.shape, b_centers.shape)
+            b_centers = nn.functional.interpolate(
+                b_centers, x.shape[-2:], mode='bilinear', align_corners=True)
+            out = torch.sum(x * b_centers, dim=1, keepdim=True)
 
         # Structure output dict
         output = dict(metric_depth=out)
@@ -237,6 +247,8 @@ class ZoeDepth(DepthModel):
 
     @staticmethod
     def build(midas_model_type="DPT_BEiT_L_384", pretrained_resource=None, use_pretrained_midas=False, train_midas=False, freeze_midas_bn=True, **kwargs):
+        # the MiDaS weights are part of the ZoeDepth checkpoint, loading them first would be wasted work
+        use_pretrained_midas = use_pretrained_midas and not pretrained_resource
         core = MidasCore.build(midas_model_type=midas_model_type, use_pretrained_midas=use_pretrained_midas,
                                train_midas=train_midas, fetch_features=True, freeze_bn=freeze_midas_bn, **kwargs)
         model = ZoeDepth(core, **kwargs)
@@ -26,6 +26,7 @@ import itertools
 
 import torch
 import torch.nn as nn
+from torch.profiler import record_function
 
 from zoedepth.models.depth_model import DepthModel
 from zoedepth.models.base_models.midas import MidasCore
@@ -175,24 +176,27 @@ class ZoeDepthNK(DepthModel):
         b, c, h, w = x.shape
         self.orig_input_width = w
         self.orig_input_height = h
-        rel_depth, out = self.core(x, denorm=denorm, return_rel_depth=True)
+        # the stages are labelled for torch.profiler, see profile_decoder.py
+        with record_function("zoedepth::core"):
+            rel_depth, out = self.core(x, denorm=denorm, return_rel_depth=True)
 
         outconv_activation = out[0]
         btlnck = out[1]
         x_blocks = out[2:]
 
-        x_d0 = self.conv2(btlnck)
-        x = x_d0
+        with record_function("zoedepth::domain"):
+            x_d0 = self.conv2(btlnck)
+            x = x_d0
 
-        # Predict which path to take
-        embedding = self.patch_transformer(x)[0]  # N, E
-        domain_logits = self.mlp_classifier(embedding)  # N, 2
-        domain_vote = torch.softmax(domain_logits.sum(
-            dim=0, keepdim=True), dim=-1)  # 1, 2
+            # Predict which path to take
+            embedding = self.patch_transformer(x)[0]  # N, E
+            domain_logits = self.mlp_classifier(embedding)  # N, 2
+            domain_vote = torch.softmax(domain_logits.sum(
+                dim=0, keepdim=True), dim=-1)  # 1, 2
 
-        # Get the path
-        bin_conf_name = ["nyu", "kitti"][torch.argmax(
-            domain_vote, dim=-1).squeeze().item()]
+            # Get the path
+            bin_conf_name = ["nyu", "kitti"][torch.argmax(
+                domain_vote, dim=-1).squeeze().item()]
 
         try:
             conf = [c for c in self.bin_conf if c.name == bin_conf_name][0]
@@ -203,36 +207,42 @@ class ZoeDepthNK(DepthModel):
         min_depth = conf['min_depth']
         max_depth = conf['max_depth']
 
-        seed_bin_regressor = self.seed_bin_regressors[bin_conf_name]
-        _, seed_b_centers = seed_bin_regressor(x)
-        if self.bin_centers_type == 'normed' or self.bin_centers_type == 'hybrid2':
-            b_prev = (seed_b_centers - min_depth)/(max_depth - min_depth)
-        else:
-            b_prev = seed_b_centers
-        prev_b_embedding = self.seed_projector(x)
+        with record_function("zoedepth::seed"):
+            seed_bin_regressor = self.seed_bin_regressors[bin_conf_name]
+            _, seed_b_centers = seed_bin_regressor(x)
+            if self.bin_centers_type == 'normed' or self.bin_centers_type == 'hybrid2':
+                b_prev = (seed_b_centers - min_depth)/(max_depth - min_depth)
+            else:
+                b_prev = seed_b_centers
+            prev_b_embedding = self.seed_projector(x)
 
         attractors = self.attractors[bin_conf_name]
-        for projector, attractor, x in zip(self.projectors, attractors, x_blocks):
-            b_embedding = projector(x)
-            b, b_centers = attractor(
-                b_embedding, b_prev, prev_b_embedding, interpolate=True)
-            b_prev = b
-            prev_b_embedding = b_embedding
+        # only the bin centers of the last attractor are used, the others skip sorting them
+        last_index = len(attractors) - 1
+        for i, (projector, attractor, x) in enumerate(zip(self.projectors, attractors, x_blocks)):
+            with record_function(f"zoedepth::attractor{i}"):
+                b_embedding = projector(x)
+                b, b_centers = attractor(
+                    b_embedding, b_prev, prev_b_embedding, interpolate=True, return_centers=i == last_index)
+                b_prev = b
+                prev_b_embedding = b_embedding
 
         last = outconv_activation
 
-        b_centers = nn.functional.interpolate(
-            b_centers, last.shape[-2:], mode='bilinear', align_corners=True)
-        b_embedding = nn.functional.interpolate(
-            b_embedding, last.shape[-2:], mode='bilinear', align_corners=True)
+        with record_function("zoedepth::log_binomial"):
+            b_centers = nn.functional.interpolate(
+                b_centers, last.shape[-2:], mode='bilinear', align_corners=True)
+            b_embedding = nn.functional.interpolate(
+                b_embedding, last.shape[-2:], mode='bilinear', align_corners=True)
 
-        clb = self.conditional_log_binomial[bin_conf_name]
-        x = clb(last, b_embedding)
+            clb = self.conditional_log_binomial[bin_conf_name]
+            x = clb(last, b_embedding)
 
-        # Now depth value is Sum px * cx , where cx are bin_centers from the last bin tensor
-        # print(x.shape, b_centers.shape)
-        # b_centers = nn.functional.interpolate(b_centers, x.shape[-2:], mode='bilinear', align_corners=True)
-        out = torch.sum(x * b_centers, dim=1, keepdim=True)
+        with record_function("zoedepth::depth"):
+            # Now depth value is Sum px * cx , where cx are bin_centers from the last bin tensor
+            # print(x.shape, b_centers.shape)
+            # b_centers = nn.functional.interpolate(b_centers, x.shape[-2:], mode='bilinear', align_corners=True)
+            out = torch.sum(x * b_centers, dim=1, keepdim=True)
 
         output = dict(domain_logits=domain_logits, metric_depth=out)
         if return_final_centers or return_probs:
@@ -320,6 +330,8 @@ class ZoeDepthNK(DepthModel):
 
     @staticmethod
     def build(midas_model_type="DPT_BEiT_L_384", pretrained_resource=None, use_pretrained_midas=False, train_midas=False, freeze_midas_bn=True, **kwargs):
+        # the MiDaS weights are part of the ZoeDepth checkpoint, loading them first would be wasted work
+        use_pretrained_midas = use_pretrained_midas and not pretrained_resource
         core = MidasCore.build(midas_model_type=midas_model_type, use_pretrained_midas=use_pretrained_midas,
                                train_midas=train_midas, fetch_features=True, freeze_bn=freeze_midas_bn, **kwargs)
         model = ZoeDepthNK(core, **kwargs)
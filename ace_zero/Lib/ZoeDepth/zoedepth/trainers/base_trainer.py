@@ -22,7 +22,10 @@
 
 # File author: Shariq Farooq Bhat
 
+import copy
+import math
 import os
+import random
 import uuid
 import warnings
 from datetime import datetime as dt
@@ -37,8 +40,11 @@ import torch.optim as optim
 import wandb
 from tqdm import tqdm
 
+from zoedepth.data.batch_augment import BatchAugment
+from zoedepth.models.model_io import load_state_dict
+from zoedepth.trainers.checkpoint import CheckpointWriter, latest_checkpoint, snapshot_to_cpu
 from zoedepth.utils.config import flatten
-from zoedepth.utils.misc import RunningAverageDict, colorize, colors
+from zoedepth.utils.misc import DepthMetrics, LossBuffer, colorize, colors
 
 
 def is_rank_zero(args):
@@ -60,6 +66,12 @@ class BaseTrainer:
         self.test_loader = test_loader
         self.optimizer = self.init_optimizer()
         self.scheduler = self.init_scheduler()
+        # rotation, flip and color augmentation of whole batches on the device, the workers only crop
+        self.batch_augment = BatchAugment(config) if config.get("gpu_aug", False) else None
+        self.checkpoint_writer = CheckpointWriter(keep_last=config.get("keep_checkpoints", 3))
+        self.step = 0
+        self.epoch = 0
+        self.best_loss = np.inf
 
     def resize_to_target(self, prediction, target):
         if prediction.shape[2:] != target.shape[-2:]:
@@ -86,10 +98,9 @@ class BaseTrainer:
         else:
             return
         model = load_wts(self.model, checkpoint)
-        # TODO : Resuming training is not properly supported in this repo. Implement loading / saving of optimizer and scheduler to support it.
         print("Loaded weights from {0}".format(checkpoint))
         warnings.warn(
-            "Resuming training is not properly supported in this repo. Implement loading / saving of optimizer and scheduler to support it.")
+            "load_ckpt only loads the weights. Set resume to continue a run with its optimizer, scheduler and step.")
         self.model = model
 
     def init_optimizer(self):
@@ -116,16 +127,80 @@ class BaseTrainer:
                                              cycle_momentum=self.config.cycle_momentum,
                                              base_momentum=0.85, max_momentum=0.95, div_factor=self.config.div_factor, final_div_factor=self.config.final_div_factor, pct_start=self.config.pct_start, three_phase=self.config.three_phase)
 
+    def augment_batch(self, batch):
+        """Apply the batched augmentation to a training batch if gpu_aug is set, see zoedepth.data.batch_augment"""
+        if self.batch_augment is None:
+            return batch
+        images = batch['image'].to(self.device, non_blocking=True)
+        depths = batch['depth'].to(self.device, non_blocking=True)
+        images, depths, mask = self.batch_augment(images, depths, batch['aug_seed'], batch['dataset'])
+        return {**batch, 'image': images, 'depth': depths, 'mask': mask}
+
     def train_on_batch(self, batch, train_step):
         raise NotImplementedError
 
     def validate_on_batch(self, batch, val_step):
         raise NotImplementedError
 
-    def raise_if_nan(self, losses):
-        for key, value in losses.items():
-            if torch.isnan(value):
-                raise ValueError(f"{key} is NaN, Stopping training")
+    def snapshot_state(self):
+        """Copy of the model and optimizer state in host memory, see rollback. Reuses the buffers of the previous copy."""
+        return snapshot_to_cpu({
+            "step": self.step,
+            "model": self.model.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+        }, self.rollback_buffers)
+
+    def rollback(self, state):
+        """Restore the model and optimizer state of a snapshot. The LR schedule keeps going, so the steps since the snapshot are skipped."""
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()  # the snapshot is copied to the host asynchronously
+        self.model.load_state_dict(state["model"])
+        # the optimizer keeps tensors that are already on the parameter device, they must not alias the snapshot
+        self.optimizer.load_state_dict(copy.deepcopy(state["optimizer"]))
+
+    def sync_losses(self, loss_buffer, pbar=None, wait=False):
+        """Log the losses of the last finished window and handle non-finite ones.
+
+        Called every loss_sync_every steps and before resumable checkpoints. The losses are read one window late (see
+        LossBuffer), so the host does not wait for the device and a non-finite loss is noticed up to
+        2 * loss_sync_every steps after it happened. Training then stops. With wait, or if nan_rollback is set, all
+        windows up to the current step are read right away (see LossBuffer.drain), at the cost of one synchronization.
+
+        With nan_rollback, a single host copy of the model and optimizer state is kept. It is taken at every call
+        whose windows were all finite, and restored when a window is non-finite: it is the state just before the
+        first non-finite window, validated by the finite window that led up to it.
+        """
+        rollback = self.config.get("nan_rollback", False)
+        windows = loss_buffer.drain(self.step) if (wait or rollback) else [loss_buffer.flush(self.step)]
+        for window in windows:
+            if window is None:
+                continue
+            window_step, losses = window
+            if not all(math.isfinite(v) for v in losses.values()):
+                bad = ", ".join(k for k, v in losses.items() if not math.isfinite(v))
+                if self.good_state is None:
+                    raise ValueError(f"{bad} is NaN, Stopping training")
+                print(f"{bad} is NaN before step {window_step}, rolling back to step {self.good_state['step']}")
+                self.rollback(self.good_state)
+                # everything after the good state is based on diverged weights
+                loss_buffer.discard()
+                return
+
+            if pbar is not None and self.config.print_losses:
+                pbar.set_description(
+                    f"Epoch: {self.epoch + 1}/{self.config.epochs}. Loop: Train. Losses: {self.stringify_losses(losses)}")
+            if self.should_log:
+                # wandb needs increasing steps, so the window is logged at the current step
+                wandb.log({f"Train/{name}": loss for name, loss in losses.items()}, step=self.step)
+
+        if rollback:
+            # all windows up to now were finite
+            self.good_state = self.snapshot_state()
+
+    @staticmethod
+    def stringify_losses(L):
+        return "; ".join(map(
+            lambda kv: f"{colors.fg.purple}{kv[0]}{colors.reset}: {round(kv[1],3):.4e}", L.items()))
 
     @property
     def iters_per_epoch(self):
@@ -146,6 +221,14 @@ class BaseTrainer:
         run_id = f"{dt.now().strftime('%d-%h_%H-%M')}-{self.config.uid}"
         self.config.run_id = run_id
         self.config.experiment_id = f"{self.config.name}{self.config.version_name}_{run_id}"
+        self.step = 0
+        self.best_loss = np.inf
+        resume = self.config.get("resume", "")
+        if resume == "auto":
+            resume = latest_checkpoint(os.path.join(
+                self.config.save_dir, f"{self.config.name}{self.config.version_name}_*_latest_*.pt"))
+        if resume:
+            self.resume(resume)
         self.should_write = ((not self.config.distributed)
                              or self.config.rank == 0)
         self.should_log = self.should_write  # and logging
@@ -156,9 +239,8 @@ class BaseTrainer:
                        tags=tags, notes=self.config.notes, settings=wandb.Settings(start_method="fork"))
 
         self.model.train()
-        self.step = 0
-        best_loss = np.inf
         validate_every = int(self.config.validate_every * self.iters_per_epoch)
+        checkpoint_every = int(self.config.get("checkpoint_every", self.config.validate_every) * self.iters_per_epoch)
 
 
         if self.config.prefetch:
@@ -168,49 +250,55 @@ class BaseTrainer:
                 pass
 
         losses = {}
-        def stringify_losses(L): return "; ".join(map(
-            lambda kv: f"{colors.fg.purple}{kv[0]}{colors.reset}: {round(kv[1].item(),3):.4e}", L.items()))
-        for epoch in range(self.config.epochs):
+        # losses stay on the device and are read every loss_sync_every steps, see sync_losses
+        loss_buffer = LossBuffer(reduce=self.config.distributed)
+        loss_sync_every = self.config.get("loss_sync_every", 50)
+        self.good_state = None
+        self.rollback_buffers = {}
+        for epoch in range(self.step // self.iters_per_epoch, self.config.epochs):
             if self.should_early_stop():
                 break
             
             self.epoch = epoch
+            # a resumed epoch only runs its remaining steps (on freshly shuffled data)
+            steps_left = self.iters_per_epoch - self.step % self.iters_per_epoch
             ################################# Train loop ##########################################################
             if self.should_log:
                 wandb.log({"Epoch": epoch}, step=self.step)
             pbar = tqdm(enumerate(self.train_loader), desc=f"Epoch: {epoch + 1}/{self.config.epochs}. Loop: Train",
-                        total=self.iters_per_epoch) if is_rank_zero(self.config) else enumerate(self.train_loader)
+                        total=steps_left) if is_rank_zero(self.config) else enumerate(self.train_loader)
             for i, batch in pbar:
+                if i >= steps_left:
+                    break
                 if self.should_early_stop():
                     print("Early stopping")
                     break
                 # print(f"Batch {self.step+1} on rank {self.config.rank}")
+                batch = self.augment_batch(batch)
                 losses = self.train_on_batch(batch, i)
                 # print(f"trained batch {self.step+1} on rank {self.config.rank}")
 
-                self.raise_if_nan(losses)
-                if is_rank_zero(self.config) and self.config.print_losses:
-                    pbar.set_description(
-                        f"Epoch: {epoch + 1}/{self.config.epochs}. Loop: Train. Losses: {stringify_losses(losses)}")
+                loss_buffer.update(losses)
                 self.scheduler.step()
 
-                if self.should_log and self.step % 50 == 0:
-                    wandb.log({f"Train/{name}": loss.item()
-                              for name, loss in losses.items()}, step=self.step)
-
                 self.step += 1
 
+                if self.step % loss_sync_every == 0:
+                    self.sync_losses(loss_buffer, pbar if is_rank_zero(self.config) else None)
+
                 ########################################################################################################
 
+                if (self.step % checkpoint_every) == 0:
+                    # never save diverged weights as the newest resumable checkpoint
+                    self.sync_losses(loss_buffer, wait=True)
+                    self.save_latest()
+
                 if self.test_loader:
                     if (self.step % validate_every) == 0:
                         self.model.eval()
-                        if self.should_write:
-                            self.save_checkpoint(
-                                f"{self.config.experiment_id}_latest.pt")
 
                         ################################# Validation loop ##################################################
-                        # validate on the entire validation set in every process but save only from rank 0, I know, inefficient, but avoids divergence of processes
+                        # every process validates its shard of the validation set, the metrics are all-reduced, only rank 0 saves
                         metrics, test_losses = self.validate()
                         # print("Validated: {}".format(metrics))
                         if self.should_log:
@@ -220,10 +308,10 @@ class BaseTrainer:
                             wandb.log({f"Metrics/{k}": v for k,
                                       v in metrics.items()}, step=self.step)
 
-                            if (metrics[self.metric_criterion] < best_loss) and self.should_write:
+                            if (metrics[self.metric_criterion] < self.best_loss) and self.should_write:
                                 self.save_checkpoint(
                                     f"{self.config.experiment_id}_best.pt")
-                                best_loss = metrics[self.metric_criterion]
+                                self.best_loss = metrics[self.metric_criterion]
 
                         self.model.train()
 
@@ -234,10 +322,13 @@ class BaseTrainer:
                 # print(f"Finished step {self.step} on device {self.config.rank}")
                 #################################################################################################
 
+        # check the last windows before saving
+        self.sync_losses(loss_buffer, wait=True)
+
         # Save / validate at the end
         self.step += 1  # log as final point
         self.model.eval()
-        self.save_checkpoint(f"{self.config.experiment_id}_latest.pt")
+        self.save_latest()
         if self.test_loader:
 
             ################################# Validation loop ##################################################
@@ -249,40 +340,118 @@ class BaseTrainer:
                 wandb.log({f"Metrics/{k}": v for k,
                           v in metrics.items()}, step=self.step)
 
-                if (metrics[self.metric_criterion] < best_loss) and self.should_write:
+                if (metrics[self.metric_criterion] < self.best_loss) and self.should_write:
                     self.save_checkpoint(
                         f"{self.config.experiment_id}_best.pt")
-                    best_loss = metrics[self.metric_criterion]
+                    self.best_loss = metrics[self.metric_criterion]
 
+        self.checkpoint_writer.wait()
         self.model.train()
 
     def validate(self):
+        """Validate on the test loader, which holds a shard of the validation set in distributed runs.
+
+        validate_on_batch returns a DepthMetrics and a dict of scalar loss tensors (or None, None to skip a batch). Both
+        are summed on the device and all-reduced, so every process gets the metrics of the whole validation set.
+
+        Returns:
+            tuple: (dict of metric averages over images, dict of loss averages over batches)
+        """
         with torch.no_grad():
-            losses_avg = RunningAverageDict()
-            metrics_avg = RunningAverageDict()
+            metrics = DepthMetrics(device=self.device)
+            loss_names = None
+            loss_sums = None  # loss_sums[0] is the number of batches, loss_sums[1:] are the loss sums
             for i, batch in tqdm(enumerate(self.test_loader), desc=f"Epoch: {self.epoch + 1}/{self.config.epochs}. Loop: Validation", total=len(self.test_loader), disable=not is_rank_zero(self.config)):
-                metrics, losses = self.validate_on_batch(batch, val_step=i)
+                batch_metrics, losses = self.validate_on_batch(batch, val_step=i)
 
                 if losses:
-                    losses_avg.update(losses)
-                if metrics:
-                    metrics_avg.update(metrics)
-
-            return metrics_avg.get_value(), losses_avg.get_value()
+                    values = torch.stack([torch.as_tensor(v, device=self.device).double().reshape(()) for v in losses.values()])
+                    if loss_sums is None:
+                        loss_names = list(losses.keys())
+                        loss_sums = values.new_zeros(len(values) + 1)
+                    loss_sums += torch.cat([values.new_ones(1), values])
+                if batch_metrics:
+                    metrics.merge(batch_metrics)
+
+            if self.config.distributed:
+                metrics.all_reduce()
+                # a shard may have no valid batches, take the loss names from any process
+                all_names = [None] * dist.get_world_size()
+                dist.all_gather_object(all_names, loss_names)
+                loss_names = next((names for names in all_names if names is not None), None)
+                if loss_names is not None:
+                    if loss_sums is None:
+                        loss_sums = torch.zeros(len(loss_names) + 1, dtype=torch.float64, device=self.device)
+                    dist.all_reduce(loss_sums)
+
+            losses_avg = None
+            if loss_sums is not None and loss_sums[0] > 0:
+                loss_sums = loss_sums.cpu()
+                losses_avg = dict(zip(loss_names, (loss_sums[1:] / loss_sums[0]).tolist()))
+            return metrics.get_value(), losses_avg
+
+    def training_state(self):
+        """Everything needed to resume training: model, optimizer, scheduler, grad scaler, counters and RNG states"""
+        m = self.model.module if self.config.multigpu else self.model
+        return {
+            "model": m.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "scheduler": self.scheduler.state_dict(),
+            "scaler": self.scaler.state_dict() if hasattr(self, "scaler") else None,
+            "epoch": self.epoch,
+            "step": self.step,
+            "best_loss": self.best_loss,
+            "experiment_id": self.config.experiment_id,
+            "rng": {
+                "python": random.getstate(),
+                "numpy": np.random.get_state(),
+                "torch": torch.get_rng_state(),
+                "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            },
+        }
+
+    def resume(self, checkpoint_path):
+        """Restore a checkpoint of training_state. Training continues at its step, in the same experiment."""
+        ckpt = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+        if ckpt.get("optimizer") is None:
+            raise ValueError(f"{checkpoint_path} has no optimizer state and can not be resumed")
+
+        load_state_dict(self.model, ckpt["model"])
+        self.optimizer.load_state_dict(ckpt["optimizer"])
+        self.scheduler.load_state_dict(ckpt["scheduler"])
+        if ckpt["scaler"] is not None and hasattr(self, "scaler"):
+            self.scaler.load_state_dict(ckpt["scaler"])
+        self.epoch = ckpt["epoch"]
+        self.step = ckpt["step"]
+        self.best_loss = ckpt["best_loss"]
+        self.config.experiment_id = ckpt["experiment_id"]
+
+        rng = ckpt["rng"]
+        random.setstate(rng["python"])
+        np.random.set_state(rng["numpy"])
+        torch.set_rng_state(rng["torch"])
+        if rng["cuda"] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(rng["cuda"])
+        print(f"Resumed {self.config.experiment_id} at step {self.step} from {checkpoint_path}")
+
+    def save_latest(self):
+        """Save a resumable checkpoint, only the keep_checkpoints newest ones are kept"""
+        if not self.should_write:
+            return
+        prefix = os.path.join(self.config.save_dir, f"{self.config.experiment_id}_latest_")
+        self.checkpoint_writer.save(self.training_state(), f"{prefix}{self.step:08d}.pt", retain_pattern=f"{prefix}*.pt")
 
     def save_checkpoint(self, filename):
+        """Save the model weights in the background, the file is replaced atomically"""
         if not self.should_write:
             return
-        root = self.config.save_dir
-        if not os.path.isdir(root):
-            os.makedirs(root)
 
-        fpath = os.path.join(root, filename)
+        fpath = os.path.join(self.config.save_dir, filename)
         m = self.model.module if self.config.multigpu else self.model
-        torch.save(
+        self.checkpoint_writer.save(
             {
                 "model": m.state_dict(),
-                "optimizer": None,  # TODO : Change to self.optimizer.state_dict() if resume support is needed, currently None to reduce file size
+                "optimizer": None,  # weights only, the resumable checkpoints are written by save_latest
                 "epoch": self.epoch
             }, fpath)
 
@@ -0,0 +1,147 @@
+# MIT License
+
+# Copyright (c) 2022 Intelligent Systems Lab Org
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Asynchronous, atomic checkpoint writing for the trainers."""
+
+import glob
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+def snapshot_to_cpu(obj, buffers=None, _path=()):
+    """Copy all tensors of a (nested) state to the cpu without waiting for the device.
+
+    Device tensors are copied to pinned memory with non-blocking copies, cpu tensors are copied too, since training
+    keeps updating the originals in place. Other values are returned as they are.
+
+    Args:
+        obj: tensor, or dict / list / tuple of states
+        buffers (dict, optional): cpu copies of an earlier snapshot, keyed by position in the state, shape and dtype.
+            They are reused, new ones are added. The earlier snapshot must not be in use any more. Defaults to None
+            (new copies).
+
+    Returns:
+        same structure as obj with cpu tensors
+    """
+    if isinstance(obj, torch.Tensor):
+        key = (_path, obj.shape, obj.dtype)
+        copy = None if buffers is None else buffers.get(key)
+        if copy is None:
+            copy = torch.empty(obj.shape, dtype=obj.dtype, device="cpu", pin_memory=obj.is_cuda)
+            if buffers is not None:
+                buffers[key] = copy
+        return copy.copy_(obj.detach(), non_blocking=obj.is_cuda)
+    if isinstance(obj, dict):
+        return type(obj)((k, snapshot_to_cpu(v, buffers, _path + (k,))) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_cpu(v, buffers, _path + (i,)) for i, v in enumerate(obj))
+    return obj
+
+
+def atomic_save(obj, path):
+    """torch.save to a temporary file which is renamed to path, so path never holds a partial checkpoint."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class CheckpointWriter:
+    """Writes checkpoints on a background thread.
+
+    save snapshots the state to the cpu (see snapshot_to_cpu) and returns right away, while the device keeps training.
+    The writer thread waits for the copies, writes the file atomically (see atomic_save) and deletes old checkpoints.
+    At most one snapshot is in flight: save first waits for the previous write, then reuses its pinned buffers, so
+    host memory holds one copy of the state however often checkpoints are saved. Errors of the writer are raised by
+    the next save or wait.
+    """
+
+    def __init__(self, keep_last=3):
+        """
+        Args:
+            keep_last (int, optional): number of checkpoints kept per retention pattern. Defaults to 3.
+        """
+        self.keep_last = keep_last
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint_writer")
+        self._future = None
+        self._buffers = {}
+
+    def save(self, state, path, retain_pattern=None):
+        """Write state to path in the background, after the previous checkpoint is written.
+
+        Args:
+            state (dict): state to save, tensors may be on any device
+            path (str): file to write
+            retain_pattern (str, optional): glob of the checkpoints path belongs to. Only the keep_last newest of them
+                are kept. Defaults to None (nothing is deleted).
+        """
+        self.wait()
+        state = snapshot_to_cpu(state, self._buffers)
+        event = None
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            event = torch.cuda.Event()
+            event.record()
+        self._future = self._executor.submit(self._write, state, event, path, retain_pattern)
+
+    def _write(self, state, event, path, retain_pattern):
+        if event is not None:
+            event.synchronize()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        atomic_save(state, path)
+        if retain_pattern is not None:
+            self._prune(retain_pattern)
+
+    def _prune(self, pattern):
+        paths = sorted(glob.glob(pattern), key=os.path.getmtime, reverse=True)
+        for path in paths[self.keep_last:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def wait(self):
+        """Block until the last checkpoint is written."""
+        future, self._future = self._future, None
+        if future is not None:
+            future.result()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+
+def latest_checkpoint(pattern):
+    """Newest file matching a glob pattern, or None."""
+    paths = glob.glob(pattern)
+    if not paths:
+        return None
+    return max(paths, key=os.path.getmtime)
@@ -41,10 +41,12 @@ def extract_key(prediction, key):
 # Main loss function used for ZoeDepth. Copy/paste from AdaBins repo (https://github.com/shariqfarooq123/AdaBins/blob/0952d91e9e762be310bb4cd055cbfe2448c0ce20/loss.py#L7)
 class SILogLoss(nn.Module):
     """SILog loss (pixel-wise)"""
-    def __init__(self, beta=0.15):
+    def __init__(self, beta=0.15, debug_nan=False):
         super(SILogLoss, self).__init__()
         self.name = 'SILog'
         self.beta = beta
+        # checking for NaN synchronizes with the device on every call, the trainer checks the losses in batches instead
+        self.debug_nan = debug_nan
 
     def forward(self, input, target, mask=None, interpolate=True, return_interpolated=False):
         input = extract_key(input, KEY_OUTPUT)
@@ -77,7 +79,7 @@ class SILogLoss(nn.Module):
 
             loss = 10 * torch.sqrt(Dg)
 
-        if torch.isnan(loss):
+        if self.debug_nan and torch.isnan(loss):
             print("Nan SILog loss")
             print("input:", input.shape)
             print("target:", target.shape)
@@ -28,7 +28,7 @@ import torch.nn as nn
 
 from zoedepth.trainers.loss import GradL1Loss, SILogLoss
 from zoedepth.utils.config import DATASETS_CONFIG
-from zoedepth.utils.misc import compute_metrics
+from zoedepth.utils.misc import DepthMetrics
 from zoedepth.data.preprocess import get_black_border
 
 from .base_trainer import BaseTrainer
@@ -166,8 +166,9 @@ class Trainer(BaseTrainer):
             l_depth = self.silog_loss(
                 pred_depths, depths_gt, mask=mask.to(torch.bool), interpolate=True)
 
-        metrics = compute_metrics(depths_gt, pred_depths, **self.config)
-        losses = {f"{self.silog_loss.name}": l_depth.item()}
+        metrics = DepthMetrics()
+        metrics.update(depths_gt, pred_depths, **self.config)
+        losses = {f"{self.silog_loss.name}": l_depth.detach()}
 
         if val_step == 1 and self.should_log:
             depths_gt[torch.logical_not(mask)] = -99
@@ -240,15 +240,31 @@ COMMON_TRAINING_CONFIG = {
     "clip_grad": 0.1,
     "use_shared_dict": False,
     "shared_dict": None,
+    # decoded training images are cached in shared memory if > 0, see zoedepth.data.image_cache
+    "image_cache_gb": 0,
+    "image_cache_slot_mb": 2,
     "use_amp": False,
 
     "aug": True,
+    # uint8 augmentation with a single affine warp and a color lookup table, see DataLoadPreprocess.train_augment_fused
+    "fused_aug": False,
+    # workers only crop, rotation, flip and color augmentation run batched in the trainer, see zoedepth.data.batch_augment
+    "gpu_aug": False,
     "random_crop": False,
     "random_translate": False,
     "translate_prob": 0.2,
     "max_translation": 100,
 
     "validate_every": 0.25,
+    # losses are read from the device every loss_sync_every steps, a NaN loss then stops training or, with
+    # nan_rollback, restores the last good model and optimizer state (one extra copy of both in host memory, and one
+    # synchronization per loss_sync_every steps)
+    "loss_sync_every": 50,
+    "nan_rollback": False,
+    # resumable checkpoints (every checkpoint_every epochs, defaults to validate_every) are written in the background,
+    # the keep_checkpoints newest are kept. resume is a checkpoint path, or "auto" for the newest one of the experiment
+    "keep_checkpoints": 3,
+    "resume": "",
     "log_images_every": 0.1,
     "prefetch": False,
 }
@@ -347,7 +363,7 @@ def check_choices(name, value, choices):
         raise ValueError(f"{name} {value} not in supported choices {choices}")
 
 
-KEYS_TYPE_BOOL = ["use_amp", "distributed", "use_shared_dict", "same_lr", "aug", "three_phase",
+KEYS_TYPE_BOOL = ["use_amp", "distributed", "use_shared_dict", "same_lr", "aug", "fused_aug", "gpu_aug", "nan_rollback", "three_phase",
                   "prefetch", "cycle_momentum"]  # Casting is not necessary as their int casted values in config are 0 or 1
 
 
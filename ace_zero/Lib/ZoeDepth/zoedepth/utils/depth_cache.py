@@ -0,0 +1,168 @@
+# MIT License
+
+# Copyright (c) 2022 Intelligent Systems Lab Org
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Content-addressed on-disk cache of depth maps."""
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+
+def hash_image(pil_img):
+    """Content hash of an image, independent of its file name and encoding.
+
+    Args:
+        pil_img (PIL.Image.Image): input image
+
+    Returns:
+        str: hex digest of the decoded pixels, size and mode
+    """
+    h = hashlib.sha256()
+    h.update(f"{pil_img.mode}:{pil_img.size[0]}x{pil_img.size[1]}:".encode())
+    h.update(pil_img.tobytes())
+    return h.hexdigest()
+
+
+class DepthCache:
+    """On-disk cache of depth maps, keyed by image content, model type, model input size and inference settings.
+
+    Depth maps are stored as float16 .npy files (one per entry), so they can be memory-mapped on read. The
+    cache is bounded by max_bytes, least recently used entries are evicted first. Recency is tracked with
+    the file modification time, so it survives restarts. Writes are atomic (write to a temporary file, then
+    rename), so several processes can share a cache directory.
+
+    Note: float16 has a relative precision of about 1e-3, which is enough for depth priors.
+    """
+
+    def __init__(self, cache_dir, model_type, max_bytes=None):
+        """
+        Args:
+            cache_dir (str): directory of the cache files
+            model_type (str): name of the model (and weights) the depth maps are computed with
+            max_bytes (int, optional): maximum total size of the cache files. Defaults to None (unbounded).
+        """
+        self.cache_dir = cache_dir
+        self.model_type = model_type
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(os.path.getsize(p) for p, _ in self._entries())
+
+    def make_key(self, image_hash, input_size, pad_input=True, with_flip_aug=True, **settings):
+        """Cache key of a depth map. DepthModel.get_cache_key fills in the arguments for a model.
+
+        Args:
+            image_hash (str): content hash of the image, see hash_image
+            input_size (tuple): (width, height) of the model input, after padding and the resizing of the model
+            pad_input (bool, optional): whether padding augmentation is used. Defaults to True.
+            with_flip_aug (bool, optional): whether flip augmentation is used. Defaults to True.
+            settings: further inference settings that change the depth map, e.g. fh, fw, padding_mode, upsampling_mode
+
+        Returns:
+            str: cache key
+        """
+        desc = f"{image_hash}|{self.model_type}|{input_size[0]}x{input_size[1]}|pad={int(pad_input)}|flip={int(with_flip_aug)}"
+        for name, value in sorted(settings.items()):
+            desc += f"|{name}={value!r}"
+        return hashlib.sha256(desc.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def _entries(self):
+        """(path, mtime) of all cache files."""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".npy"):
+                    path = os.path.join(root, name)
+                    try:
+                        entries.append((path, os.path.getmtime(path)))
+                    except FileNotFoundError:
+                        pass  # evicted by another process
+        return entries
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key, mmap=True):
+        """Look up a depth map.
+
+        Args:
+            key (str): cache key, see make_key
+            mmap (bool, optional): memory-map the file instead of reading it. Defaults to True.
+
+        Returns:
+            np.ndarray: float16 depth map of shape (h, w), or None if it is not cached
+        """
+        path = self._path(key)
+        try:
+            depth = np.load(path, mmap_mode="r" if mmap else None)
+            os.utime(path)  # mark as recently used
+        except (FileNotFoundError, ValueError):
+            return None
+        return depth
+
+    def put(self, key, depth):
+        """Store a depth map and evict least recently used entries if the cache is too large.
+
+        Args:
+            key (str): cache key, see make_key
+            depth (np.ndarray): depth map of shape (h, w)
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(depth, dtype=np.float16))
+
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._total_bytes += os.path.getsize(path) - old_size
+
+            if self.max_bytes is not None and self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits into max_bytes."""
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        sizes = []
+        for path, _ in entries:
+            try:
+                sizes.append(os.path.getsize(path))
+            except FileNotFoundError:
+                sizes.append(0)
+        self._total_bytes = sum(sizes)
+
+        for (path, _), size in zip(entries, sizes):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
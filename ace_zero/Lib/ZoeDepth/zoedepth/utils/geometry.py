@@ -22,54 +22,103 @@
 
 # File author: Shariq Farooq Bhat
 
+from collections import OrderedDict
+
 import numpy as np
 
-def get_intrinsics(H,W):
+# number of (H, W, K) ray grids kept by get_ray_grid
+RAY_GRID_CACHE_SIZE = 8
+_ray_grid_cache = OrderedDict()
+
+# M converts from your coordinate to PyTorch3D's coordinate system
+PYTORCH3D_FROM_CAMERA = np.diag([-1.0, -1.0, 1.0])
+
+def get_intrinsics(H, W, focal_length=None, ppoint_x=None, ppoint_y=None):
     """
     Intrinsics for a pinhole camera model.
-    Assume fov of 55 degrees and central principal point.
+    Unless given, assume fov of 55 degrees and central principal point.
     """
-    f = 0.5 * W / np.tan(0.5 * 55 * np.pi / 180.0)
-    cx = 0.5 * W
-    cy = 0.5 * H
+    f = 0.5 * W / np.tan(0.5 * 55 * np.pi / 180.0) if focal_length is None else focal_length
+    cx = 0.5 * W if ppoint_x is None else ppoint_x
+    cy = 0.5 * H if ppoint_y is None else ppoint_y
     return np.array([[f, 0, cx],
                      [0, f, cy],
                      [0, 0, 1]])
 
-def depth_to_points(depth, R=None, t=None):
-
-    K = get_intrinsics(depth.shape[1], depth.shape[2])
-    Kinv = np.linalg.inv(K)
-    if R is None:
-        R = np.eye(3)
-    if t is None:
-        t = np.zeros(3)
-
-    # M converts from your coordinate to PyTorch3D's coordinate system
-    M = np.eye(3)
-    M[0, 0] = -1.0
-    M[1, 1] = -1.0
-
-    height, width = depth.shape[1:3]
-
-    x = np.arange(width)
-    y = np.arange(height)
-    coord = np.stack(np.meshgrid(x, y), -1)
-    coord = np.concatenate((coord, np.ones_like(coord)[:, :, [0]]), -1)  # z=1
-    coord = coord.astype(np.float32)
-    # coord = torch.as_tensor(coord, dtype=torch.float32, device=device)
-    coord = coord[None]  # bs, h, w, 3
-
-    D = depth[:, :, :, None, None]
-    # print(D.shape, Kinv[None, None, None, ...].shape, coord[:, :, :, :, None].shape )
-    pts3D_1 = D * Kinv[None, None, None, ...] @ coord[:, :, :, :, None]
-    # pts3D_1 live in your coordinate system. Convert them to Py3D's
-    pts3D_1 = M[None, None, None, ...] @ pts3D_1
-    # from reference to targe tviewpoint
-    pts3D_2 = R[None, None, None, ...] @ pts3D_1 + t[None, None, None, :, None]
-    # pts3D_2 = pts3D_1
-    # depth_2 = pts3D_2[:, :, :, 2, :]  # b,1,h,w
-    return pts3D_2[:, :, :, :3, 0][0]
+def get_ray_grid(H, W, K):
+    """
+    Camera rays K^-1 (u, v, 1) of all pixels, cached per (H, W, K).
+    Args:
+        H, W (int): image size
+        K (np.ndarray): 3x3 intrinsics
+    Returns:
+        np.ndarray: read-only float32 array of shape (H*W, 3), row major pixel order
+    """
+    K = np.asarray(K, dtype=np.float64)
+    key = (H, W, K.tobytes())
+    rays = _ray_grid_cache.get(key)
+    if rays is not None:
+        _ray_grid_cache.move_to_end(key)
+        return rays
+
+    # K^-1 of a pinhole camera (no skew) is applied per axis instead of as a matmul
+    fx, fy, cx, cy, s = K[0, 0], K[1, 1], K[0, 2], K[1, 2], K[0, 1]
+    v, u = np.mgrid[0:H, 0:W].astype(np.float64)
+    y = (v - cy) / fy
+    x = (u - cx - s * y) / fx
+    rays = np.stack([x, y, np.ones_like(x)], -1).reshape(-1, 3).astype(np.float32)
+    rays.setflags(write=False)
+
+    _ray_grid_cache[key] = rays
+    if len(_ray_grid_cache) > RAY_GRID_CACHE_SIZE:
+        _ray_grid_cache.popitem(last=False)
+    return rays
+
+def backproject_depth(depth, K, R=None, t=None, to_pytorch3d=True):
+    """
+    Backproject depth maps to 3D points, x = R M (d K^-1 (u, v, 1)) + t.
+    The rotations are fused into the cached ray grid, so every point costs one multiply-add.
+    Args:
+        depth (np.ndarray): depth of shape (H, W) or (B, H, W)
+        K (np.ndarray): 3x3 intrinsics, e.g. get_intrinsics(H, W, focal_length, ppoint_x, ppoint_y)
+        R (np.ndarray, optional): rotation of shape (3, 3) or (B, 3, 3). Defaults to identity.
+        t (np.ndarray, optional): translation of shape (3,) or (B, 3). Defaults to zero.
+        to_pytorch3d (bool, optional): apply M, which flips x and y to PyTorch3D's coordinate system. Defaults to True.
+    Returns:
+        np.ndarray: float32 points of shape (H, W, 3) or (B, H, W, 3), matching depth
+    """
+    depth = np.asarray(depth)
+    batched = depth.ndim == 3
+    if not batched:
+        depth = depth[None]
+    B, H, W = depth.shape
+
+    rays = get_ray_grid(H, W, K)
+
+    A = np.eye(3) if R is None else np.asarray(R, dtype=np.float64)
+    if to_pytorch3d:
+        A = A @ PYTORCH3D_FROM_CAMERA
+    A = A.astype(np.float32)
+    if A.ndim == 2:
+        rays = (rays @ A.T)[None]  # 1, H*W, 3
+    else:
+        rays = np.einsum('nk,bjk->bnj', rays, A)  # B, H*W, 3
+
+    points = depth.reshape(B, -1, 1).astype(np.float32, copy=False) * rays
+    if t is not None:
+        points += np.asarray(t, dtype=np.float32).reshape(-1, 1, 3)
+
+    points = points.reshape(B, H, W, 3)
+    return points if batched else points[0]
+
+def depth_to_points(depth, R=None, t=None, K=None):
+    """
+    Points of the first depth map of a (B, H, W) batch, in PyTorch3D's coordinate system.
+    K defaults to get_intrinsics, see backproject_depth for the batched version.
+    """
+    if K is None:
+        K = get_intrinsics(depth.shape[1], depth.shape[2])
+    return backproject_depth(depth[:1], K, R, t)[0]
 
 
 def create_triangles(h, w, mask=None):
@@ -94,6 +94,97 @@ class RunningAverageDict:
         return {key: value.get_value() for key, value in self._dict.items()}
 
 
+class LossBuffer:
+    """Window averages of the training losses, without synchronizing the host and the device on every step.
+
+    update only adds the losses to sums on the device. flush hands the sums of the current window to the host with an
+    asynchronous copy and returns the previous window, whose copy finished long ago. The host therefore sees the losses
+    one window late, but never waits for the device. A non-finite loss makes the window average non-finite.
+    """
+
+    def __init__(self, reduce=False):
+        """
+        Args:
+            reduce (bool, optional): average the windows over all processes with torch.distributed. Defaults to False.
+        """
+        self.reduce = reduce
+        self.names = None
+        self.sums = None
+        self.count = 0
+        self._pending = None  # (step, host copy of the averages, copy done event)
+
+    def update(self, losses):
+        """Add the losses of a training step.
+
+        Args:
+            losses (dict): name -> scalar loss tensor, with the same names on every step
+        """
+        values = torch.stack([value.detach().float().reshape(()) for value in losses.values()])
+        if self.sums is None:
+            self.names = list(losses.keys())
+            self.sums = torch.zeros_like(values)
+        self.sums += values
+        self.count += 1
+
+    def flush(self, step):
+        """Start copying the current window to the host and collect the previous one.
+
+        Args:
+            step (int): training step at the end of the current window
+
+        Returns:
+            tuple: (step, dict of name -> average loss) of the previous window, or None if there is none
+        """
+        previous = self.collect()
+        if self.count == 0:
+            return previous
+
+        sums = self.sums / self.count
+        if self.reduce:
+            dist.all_reduce(sums)  # queued on the device like any other kernel
+            sums /= dist.get_world_size()
+        event = None
+        if sums.is_cuda:
+            event = torch.cuda.Event()
+            sums = sums.to("cpu", non_blocking=True)
+            event.record()
+        self._pending = (step, sums, event)
+
+        self.sums = torch.zeros_like(self.sums)
+        self.count = 0
+        return previous
+
+    def collect(self):
+        """Wait for the window of the last flush, see flush for the return value."""
+        if self._pending is None:
+            return None
+        step, means, event = self._pending
+        self._pending = None
+        if event is not None:
+            event.synchronize()
+        return step, dict(zip(self.names, means.tolist()))
+
+    def drain(self, step):
+        """Flush the current window and wait for it, e.g. at the end of training.
+
+        Args:
+            step (int): training step at the end of the current window
+
+        Returns:
+            list: (step, dict of name -> average loss) of the windows not collected yet, oldest first
+        """
+        previous = self.flush(step)
+        current = self.collect()
+        return [window for window in (previous, current) if window is not None]
+
+    def discard(self):
+        """Drop the current and the pending window, e.g. after the model was rolled back."""
+        self._pending = None
+        if self.sums is not None:
+            self.sums.zero_()
+        self.count = 0
+
+
 def colorize(value, vmin=None, vmax=None, cmap='gray_r', invalid_val=-99, invalid_mask=None, background_color=(128, 128, 128, 255), gamma_corrected=False, value_transform=None):
     """Converts a depth map to a color image.
 
@@ -199,9 +290,102 @@ def compute_errors(gt, pred):
                 silog=silog, sq_rel=sq_rel)
 
 
-def compute_metrics(gt, pred, interpolate=True, garg_crop=False, eigen_crop=True, dataset='nyu', min_depth_eval=0.1, max_depth_eval=10, **kwargs):
-    """Compute metrics of predicted depth maps. Applies cropping and masking as necessary or specified via arguments. Refer to compute_errors for more details on metrics.
+# order of the metrics in the statistics of DepthMetrics
+METRIC_NAMES = ('a1', 'a2', 'a3', 'abs_rel', 'rmse', 'log_10', 'rmse_log', 'silog', 'sq_rel')
+
+_eval_mask_cache = {}
+
+
+def get_eval_mask(height, width, garg_crop=False, eigen_crop=True, dataset='nyu', device='cpu'):
+    """Garg / Eigen crop mask of the evaluation region. Masks are cached per resolution, crop and device, so they must not be modified.
+
+    Args:
+        height (int): depth map height
+        width (int): depth map width
+        garg_crop (bool, optional): use the Garg crop. Defaults to False.
+        eigen_crop (bool, optional): use the Eigen crop, unless garg_crop is set. Defaults to True.
+        dataset (str, optional): dataset name, the Eigen crop of 'kitti' differs from the others. Defaults to 'nyu'.
+        device (torch.device, optional): device of the mask. Defaults to 'cpu'.
+
+    Returns:
+        torch.Tensor - shape(H, W): Boolean mask, or None if no crop is used
+    """
+    if not (garg_crop or eigen_crop):
+        return None
+
+    key = (height, width, garg_crop, eigen_crop, dataset == 'kitti', str(device))
+    eval_mask = _eval_mask_cache.get(key)
+    if eval_mask is None:
+        eval_mask = torch.zeros(height, width, dtype=torch.bool)
+        if garg_crop:
+            eval_mask[int(0.40810811 * height):int(0.99189189 * height),
+                      int(0.03594771 * width):int(0.96405229 * width)] = 1
+        elif dataset == 'kitti':
+            eval_mask[int(0.3324324 * height):int(0.91351351 * height),
+                      int(0.0359477 * width):int(0.96405229 * width)] = 1
+        else:
+            # assert (height, width) == (480, 640), "Error: Eigen crop is currently only valid for (480, 640) images"
+            eval_mask[45:471, 41:601] = 1
+        eval_mask = eval_mask.to(device)
+        _eval_mask_cache[key] = eval_mask
+    return eval_mask
+
+
+def compute_errors_batch(gt, pred, valid_mask):
+    """Compute the metrics of compute_errors for every row of a batch, on the device of the inputs.
+
+    All terms are derived from the difference and the log ratio of pred and gt, which are computed once. Masking is
+    done without gathering the valid pixels, so rows with different numbers of valid pixels can be batched.
+
+    Args:
+        gt (torch.Tensor - shape(B, P)): Ground truth values
+        pred (torch.Tensor - shape(B, P)): Predicted values, positive
+        valid_mask (torch.Tensor - shape(B, P)): Boolean mask of the pixels to evaluate
+
+    Returns:
+        torch.Tensor - shape(B, 9): float64 metrics in METRIC_NAMES order. Rows without valid pixels are NaN.
     """
+    # invalid pixels are set to gt = pred = 1, so they add zero to all error sums
+    gt = torch.where(valid_mask, gt, torch.ones_like(gt))
+    pred = torch.where(valid_mask, pred, torch.ones_like(pred))
+    n = valid_mask.sum(dim=-1).double()
+    num_invalid = valid_mask.shape[-1] - n
+
+    diff = gt - pred
+    sq = diff ** 2
+    err = torch.log(pred) - torch.log(gt)
+    abs_err = err.abs()
+
+    def total(x):
+        return x.sum(dim=-1).double()
+
+    # max(gt / pred, pred / gt) < t  <=>  |log(pred / gt)| < log(t), invalid pixels (err = 0) are subtracted again
+    a1 = total(abs_err < math.log(1.25)) - num_invalid
+    a2 = total(abs_err < 2 * math.log(1.25)) - num_invalid
+    a3 = total(abs_err < 3 * math.log(1.25)) - num_invalid
+    abs_rel = total(diff.abs() / gt)
+    sq_rel = total(sq / gt)
+    sq = total(sq)
+    abs_log = total(abs_err)
+    sq_log = total(err ** 2)
+    log = total(err)
+
+    mean_log = log / n
+    return torch.stack([
+        a1 / n,
+        a2 / n,
+        a3 / n,
+        abs_rel / n,
+        torch.sqrt(sq / n),
+        abs_log / n / math.log(10),
+        torch.sqrt(sq_log / n),
+        torch.sqrt(sq_log / n - mean_log ** 2) * 100,
+        sq_rel / n,
+    ], dim=-1)
+
+
+def _prepare_metric_inputs(gt, pred, interpolate=True, garg_crop=False, eigen_crop=True, dataset='nyu', min_depth_eval=0.1, max_depth_eval=10, **kwargs):
+    """Clamp pred and build the valid mask of gt, see compute_metrics. Returns gt, pred and valid mask of shape (B, H, W)."""
     if 'config' in kwargs:
         config = kwargs['config']
         garg_crop = config.garg_crop
@@ -213,36 +397,80 @@ def compute_metrics(gt, pred, interpolate=True, garg_crop=False, eigen_crop=True
         pred = nn.functional.interpolate(
             pred, gt.shape[-2:], mode='bilinear', align_corners=True)
 
-    pred = pred.squeeze().cpu().numpy()
-    pred[pred < min_depth_eval] = min_depth_eval
-    pred[pred > max_depth_eval] = max_depth_eval
-    pred[np.isinf(pred)] = max_depth_eval
-    pred[np.isnan(pred)] = min_depth_eval
+    height, width = gt.shape[-2:]
+    gt = gt.reshape(-1, height, width)
+    pred = pred.reshape(-1, height, width).to(gt.device)
+    pred = torch.nan_to_num(pred, nan=min_depth_eval, posinf=max_depth_eval, neginf=min_depth_eval)
+    pred = pred.clamp(min_depth_eval, max_depth_eval)
 
-    gt_depth = gt.squeeze().cpu().numpy()
-    valid_mask = np.logical_and(
-        gt_depth > min_depth_eval, gt_depth < max_depth_eval)
+    valid_mask = torch.logical_and(gt > min_depth_eval, gt < max_depth_eval)
+    eval_mask = get_eval_mask(height, width, garg_crop, eigen_crop, dataset, gt.device)
+    if eval_mask is not None:
+        valid_mask = torch.logical_and(valid_mask, eval_mask)
+    return gt, pred, valid_mask
 
-    if garg_crop or eigen_crop:
-        gt_height, gt_width = gt_depth.shape
-        eval_mask = np.zeros(valid_mask.shape)
 
-        if garg_crop:
-            eval_mask[int(0.40810811 * gt_height):int(0.99189189 * gt_height),
-                      int(0.03594771 * gt_width):int(0.96405229 * gt_width)] = 1
-
-        elif eigen_crop:
-            # print("-"*10, " EIGEN CROP ", "-"*10)
-            if dataset == 'kitti':
-                eval_mask[int(0.3324324 * gt_height):int(0.91351351 * gt_height),
-                          int(0.0359477 * gt_width):int(0.96405229 * gt_width)] = 1
-            else:
-                # assert gt_depth.shape == (480, 640), "Error: Eigen crop is currently only valid for (480, 640) images"
-                eval_mask[45:471, 41:601] = 1
+def compute_metrics(gt, pred, interpolate=True, garg_crop=False, eigen_crop=True, dataset='nyu', min_depth_eval=0.1, max_depth_eval=10, **kwargs):
+    """Compute metrics of predicted depth maps. Applies cropping and masking as necessary or specified via arguments. Refer to compute_errors for more details on metrics.
+
+    All pixels of the inputs are pooled, use DepthMetrics to average the metrics per image.
+    """
+    gt, pred, valid_mask = _prepare_metric_inputs(gt, pred, interpolate, garg_crop, eigen_crop, dataset,
+                                                  min_depth_eval, max_depth_eval, **kwargs)
+    metrics = compute_errors_batch(gt.reshape(1, -1), pred.reshape(1, -1), valid_mask.reshape(1, -1))[0]
+    return dict(zip(METRIC_NAMES, metrics.tolist()))
+
+
+class DepthMetrics:
+    """Streaming average of the per-image depth metrics of compute_metrics.
+
+    Only sufficient statistics are kept on the device of the inputs: the number of images and the sums of their metrics.
+    Nothing is copied to the host until get_value, and partial results (e.g. of parallel workers) can be combined with
+    merge, or by summing the stats tensors (e.g. with torch.distributed.all_reduce).
+    """
+
+    def __init__(self, device=None):
+        # stats[0] is the number of images, stats[1:] are the metric sums in METRIC_NAMES order
+        self.stats = None if device is None else torch.zeros(len(METRIC_NAMES) + 1, dtype=torch.float64, device=device)
+
+    def _add(self, stats):
+        if self.stats is None:
+            self.stats = stats.clone()
         else:
-            eval_mask = np.ones(valid_mask.shape)
-    valid_mask = np.logical_and(valid_mask, eval_mask)
-    return compute_errors(gt_depth[valid_mask], pred[valid_mask])
+            self.stats += stats.to(self.stats.device)
+
+    def update(self, gt, pred, **kwargs):
+        """Add the metrics of a batch of depth maps, see compute_metrics for the arguments.
+
+        Args:
+            gt (torch.Tensor - shape(B, 1, H, W)): Ground truth depth
+            pred (torch.Tensor - shape(B, 1, h, w)): Predicted depth
+        """
+        gt, pred, valid_mask = _prepare_metric_inputs(gt, pred, **kwargs)
+        metrics = compute_errors_batch(gt.flatten(1), pred.flatten(1), valid_mask.flatten(1))
+        # images without valid pixels have no metrics and are skipped
+        has_valid = valid_mask.flatten(1).any(dim=1)
+        metrics = metrics[has_valid]
+        self._add(torch.cat([metrics.new_tensor([metrics.shape[0]]), metrics.sum(dim=0)]))
+
+    def merge(self, other):
+        """Add the statistics of another DepthMetrics."""
+        if other.stats is not None:
+            self._add(other.stats)
+        return self
+
+    def all_reduce(self):
+        """Sum the statistics of all processes with torch.distributed, the result equals that of a single process."""
+        if self.stats is None:
+            raise ValueError("DepthMetrics needs a device to be all-reduced, pass it to the constructor")
+        dist.all_reduce(self.stats)
+        return self
+
+    def get_value(self):
+        if self.stats is None or self.stats[0] == 0:
+            return None
+        stats = self.stats.cpu()
+        return dict(zip(METRIC_NAMES, (stats[1:] / stats[0]).tolist()))
 
 
 #################################### Model uilts ################################################
@@ -0,0 +1,118 @@
+"""Benchmark of the DSAC* RGB pose estimation, C++ extension vs. the pure PyTorch fallback.
+
+Estimates the pose of a synthetic scene coordinate prediction (known ground truth, a fraction of
+random outliers) with an increasing number of RANSAC hypotheses. The C++ extension is skipped if
+it is not built.
+"""
+import argparse
+import math
+import time
+
+import torch
+
+import dsacstar_torch
+
+try:
+    import dsacstar
+except ImportError:
+    dsacstar = None
+
+
+def make_scene(height, width, sub_sampling, focal_length, outlier_ratio, noise, seed):
+    """Synthetic scene coordinates seen by a camera at a random pose.
+
+    Returns:
+        tuple: (1, 3, H, W) scene coordinates and the (4, 4) ground truth camera to scene transformation
+    """
+    generator = torch.Generator().manual_seed(seed)
+
+    rotation = dsacstar_torch.so3_exp(torch.rand(3, generator=generator, dtype=torch.float64) * 0.5 + 0.1)
+    translation = torch.rand(3, generator=generator, dtype=torch.float64) * 2 - 1
+
+    sampling = dsacstar_torch.create_sampling(width, height, sub_sampling, torch.device('cpu'))
+    sampling = sampling + torch.randn(sampling.shape, generator=generator, dtype=torch.float64) * noise
+    pp = sampling.new_tensor([width * sub_sampling / 2, height * sub_sampling / 2])
+
+    depth = torch.rand(height * width, 1, generator=generator, dtype=torch.float64) * 4 + 2
+    cam = torch.cat([(sampling - pp) / focal_length, torch.ones_like(depth)], dim=1) * depth
+    coords = (cam - translation) @ rotation
+
+    outliers = torch.rand(height * width, generator=generator) < outlier_ratio
+    coords[outliers] = torch.randn(int(outliers.sum()), 3, generator=generator, dtype=torch.float64) * 5
+
+    scene_pose = torch.eye(4, dtype=torch.float64)
+    scene_pose[:3, :3] = rotation
+    scene_pose[:3, 3] = translation
+
+    scene_coordinates = coords.T.reshape(1, 3, height, width).float()
+    return scene_coordinates, torch.linalg.inv(scene_pose).float()
+
+
+def pose_error(estimate, ground_truth):
+    """Rotation error (deg) and translation error of a camera pose."""
+    delta = estimate[:3, :3].double() @ ground_truth[:3, :3].double().T
+    cos_angle = ((torch.trace(delta) - 1) / 2).clamp(-1, 1)
+    return math.degrees(math.acos(float(cos_angle))), float((estimate[:3, 3] - ground_truth[:3, 3]).norm())
+
+
+def run(hypotheses, args):
+    implementations = [('torch', dsacstar_torch)]
+    if dsacstar is not None:
+        implementations.insert(0, ('c++', dsacstar))
+    else:
+        print("dsacstar extension not found, benchmarking the PyTorch implementation only.")
+
+    height, width = args.height, args.width
+    scene_coordinates, ground_truth = make_scene(
+        height, width, args.sub_sampling, args.focal_length, args.outliers, args.noise, args.seed)
+
+    print(f"{'impl':>6} {'hyps':>6} {'time [ms]':>10} {'hyps/s':>10} {'inliers':>8} {'rot [deg]':>10} {'trans':>10}")
+
+    for num_hypotheses in hypotheses:
+        for name, module in implementations:
+            out_pose = torch.zeros(4, 4)
+            times = []
+
+            for run_idx in range(args.repeats):
+                start = time.time()
+                inlier_count = module.forward_rgb(
+                    scene_coordinates,
+                    out_pose,
+                    num_hypotheses,
+                    args.threshold,
+                    args.focal_length,
+                    width * args.sub_sampling / 2,
+                    height * args.sub_sampling / 2,
+                    args.inlier_alpha,
+                    args.max_reproj,
+                    args.sub_sampling,
+                    args.seed + run_idx,
+                    args.max_hypotheses_tries)
+                times.append(time.time() - start)
+
+            run_time = min(times)
+            rot_err, trans_err = pose_error(out_pose, ground_truth)
+            print(f"{name:>6} {num_hypotheses:>6} {run_time * 1000:>10.1f} {num_hypotheses / run_time:>10.0f} "
+                  f"{inlier_count:>8} {rot_err:>10.4f} {trans_err:>10.5f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hypotheses', type=int, nargs='+', default=[64, 256, 1024],
+                        help='numbers of RANSAC hypotheses to benchmark')
+    parser.add_argument('--height', type=int, default=60, help='height of the scene coordinate prediction')
+    parser.add_argument('--width', type=int, default=80, help='width of the scene coordinate prediction')
+    parser.add_argument('--sub_sampling', type=int, default=8, help='sub-sampling of the scene coordinate prediction')
+    parser.add_argument('--focal_length', type=float, default=525, help='focal length in px')
+    parser.add_argument('--outliers', type=float, default=0.5, help='ratio of random scene coordinates')
+    parser.add_argument('--noise', type=float, default=0.5, help='noise of the inlier image positions in px')
+    parser.add_argument('--threshold', type=float, default=10, help='inlier threshold in px')
+    parser.add_argument('--inlier_alpha', type=float, default=100, help='alpha parameter of soft inlier counting')
+    parser.add_argument('--max_reproj', type=float, default=100, help='reprojection errors are clamped to this value')
+    parser.add_argument('--max_hypotheses_tries', type=int, default=1000000,
+                        help='number of times to repeat sampling if a hypothesis is invalid')
+    parser.add_argument('--repeats', type=int, default=3, help='runs per setting, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=2089, help='random seed')
+    args = parser.parse_args()
+
+    run(args.hypotheses, args)
@@ -0,0 +1,43 @@
+"""Microbenchmark of the dsacstar reprojection error calculation.
+
+Compares cv::projectPoints with the dedicated pinhole kernel on synthetic scene coordinates
+for several scene coordinate grid sizes. Requires the compiled dsacstar extension.
+"""
+import argparse
+
+import torch
+
+import dsacstar
+
+
+def run(sizes, num_hypotheses, sub_sampling, focal_length, max_reproj, seed):
+    print(f"{'grid':>10} {'projectPoints [ms]':>20} {'kernel [ms]':>12} {'speedup':>8} {'max diff [px]':>14}")
+
+    for height, width in sizes:
+        scene_coordinates = torch.randn(1, 3, height, width)
+        scene_coordinates[:, 2] = scene_coordinates[:, 2].abs() + 2  # in front of the camera
+
+        generic_ms, kernel_ms, max_diff = dsacstar.benchmark_repro_errs(
+            scene_coordinates,
+            focal_length,
+            width * sub_sampling / 2,
+            height * sub_sampling / 2,
+            max_reproj,
+            sub_sampling,
+            num_hypotheses,
+            seed)
+
+        print(f"{height:>4}x{width:<5} {generic_ms:>20.4f} {kernel_ms:>12.4f} {generic_ms / kernel_ms:>7.1f}x {max_diff:>14.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num_hypotheses', type=int, default=256, help='number of random pose hypotheses')
+    parser.add_argument('--sub_sampling', type=int, default=8, help='sub-sampling of the scene coordinate prediction')
+    parser.add_argument('--focal_length', type=float, default=525, help='focal length in px')
+    parser.add_argument('--max_reproj', type=float, default=100, help='reprojection errors are clamped to this value')
+    parser.add_argument('--seed', type=int, default=2089, help='random seed for the pose hypotheses')
+    args = parser.parse_args()
+
+    run([(30, 40), (60, 80), (90, 120)], args.num_hypotheses, args.sub_sampling, args.focal_length, args.max_reproj,
+        args.seed)
@@ -34,6 +34,9 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #include <opencv2/opencv.hpp>
 
 #include <iostream>
+#include <future>
+#include <mutex>
+#include <thread>
 
 #include "thread_rand.h"
 #include "stop_watch.h"
@@ -45,8 +48,31 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #include "dsacstar_derivative.h"
 
 #define MAX_REF_STEPS 100 // max pose refienment iterations
+#define PREEMPTIVE_SURVIVORS 8 // hypotheses which get dense reprojection error images when scoring pre-emptively
+#define REF_CONV_ROT 0.01 // incremental pose refinement converged if rotation changes less (degree)
+#define REF_CONV_TRANS 0.0001 // incremental pose refinement converged if translation changes less (scene units)
 //#define MAX_HYPOTHESES_TRIES 16 // repeat sampling x times hypothesis if hypothesis is invalid
 
+namespace dsacstar
+{
+	// profile of all pose estimations since the module was loaded or the stats were reset
+	std::mutex statsMutex;
+	profile_t stats;
+	long statsPoses = 0;
+
+	/**
+	* @brief Add the profile of a pose estimation call to the aggregate stats. Thread-safe.
+	* @param profile Profile of the call.
+	* @param numPoses Number of poses estimated by the call.
+	*/
+	void addToStats(const profile_t& profile, long numPoses = 1)
+	{
+		std::lock_guard<std::mutex> lock(statsMutex);
+		stats += profile;
+		statsPoses += numPoses;
+	}
+}
+
 /**
  * @brief Estimate a camera pose based on a scene coordinate prediction
  * @param sceneCoordinatesSrc Scene coordinate prediction, (1x3xHxW) with 1=batch dimension (only batch_size=1 supported atm), 3=scene coordainte dimensions, H=height and W=width.
@@ -61,6 +87,12 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
  * @param subSampling Sub-sampling  of the scene coordinate prediction wrt the input image.
  * @param randomSeed External random seed to make sure we draw different samples across calls of this function.
  * @param max_hypotheses_tries Number of times to repeat sampling if hypothesis is invalid.
+ * @param adaptiveConfidence If larger than zero, stop sampling hypotheses as soon as an all-inlier minimal set has been drawn with this probability. ransacHypotheses is then the maximum number of hypotheses.
+ * @param minHypotheses Minimum number of hypotheses to draw when stopping adaptively.
+ * @param preemptiveSubset If larger than zero, score hypotheses pre-emptively on growing random subsets of this initial size, and calculate dense reprojection errors only for the surviving hypotheses. Ignored when stopping adaptively.
+ * @param incrementalRefinement Refine the winning pose incrementally, i.e. update the inlier set instead of rebuilding it, warm-start each step from the previous pose, and stop when the pose converges.
+ * @param verbose Print progress and timings to stdout.
+ * @param profile (output parameter) Optional, stage times and counters of this call.
  * @return The number of inliers for the output pose.
  */
 int dsacstar_rgb_forward(
@@ -75,10 +107,14 @@ int dsacstar_rgb_forward(
 	float maxReproj,
 	int subSampling,
 	int randomSeed,
-	int max_hypotheses_tries)
+	int max_hypotheses_tries,
+	float adaptiveConfidence,
+	int minHypotheses,
+	int preemptiveSubset,
+	bool incrementalRefinement,
+	bool verbose,
+	dsacstar::profile_t* profile = nullptr)
 {
-	ThreadRand::init(randomSeed);
-
 	// access to tensor objects
 	dsacstar::coord_t sceneCoordinates = 
 		sceneCoordinatesSrc.accessor<float, 4>();
@@ -98,8 +134,9 @@ int dsacstar_rgb_forward(
 	cv::Mat_<cv::Point2i> sampling = 
 		dsacstar::createSampling(imW, imH, subSampling, 0, 0);
 
-	std::cout << BLUETEXT("Sampling " << ransacHypotheses << " hypotheses.") << std::endl;
 	StopWatch stopW;
+	StopWatch totalW;
+	dsacstar::profile_t prof;
 
 	// sample RANSAC hypotheses
 	std::vector<dsacstar::pose_t> hypotheses;
@@ -107,71 +144,154 @@ int dsacstar_rgb_forward(
 	std::vector<std::vector<cv::Point2f>> imgPts;
 	std::vector<std::vector<cv::Point3f>> objPts;
 
-	dsacstar::sampleHypotheses(
-		sceneCoordinates,
-		sampling,
-		camMat,
-		ransacHypotheses,
-		max_hypotheses_tries,
-		inlierThreshold,
-		hypotheses,
-		sampledPoints,
-		imgPts,
-		objPts);
-
-	std::cout << "Done in " << stopW.stop() / 1000 << "s." << std::endl;	
-	std::cout << BLUETEXT("Calculating scores.") << std::endl;
-    
-	// compute reprojection error images
-	std::vector<cv::Mat_<float>> reproErrs(ransacHypotheses);
-	cv::Mat_<double> jacobeanDummy;
+	// reprojection error images and soft inlier counts
+	std::vector<cv::Mat_<float>> reproErrs;
+	std::vector<double> scores;
+
+	if(adaptiveConfidence > 0)
+	{
+		if(verbose) std::cout << BLUETEXT("Sampling and scoring up to " << ransacHypotheses << " hypotheses adaptively.") << std::endl;
+
+		prof.sampling = dsacstar::sampleHypothesesAdaptive(
+			sceneCoordinates,
+			sampling,
+			camMat,
+			minHypotheses,
+			ransacHypotheses,
+			adaptiveConfidence,
+			max_hypotheses_tries,
+			inlierThreshold,
+			inlierAlpha,
+			maxReproj,
+			randomSeed,
+			hypotheses,
+			sampledPoints,
+			imgPts,
+			objPts,
+			reproErrs,
+			scores);
+
+		prof.hypotheses = hypotheses.size();
+		prof.samplingMs = stopW.stop();
+		if(verbose) std::cout << "Done in " << prof.samplingMs / 1000 << "s (" << hypotheses.size() << " hypotheses)." << std::endl;
+	}
+	else
+	{
+		if(verbose) std::cout << BLUETEXT("Sampling " << ransacHypotheses << " hypotheses.") << std::endl;
+
+		prof.sampling = dsacstar::sampleHypotheses(
+			sceneCoordinates,
+			sampling,
+			camMat,
+			ransacHypotheses,
+			max_hypotheses_tries,
+			inlierThreshold,
+			randomSeed,
+			hypotheses,
+			sampledPoints,
+			imgPts,
+			objPts);
+
+		prof.hypotheses = hypotheses.size();
+		prof.samplingMs = stopW.stop();
+		if(verbose) std::cout << "Done in " << prof.samplingMs / 1000 << "s." << std::endl;	
+
+		if(preemptiveSubset > 0)
+		{
+			if(verbose) std::cout << BLUETEXT("Pre-emptively scoring hypotheses.") << std::endl;
+
+			std::vector<int> survivors = dsacstar::preemptiveScoring(
+				sceneCoordinates,
+				hypotheses,
+				sampling,
+				camMat,
+				preemptiveSubset,
+				PREEMPTIVE_SURVIVORS,
+				inlierThreshold,
+				maxReproj,
+				randomSeed);
 
-	#pragma omp parallel for 
-	for(unsigned h = 0; h < hypotheses.size(); h++)
-    	reproErrs[h] = dsacstar::getReproErrs(
-		sceneCoordinates,
-		hypotheses[h], 
-		sampling, 
-		camMat,
-		maxReproj,
-		jacobeanDummy);
-
-    // soft inlier counting
-	std::vector<double> scores = dsacstar::getHypScores(
-    	reproErrs,
-    	inlierThreshold,
-    	inlierAlpha);
-
-	std::cout << "Done in " << stopW.stop() / 1000 << "s." << std::endl;
-	std::cout << BLUETEXT("Drawing final hypothesis.") << std::endl;	
+			// only surviving hypotheses get dense scores
+			std::vector<dsacstar::pose_t> survivingHyps(survivors.size());
+			for(unsigned s = 0; s < survivors.size(); s++)
+				survivingHyps[s] = hypotheses[survivors[s]];
+			hypotheses = survivingHyps;
+
+			prof.preemptiveMs = stopW.stop();
+			if(verbose) std::cout << "Done in " << prof.preemptiveMs / 1000 << "s (" << hypotheses.size() << " survivors)." << std::endl;
+		}
+
+		if(verbose) std::cout << BLUETEXT("Calculating scores.") << std::endl;
+
+		// compute reprojection error images
+		reproErrs.resize(hypotheses.size());
+		cv::Mat_<double> jacobeanDummy;
+
+		#pragma omp parallel for 
+		for(unsigned h = 0; h < hypotheses.size(); h++)
+			reproErrs[h] = dsacstar::getReproErrs(
+				sceneCoordinates,
+				hypotheses[h], 
+				sampling, 
+				camMat,
+				maxReproj,
+				jacobeanDummy);
+
+		// soft inlier counting
+		scores = dsacstar::getHypScores(
+			reproErrs,
+			inlierThreshold,
+			inlierAlpha);
+
+		prof.scoringMs = stopW.stop();
+		if(verbose) std::cout << "Done in " << prof.scoringMs / 1000 << "s." << std::endl;
+	}
+
+	if(verbose) std::cout << BLUETEXT("Drawing final hypothesis.") << std::endl;	
 
 	// apply soft max to scores to get a distribution
 	std::vector<double> hypProbs = dsacstar::softMax(scores);
 	double hypEntropy = dsacstar::entropy(hypProbs); // measure distribution entropy
 	int hypIdx = dsacstar::draw(hypProbs, false); // select winning hypothesis
 
-	std::cout << "Soft inlier count: " << scores[hypIdx] << " (Selection Probability: " << (int) (hypProbs[hypIdx]*100) << "%)" << std::endl; 
-	std::cout << "Entropy of hypothesis distribution: " << hypEntropy << std::endl;
+	if(verbose) std::cout << "Soft inlier count: " << scores[hypIdx] << " (Selection Probability: " << (int) (hypProbs[hypIdx]*100) << "%)" << std::endl; 
+	if(verbose) std::cout << "Entropy of hypothesis distribution: " << hypEntropy << std::endl;
 
 
-	std::cout << "Done in " << stopW.stop() / 1000 << "s." << std::endl;
-	std::cout << BLUETEXT("Refining winning pose:") << std::endl;
+	prof.selectionMs = stopW.stop();
+	if(verbose) std::cout << "Done in " << prof.selectionMs / 1000 << "s." << std::endl;
+	if(verbose) std::cout << BLUETEXT("Refining winning pose:") << std::endl;
 
 	// refine selected hypothesis
 	cv::Mat_<int> inlierMap;
 
-	dsacstar::refineHyp(
-		sceneCoordinates,
-		reproErrs[hypIdx],
-		sampling,
-		camMat,
-		inlierThreshold,
-		MAX_REF_STEPS,
-		maxReproj,
-		hypotheses[hypIdx],
-		inlierMap);
+	if(incrementalRefinement)
+		prof.refinementSteps = dsacstar::refineHypIncremental(
+			sceneCoordinates,
+			reproErrs[hypIdx],
+			sampling,
+			camMat,
+			inlierThreshold,
+			MAX_REF_STEPS,
+			maxReproj,
+			REF_CONV_ROT,
+			REF_CONV_TRANS,
+			hypotheses[hypIdx],
+			inlierMap);
+	else
+		prof.refinementSteps = dsacstar::refineHyp(
+			sceneCoordinates,
+			reproErrs[hypIdx],
+			sampling,
+			camMat,
+			inlierThreshold,
+			MAX_REF_STEPS,
+			maxReproj,
+			hypotheses[hypIdx],
+			inlierMap);
 
-	std::cout << "Done in " << stopW.stop() / 1000 << "s." << std::endl;
+	prof.refinementMs = stopW.stop();
+	if(verbose) std::cout << "Done in " << prof.refinementMs / 1000 << "s." << std::endl;
 
 	// write result back to PyTorch
 	dsacstar::trans_t estTrans = dsacstar::pose2trans(hypotheses[hypIdx]);
@@ -181,8 +301,597 @@ int dsacstar_rgb_forward(
 	for(unsigned y = 0; y < 4; y++)
 		outPose[y][x] = estTrans(y, x);
 
-	// Return the inlier count. cv::sum returns a scalar, so we return its first element.
-	return cv::sum(inlierMap)[0];
+	// cv::sum returns a scalar, so we take its first element.
+	prof.inlierCount = cv::sum(inlierMap)[0];
+	prof.totalMs = totalW.stop();
+
+	dsacstar::addToStats(prof);
+	if(profile) *profile = prof;
+
+	// Return the inlier count.
+	return prof.inlierCount;
+}
+
+/**
+ * @brief Estimate camera poses for a batch of scene coordinate predictions.
+ *
+ * Hypotheses of all images are sampled, scored and refined in shared parallel loops,
+ * so that all cores stay busy even if each image only yields a small scene coordinate grid.
+ *
+ * @param sceneCoordinatesSrc Scene coordinate predictions, (Nx3xHxW) with N=batch dimension, 3=scene coordainte dimensions, H=height and W=width.
+ * @param intrinsicsSrc Camera intrinsics, (Nx3) tensor containing focal length, principal point X and principal point Y (in px) per image.
+ * @param outPosesSrc Camera poses (output parameter), (Nx4x4) tensor containing the homogeneous camera tranformation matrices.
+ * @param ransacHypotheses Number of RANSAC iterations per image.
+ * @param inlierThreshold Inlier threshold for RANSAC in px.
+ * @param inlierAlpha Alpha parameter for soft inlier counting.
+ * @param maxReproj Reprojection errors are clamped above this value (px).
+ * @param subSampling Sub-sampling  of the scene coordinate prediction wrt the input image.
+ * @param randomSeed External random seed to make sure we draw different samples across calls of this function.
+ * @param max_hypotheses_tries Number of times to repeat sampling if hypothesis is invalid.
+ * @param verbose Print progress and timings to stdout.
+ * @param profile (output parameter) Optional, stage times and counters of this call, summed over images.
+ * @return (N) tensor with the number of inliers for each output pose.
+ */
+at::Tensor dsacstar_rgb_forward_batch(
+	at::Tensor sceneCoordinatesSrc,
+	at::Tensor intrinsicsSrc,
+	at::Tensor outPosesSrc,
+	int ransacHypotheses,
+	float inlierThreshold,
+	float inlierAlpha,
+	float maxReproj,
+	int subSampling,
+	int randomSeed,
+	int max_hypotheses_tries,
+	bool verbose,
+	dsacstar::profile_t* profile = nullptr)
+{
+	// access to tensor objects
+	dsacstar::coord_t sceneCoordinates = 
+		sceneCoordinatesSrc.accessor<float, 4>();
+	auto intrinsics = intrinsicsSrc.accessor<float, 2>();
+
+	// dimensions of scene coordinate predictions
+	int imN = sceneCoordinates.size(0);
+	int imH = sceneCoordinates.size(2);
+	int imW = sceneCoordinates.size(3);
+
+	// internal camera calibration matrix per image
+	std::vector<cv::Mat_<float>> camMats(imN);
+	for(int b = 0; b < imN; b++)
+	{
+		camMats[b] = cv::Mat_<float>::eye(3, 3);
+		camMats[b](0, 0) = intrinsics[b][0];
+		camMats[b](1, 1) = intrinsics[b][0];
+		camMats[b](0, 2) = intrinsics[b][1];
+		camMats[b](1, 2) = intrinsics[b][2];
+	}
+
+	// calculate original image position for each scene coordinate prediction (shared by all images)
+	cv::Mat_<cv::Point2i> sampling = 
+		dsacstar::createSampling(imW, imH, subSampling, 0, 0);
+
+	if(verbose) std::cout << BLUETEXT("Sampling " << ransacHypotheses << " hypotheses for " << imN << " images.") << std::endl;
+	StopWatch stopW;
+	StopWatch totalW;
+	dsacstar::profile_t prof;
+
+	// hypotheses of all images are stored in one flat list, hypothesis h of image b at b * ransacHypotheses + h
+	int totalHypotheses = imN * ransacHypotheses;
+
+	std::vector<dsacstar::pose_t> hypotheses(totalHypotheses);
+	std::vector<std::vector<cv::Point2i>> sampledPoints(totalHypotheses);
+	std::vector<std::vector<cv::Point2f>> imgPts(totalHypotheses);
+	std::vector<std::vector<cv::Point3f>> objPts(totalHypotheses);
+
+	long tries = 0, invalidP3P = 0;
+
+	#pragma omp parallel for reduction(+:tries, invalidP3P)
+	for(int i = 0; i < totalHypotheses; i++)
+	{
+		int b = i / ransacHypotheses;
+		CounterRand rng(randomSeed, i);
+
+		dsacstar::sample_stats_t stats = dsacstar::sampleHypothesis(
+			sceneCoordinates,
+			b,
+			sampling,
+			camMats[b],
+			max_hypotheses_tries,
+			inlierThreshold,
+			rng,
+			hypotheses[i],
+			sampledPoints[i],
+			imgPts[i],
+			objPts[i]);
+
+		tries += stats.tries;
+		invalidP3P += stats.invalidP3P;
+	}
+
+	prof.sampling.tries = tries;
+	prof.sampling.invalidP3P = invalidP3P;
+	prof.samplingMs = stopW.stop();
+	if(verbose) std::cout << "Done in " << prof.samplingMs / 1000 << "s." << std::endl;	
+	if(verbose) std::cout << BLUETEXT("Calculating scores.") << std::endl;
+
+	// compute reprojection error images and soft inlier counts
+	std::vector<cv::Mat_<float>> reproErrs(totalHypotheses);
+	std::vector<double> scores(totalHypotheses);
+
+	#pragma omp parallel for
+	for(int i = 0; i < totalHypotheses; i++)
+	{
+		int b = i / ransacHypotheses;
+		cv::Mat_<double> jacobeanDummy;
+
+		reproErrs[i] = dsacstar::getReproErrs(
+			sceneCoordinates,
+			hypotheses[i],
+			sampling,
+			camMats[b],
+			maxReproj,
+			jacobeanDummy,
+			false,
+			b);
+
+		scores[i] = dsacstar::getHypScore(
+			reproErrs[i],
+			inlierThreshold,
+			inlierAlpha);
+	}
+
+	prof.scoringMs = stopW.stop();
+	if(verbose) std::cout << "Done in " << prof.scoringMs / 1000 << "s." << std::endl;
+	if(verbose) std::cout << BLUETEXT("Drawing final hypotheses and refining winning poses.") << std::endl;
+
+	// select and refine the winning hypothesis of each image
+	std::vector<int> hypIdxs(imN);
+	std::vector<cv::Mat_<int>> inlierMaps(imN);
+	long refinementSteps = 0;
+
+	#pragma omp parallel for reduction(+:refinementSteps)
+	for(int b = 0; b < imN; b++)
+	{
+		std::vector<double> imgScores(
+			scores.begin() + b * ransacHypotheses,
+			scores.begin() + (b + 1) * ransacHypotheses);
+
+		// apply soft max to scores to get a distribution
+		std::vector<double> hypProbs = dsacstar::softMax(imgScores);
+		hypIdxs[b] = b * ransacHypotheses + dsacstar::draw(hypProbs, false); // select winning hypothesis
+
+		refinementSteps += dsacstar::refineHyp(
+			sceneCoordinates,
+			reproErrs[hypIdxs[b]],
+			sampling,
+			camMats[b],
+			inlierThreshold,
+			MAX_REF_STEPS,
+			maxReproj,
+			hypotheses[hypIdxs[b]],
+			inlierMaps[b],
+			b);
+	}
+
+	// selection and refinement run in one loop, and are profiled as refinement
+	prof.refinementSteps = refinementSteps;
+	prof.refinementMs = stopW.stop();
+	if(verbose) std::cout << "Done in " << prof.refinementMs / 1000 << "s." << std::endl;
+
+	// write results back to PyTorch
+	auto outPoses = outPosesSrc.accessor<float, 3>();
+	at::Tensor inlierCounts = torch::zeros({imN}, torch::kInt64);
+	auto inlierCountsAcc = inlierCounts.accessor<int64_t, 1>();
+
+	for(int b = 0; b < imN; b++)
+	{
+		dsacstar::trans_t estTrans = dsacstar::pose2trans(hypotheses[hypIdxs[b]]);
+
+		for(unsigned x = 0; x < 4; x++)
+		for(unsigned y = 0; y < 4; y++)
+			outPoses[b][y][x] = estTrans(y, x);
+
+		inlierCountsAcc[b] = cv::sum(inlierMaps[b])[0];
+		prof.inlierCount += inlierCountsAcc[b];
+	}
+
+	prof.hypotheses = totalHypotheses;
+	prof.totalMs = totalW.stop();
+
+	dsacstar::addToStats(prof, imN);
+	if(profile) *profile = prof;
+
+	return inlierCounts;
+}
+
+/**
+ * @brief Convert the profile of a pose estimation to a Python dict. Requires the GIL.
+ * @param profile Stage times (ms) and counters.
+ * @param dict (output parameter) Dict to fill.
+ */
+void profile2dict(const dsacstar::profile_t& profile, py::dict dict)
+{
+	dict["sampling_ms"] = profile.samplingMs;
+	dict["preemptive_ms"] = profile.preemptiveMs;
+	dict["scoring_ms"] = profile.scoringMs;
+	dict["selection_ms"] = profile.selectionMs;
+	dict["refinement_ms"] = profile.refinementMs;
+	dict["total_ms"] = profile.totalMs;
+	dict["hypotheses"] = profile.hypotheses;
+	dict["hypotheses_tried"] = profile.sampling.tries;
+	dict["invalid_p3p"] = profile.sampling.invalidP3P;
+	dict["refinement_steps"] = profile.refinementSteps;
+	dict["inlier_count"] = profile.inlierCount;
+}
+
+/**
+ * @brief Python entry point of dsacstar_rgb_forward, releases the GIL during the estimation.
+ * @param profile Optional dict, filled with stage times (ms) and counters of this call.
+ * @return The number of inliers for the output pose.
+ */
+int dsacstar_rgb_forward_py(
+	at::Tensor sceneCoordinatesSrc, 
+	at::Tensor outPoseSrc,
+	int ransacHypotheses, 
+	float inlierThreshold,
+	float focalLength,
+	float ppointX,
+	float ppointY,
+	float inlierAlpha,
+	float maxReproj,
+	int subSampling,
+	int randomSeed,
+	int max_hypotheses_tries,
+	float adaptiveConfidence,
+	int minHypotheses,
+	int preemptiveSubset,
+	bool incrementalRefinement,
+	bool verbose,
+	py::object profile)
+{
+	dsacstar::profile_t prof;
+	int inlierCount;
+
+	{
+		py::gil_scoped_release release;
+
+		inlierCount = dsacstar_rgb_forward(
+			sceneCoordinatesSrc,
+			outPoseSrc,
+			ransacHypotheses,
+			inlierThreshold,
+			focalLength,
+			ppointX,
+			ppointY,
+			inlierAlpha,
+			maxReproj,
+			subSampling,
+			randomSeed,
+			max_hypotheses_tries,
+			adaptiveConfidence,
+			minHypotheses,
+			preemptiveSubset,
+			incrementalRefinement,
+			verbose,
+			&prof);
+	}
+
+	if(!profile.is_none())
+		profile2dict(prof, profile.cast<py::dict>());
+
+	return inlierCount;
+}
+
+/**
+ * @brief Python entry point of dsacstar_rgb_forward_batch, releases the GIL during the estimation.
+ * @param profile Optional dict, filled with stage times (ms) and counters of this call, summed over images.
+ * @return (N) tensor with the number of inliers for each output pose.
+ */
+at::Tensor dsacstar_rgb_forward_batch_py(
+	at::Tensor sceneCoordinatesSrc,
+	at::Tensor intrinsicsSrc,
+	at::Tensor outPosesSrc,
+	int ransacHypotheses,
+	float inlierThreshold,
+	float inlierAlpha,
+	float maxReproj,
+	int subSampling,
+	int randomSeed,
+	int max_hypotheses_tries,
+	bool verbose,
+	py::object profile)
+{
+	dsacstar::profile_t prof;
+	at::Tensor inlierCounts;
+
+	{
+		py::gil_scoped_release release;
+
+		inlierCounts = dsacstar_rgb_forward_batch(
+			sceneCoordinatesSrc,
+			intrinsicsSrc,
+			outPosesSrc,
+			ransacHypotheses,
+			inlierThreshold,
+			inlierAlpha,
+			maxReproj,
+			subSampling,
+			randomSeed,
+			max_hypotheses_tries,
+			verbose,
+			&prof);
+	}
+
+	if(!profile.is_none())
+		profile2dict(prof, profile.cast<py::dict>());
+
+	return inlierCounts;
+}
+
+/**
+ * @brief Aggregate profile of all pose estimations since the module was loaded or the stats were reset.
+ * @return Dict with the number of estimated poses, summed stage times (ms) and summed counters.
+ */
+py::dict dsacstar_get_stats()
+{
+	dsacstar::profile_t stats;
+	long poses;
+
+	{
+		std::lock_guard<std::mutex> lock(dsacstar::statsMutex);
+		stats = dsacstar::stats;
+		poses = dsacstar::statsPoses;
+	}
+
+	py::dict dict;
+	dict["poses"] = poses;
+	profile2dict(stats, dict);
+	return dict;
+}
+
+/**
+ * @brief Reset the aggregate profile of pose estimations.
+ */
+void dsacstar_reset_stats()
+{
+	std::lock_guard<std::mutex> lock(dsacstar::statsMutex);
+	dsacstar::stats = dsacstar::profile_t();
+	dsacstar::statsPoses = 0;
+}
+
+/**
+ * @brief Microbenchmark of the reprojection error calculation used for scoring and refinement.
+ *
+ * Compares the generic path via cv::projectPoints with the dedicated pinhole kernel, single-threaded,
+ * on random pose hypotheses.
+ *
+ * @param sceneCoordinatesSrc Scene coordinate prediction, (1x3xHxW).
+ * @param focalLength Focal length of the camera in px.
+ * @param ppointX Coordinate (X) of the prinicpal points.
+ * @param ppointY Coordinate (Y) of the prinicpal points.
+ * @param maxReproj Reprojection errors are clamped above this value (px).
+ * @param subSampling Sub-sampling  of the scene coordinate prediction wrt the input image.
+ * @param numHypotheses Number of random pose hypotheses to calculate errors for.
+ * @param randomSeed Random seed for drawing the pose hypotheses.
+ * @return Time per hypothesis (ms) of cv::projectPoints, time per hypothesis (ms) of the kernel, and the maximum absolute difference of both (px).
+ */
+std::tuple<double, double, double> dsacstar_benchmark_repro_errs(
+	at::Tensor sceneCoordinatesSrc,
+	float focalLength,
+	float ppointX,
+	float ppointY,
+	float maxReproj,
+	int subSampling,
+	int numHypotheses,
+	int randomSeed)
+{
+	dsacstar::coord_t sceneCoordinates = 
+		sceneCoordinatesSrc.accessor<float, 4>();
+
+	int imH = sceneCoordinates.size(2);
+	int imW = sceneCoordinates.size(3);
+
+	cv::Mat_<float> camMat = cv::Mat_<float>::eye(3, 3);
+	camMat(0, 0) = focalLength;
+	camMat(1, 1) = focalLength;
+	camMat(0, 2) = ppointX;
+	camMat(1, 2) = ppointY;	
+
+	cv::Mat_<cv::Point2i> sampling = 
+		dsacstar::createSampling(imW, imH, subSampling, 0, 0);
+
+	// random poses close to the identity
+	std::vector<dsacstar::pose_t> hypotheses(numHypotheses);
+	for(int h = 0; h < numHypotheses; h++)
+	{
+		CounterRand rng(randomSeed, h);
+
+		hypotheses[h].first = cv::Mat_<double>(3, 1);
+		hypotheses[h].second = cv::Mat_<double>(3, 1);
+		for(int i = 0; i < 3; i++)
+		{
+			hypotheses[h].first.at<double>(i) = rng.drand(-0.2, 0.2);
+			hypotheses[h].second.at<double>(i) = rng.drand(-1, 1);
+		}
+	}
+
+	std::vector<cv::Mat_<float>> genericErrs(numHypotheses);
+	cv::Mat_<double> jacobeanDummy;
+	StopWatch stopW;
+
+	for(int h = 0; h < numHypotheses; h++)
+		genericErrs[h] = dsacstar::getReproErrs(
+			sceneCoordinates,
+			hypotheses[h],
+			sampling,
+			camMat,
+			maxReproj,
+			jacobeanDummy,
+			false,
+			0,
+			false);
+
+	double genericTime = stopW.stop() / std::max(numHypotheses, 1);
+
+	// one buffer re-used for all hypotheses
+	cv::Mat_<float> kernelErrs;
+	double maxDiff = 0;
+	double kernelTime = 0;
+
+	for(int h = 0; h < numHypotheses; h++)
+	{
+		stopW.init();
+		dsacstar::projectReproErrs(
+			sceneCoordinates,
+			hypotheses[h],
+			sampling,
+			camMat,
+			maxReproj,
+			kernelErrs);
+		kernelTime += stopW.stop();
+
+		maxDiff = std::max(maxDiff, cv::norm(genericErrs[h], kernelErrs, cv::NORM_INF));
+	}
+
+	kernelTime /= std::max(numHypotheses, 1);
+
+	return std::make_tuple(genericTime, kernelTime, maxDiff);
+}
+
+/**
+ * @brief Handle of a pose estimation running in a background thread, returned by forward_rgb_async.
+ */
+class ForwardFuture
+{
+public:
+	/**
+	 * @brief Constructor.
+	 * @param result Future of the inlier count returned by the pose estimation.
+	 */
+	ForwardFuture(std::shared_future<int> result) : result(result) {}
+
+	/**
+	 * @brief Check whether the pose estimation has finished (successfully or not).
+	 * @return True if the result is available.
+	 */
+	bool done() const
+	{
+		return result.wait_for(std::chrono::seconds(0)) == std::future_status::ready;
+	}
+
+	/**
+	 * @brief Wait for the pose estimation to finish, without holding the GIL.
+	 * @return The number of inliers for the output pose. Re-raises errors of the pose estimation.
+	 */
+	int get() const
+	{
+		py::gil_scoped_release release;
+		return result.get();
+	}
+
+private:
+	std::shared_future<int> result; // inlier count of the pose estimation
+};
+
+/**
+ * @brief Estimate a camera pose in a background thread.
+ *
+ * Same as dsacstar_rgb_forward, but returns immediately. The output pose tensor is written when the
+ * estimation finishes. Allows to overlap pose estimation with Python-side work, e.g. running the
+ * network on the next frame. Each call runs in its own thread with its own OpenMP team.
+ *
+ * @param callback Optional Python callable, called with the inlier count when the estimation finished successfully. Called from the background thread, before the future becomes ready.
+ * @return Future of the inlier count.
+ */
+ForwardFuture dsacstar_rgb_forward_async(
+	at::Tensor sceneCoordinatesSrc, 
+	at::Tensor outPoseSrc,
+	int ransacHypotheses, 
+	float inlierThreshold,
+	float focalLength,
+	float ppointX,
+	float ppointY,
+	float inlierAlpha,
+	float maxReproj,
+	int subSampling,
+	int randomSeed,
+	int max_hypotheses_tries,
+	float adaptiveConfidence,
+	int minHypotheses,
+	int preemptiveSubset,
+	bool incrementalRefinement,
+	bool verbose,
+	py::object callback)
+{
+	// the callback is released in the background thread, which requires the GIL
+	std::shared_ptr<py::object> callbackPtr;
+	if(!callback.is_none())
+		callbackPtr.reset(
+			new py::object(callback),
+			[](py::object* obj) { py::gil_scoped_acquire acquire; delete obj; });
+
+	auto promise = std::make_shared<std::promise<int>>();
+	std::shared_future<int> result = promise->get_future().share();
+
+	// tensors are captured by value to keep them alive until the estimation finished
+	std::thread([=]() mutable {
+		int inlierCount;
+
+		try
+		{
+			inlierCount = dsacstar_rgb_forward(
+				sceneCoordinatesSrc,
+				outPoseSrc,
+				ransacHypotheses,
+				inlierThreshold,
+				focalLength,
+				ppointX,
+				ppointY,
+				inlierAlpha,
+				maxReproj,
+				subSampling,
+				randomSeed,
+				max_hypotheses_tries,
+				adaptiveConfidence,
+				minHypotheses,
+				preemptiveSubset,
+				incrementalRefinement,
+				verbose);
+		}
+		catch(...)
+		{
+			sceneCoordinatesSrc.reset();
+			outPoseSrc.reset();
+			callbackPtr.reset();
+			promise->set_exception(std::current_exception());
+			return;
+		}
+
+		// tensors may reference Python objects, drop them while the interpreter is guaranteed to be alive
+		sceneCoordinatesSrc.reset();
+		outPoseSrc.reset();
+
+		// call and release the callback before publishing the result, so that the thread is
+		// done with Python once result() returned (the interpreter may shut down afterwards)
+		if(callbackPtr)
+		{
+			py::gil_scoped_acquire acquire;
+			try
+			{
+				(*callbackPtr)(inlierCount);
+			}
+			catch(py::error_already_set& e)
+			{
+				e.discard_as_unraisable("dsacstar.forward_rgb_async callback");
+			}
+			callbackPtr.reset();
+		}
+
+		promise->set_value(inlierCount);
+	}).detach();
+
+	return ForwardFuture(result);
 }
 //
 ///**
@@ -896,7 +1605,66 @@ int dsacstar_rgb_forward(
 //}
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
-	m.def("forward_rgb", &dsacstar_rgb_forward, "DSAC* forward (RGB)");
+	// the pose estimation does not touch Python objects, so other Python threads can run meanwhile
+	m.def("forward_rgb", &dsacstar_rgb_forward_py, "DSAC* forward (RGB)",
+		py::arg("scene_coordinates"),
+		py::arg("out_pose"),
+		py::arg("ransac_hypotheses"),
+		py::arg("inlier_threshold"),
+		py::arg("focal_length"),
+		py::arg("ppoint_x"),
+		py::arg("ppoint_y"),
+		py::arg("inlier_alpha"),
+		py::arg("max_reproj"),
+		py::arg("sub_sampling"),
+		py::arg("random_seed"),
+		py::arg("max_hypotheses_tries"),
+		py::arg("adaptive_confidence") = 0.f,
+		py::arg("min_hypotheses") = 16,
+		py::arg("preemptive_subset") = 0,
+		py::arg("incremental_refinement") = false,
+		py::arg("verbose") = false,
+		py::arg("profile") = py::none());
+	m.def("forward_rgb_async", &dsacstar_rgb_forward_async, "DSAC* forward (RGB) in a background thread",
+		py::arg("scene_coordinates"),
+		py::arg("out_pose"),
+		py::arg("ransac_hypotheses"),
+		py::arg("inlier_threshold"),
+		py::arg("focal_length"),
+		py::arg("ppoint_x"),
+		py::arg("ppoint_y"),
+		py::arg("inlier_alpha"),
+		py::arg("max_reproj"),
+		py::arg("sub_sampling"),
+		py::arg("random_seed"),
+		py::arg("max_hypotheses_tries"),
+		py::arg("adaptive_confidence") = 0.f,
+		py::arg("min_hypotheses") = 16,
+		py::arg("preemptive_subset") = 0,
+		py::arg("incremental_refinement") = false,
+		py::arg("verbose") = false,
+		py::arg("callback") = py::none());
+	m.def("forward_rgb_batch", &dsacstar_rgb_forward_batch_py, "DSAC* forward (RGB), batch of images",
+		py::arg("scene_coordinates"),
+		py::arg("intrinsics"),
+		py::arg("out_poses"),
+		py::arg("ransac_hypotheses"),
+		py::arg("inlier_threshold"),
+		py::arg("inlier_alpha"),
+		py::arg("max_reproj"),
+		py::arg("sub_sampling"),
+		py::arg("random_seed"),
+		py::arg("max_hypotheses_tries"),
+		py::arg("verbose") = false,
+		py::arg("profile") = py::none());
+	m.def("get_stats", &dsacstar_get_stats, "Aggregate profile of all pose estimations since loading or the last reset");
+	m.def("reset_stats", &dsacstar_reset_stats, "Reset the aggregate profile of pose estimations");
+	m.def("benchmark_repro_errs", &dsacstar_benchmark_repro_errs, "Microbenchmark of reprojection error calculation",
+		py::call_guard<py::gil_scoped_release>());
+
+	py::class_<ForwardFuture>(m, "ForwardFuture")
+		.def("done", &ForwardFuture::done, "True if the pose estimation has finished")
+		.def("result", &ForwardFuture::get, "Wait for the pose estimation and return the inlier count");
 //	m.def("backward_rgb", &dsacstar_rgb_backward, "DSAC* backward (RGB)");
 //	m.def("forward_rgbd", &dsacstar_rgbd_forward, "DSAC* forward (RGB-D)");
 //	m.def("backward_rgbd", &dsacstar_rgbd_backward, "DSAC* backward (RGB-D)");
@@ -0,0 +1,451 @@
+"""Pure PyTorch implementation of the DSAC* forward pass (RGB).
+
+Fallback for machines where the dsacstar C++ extension cannot be built (no OpenCV / OpenMP toolchain).
+forward_rgb has the same signature as dsacstar.forward_rgb, so it can be used as a drop-in replacement:
+
+    try:
+        import dsacstar
+    except ImportError:
+        import dsacstar_torch as dsacstar
+
+Instead of looping over hypotheses, all hypotheses are solved (P3P), scored (soft inlier counting) and
+checked as batched tensor operations. Refinement re-fits the winning pose to all inliers with
+Levenberg-Marquardt, like the iterative PnP of the C++ version.
+"""
+import threading
+import time
+
+import torch
+
+MAX_REF_STEPS = 100  # max pose refinement iterations
+MAX_LM_ITERATIONS = 20  # Levenberg-Marquardt iterations per refinement step
+
+PROFILE_KEYS = ("sampling_ms", "preemptive_ms", "scoring_ms", "selection_ms", "refinement_ms", "total_ms",
+                "hypotheses", "hypotheses_tried", "invalid_p3p", "refinement_steps", "inlier_count")
+
+# profile of all pose estimations since the module was loaded or the stats were reset, see get_stats
+_stats_lock = threading.Lock()
+_stats = dict.fromkeys(("poses",) + PROFILE_KEYS, 0)
+
+
+def create_sampling(width, height, sub_sampling, device):
+    """Calculate original image positions of a scene coordinate prediction.
+
+    Args:
+        width (int): width of the scene coordinate prediction
+        height (int): height of the scene coordinate prediction
+        sub_sampling (int): sub-sampling of the scene coordinate prediction wrt. to the input image
+        device (torch.device): device of the returned tensor
+
+    Returns:
+        torch.Tensor: (H*W, 2) image position (x, y) of each scene coordinate, row-major, float64
+    """
+    ys, xs = torch.meshgrid(
+        torch.arange(height, device=device), torch.arange(width, device=device), indexing="ij")
+    sampling = torch.stack([xs, ys], dim=-1) * sub_sampling + sub_sampling // 2
+    return sampling.reshape(-1, 2).double()
+
+
+def project(rotations, translations, points, focal_length, ppoint_x, ppoint_y):
+    """Project scene points into the image for a batch of poses (pinhole camera, no distortion).
+
+    Args:
+        rotations (torch.Tensor): (B, 3, 3) rotation matrices, scene to camera
+        translations (torch.Tensor): (B, 3) translations, scene to camera
+        points (torch.Tensor): (N, 3) or (B, N, 3) scene points
+        focal_length (float): focal length in px
+        ppoint_x (float): principal point x in px
+        ppoint_y (float): principal point y in px
+
+    Returns:
+        torch.Tensor: (B, N, 2) image positions
+    """
+    cam = points @ rotations.transpose(1, 2) + translations[:, None]
+    z = cam[..., 2:]
+    # same convention as cv::projectPoints for points on the camera plane
+    inv_z = torch.where(z != 0, 1 / z, torch.ones_like(z))
+    pp = cam.new_tensor([ppoint_x, ppoint_y])
+    return cam[..., :2] * inv_z * focal_length + pp
+
+
+def kabsch(src, dst):
+    """Batched rigid alignment, finds R, t with dst = R @ src + t in the least squares sense.
+
+    Args:
+        src (torch.Tensor): (B, N, 3) source points
+        dst (torch.Tensor): (B, N, 3) target points
+
+    Returns:
+        tuple: (B, 3, 3) rotations and (B, 3) translations
+    """
+    src_mean = src.mean(dim=1, keepdim=True)
+    dst_mean = dst.mean(dim=1, keepdim=True)
+
+    cov = (dst - dst_mean).transpose(1, 2) @ (src - src_mean)
+    u, _, vh = torch.linalg.svd(cov)
+
+    # avoid reflections
+    d = torch.sign(torch.linalg.det(u @ vh))
+    d = torch.where(d == 0, torch.ones_like(d), d)
+    correction = torch.diag_embed(torch.stack([torch.ones_like(d), torch.ones_like(d), d], dim=-1))
+
+    rotations = u @ correction @ vh
+    translations = dst_mean[:, 0] - (rotations @ src_mean[:, 0, :, None])[..., 0]
+    return rotations, translations
+
+
+def solve_p3p(bearings, points):
+    """Batched P3P solver (Grunert's method, see Haralick et al., IJCV 1994).
+
+    Args:
+        bearings (torch.Tensor): (B, 3, 3) unit bearing vectors of three image points
+        points (torch.Tensor): (B, 3, 3) corresponding scene points
+
+    Returns:
+        tuple: (B, 4, 3, 3) rotations, (B, 4, 3) translations and a (B, 4) mask of valid solutions
+    """
+    j1, j2, j3 = bearings.unbind(1)
+    p1, p2, p3 = points.unbind(1)
+
+    a2 = (p2 - p3).square().sum(-1)
+    b2 = (p1 - p3).square().sum(-1).clamp_min(1e-12)
+    c2 = (p1 - p2).square().sum(-1)
+
+    cos_a = (j2 * j3).sum(-1)
+    cos_b = (j1 * j3).sum(-1)
+    cos_g = (j1 * j2).sum(-1)
+
+    p = (a2 - c2) / b2
+    q = (a2 + c2) / b2
+    r = (b2 - c2) / b2
+    s = (b2 - a2) / b2
+
+    # quartic in v = s3 / s1
+    a4 = (p - 1) ** 2 - 4 * c2 / b2 * cos_a ** 2
+    a3 = 4 * (p * (1 - p) * cos_b - (1 - q) * cos_a * cos_g + 2 * c2 / b2 * cos_a ** 2 * cos_b)
+    a2_ = 2 * (p ** 2 - 1 + 2 * p ** 2 * cos_b ** 2 + 2 * r * cos_a ** 2 - 4 * q * cos_a * cos_b * cos_g
+               + 2 * s * cos_g ** 2)
+    a1 = 4 * (-p * (1 + p) * cos_b + 2 * a2 / b2 * cos_g ** 2 * cos_b - (1 - q) * cos_a * cos_g)
+    a0 = (1 + p) ** 2 - 4 * a2 / b2 * cos_g ** 2
+
+    degenerate = a4.abs() < 1e-10
+    a4 = torch.where(degenerate, torch.ones_like(a4), a4)
+
+    # roots as eigenvalues of the companion matrix
+    companion = bearings.new_zeros(bearings.shape[0], 4, 4)
+    companion[:, 0, :] = -torch.stack([a3, a2_, a1, a0], dim=-1) / a4[:, None]
+    companion[:, 1, 0] = 1
+    companion[:, 2, 1] = 1
+    companion[:, 3, 2] = 1
+    roots = torch.linalg.eigvals(companion)
+
+    v = roots.real
+    valid = (roots.imag.abs() < 1e-6 * (1 + v.abs())) & (v > 0) & ~degenerate[:, None]
+
+    cos_a, cos_b, cos_g, p = cos_a[:, None], cos_b[:, None], cos_g[:, None], p[:, None]
+    u = ((p - 1) * v ** 2 - 2 * p * cos_b * v + 1 + p) / (2 * (cos_g - v * cos_a))
+    s1 = (b2[:, None] / (1 + v ** 2 - 2 * v * cos_b)).sqrt()
+    valid &= (u > 0) & torch.isfinite(u) & torch.isfinite(s1)
+
+    # camera coordinates of the three points for each solution
+    dists = torch.stack([s1, u * s1, v * s1], dim=-1)  # B, 4, 3
+    dists = torch.where(valid[..., None], dists, torch.ones_like(dists))
+    cam_points = dists[..., None] * bearings[:, None]  # B, 4, 3, 3
+
+    num_hyps = bearings.shape[0]
+    rotations, translations = kabsch(
+        points[:, None].expand(-1, 4, -1, -1).reshape(-1, 3, 3), cam_points.reshape(-1, 3, 3))
+    return rotations.view(num_hyps, 4, 3, 3), translations.view(num_hyps, 4, 3), valid
+
+
+def sample_hypotheses(coords, sampling, num_hypotheses, max_tries, inlier_threshold, focal_length, ppoint_x,
+                      ppoint_y, generator):
+    """Sample RANSAC pose hypotheses from minimal sets of 4 correspondences.
+
+    P3P is solved on the first 3 correspondences, the 4th selects among the P3P solutions. Hypotheses
+    whose 4 correspondences do not reproject within the inlier threshold are re-sampled (all at once)
+    up to max_tries times.
+
+    Args:
+        coords (torch.Tensor): (H*W, 3) scene coordinates, float64
+        sampling (torch.Tensor): (H*W, 2) image positions of scene coordinates, float64
+        num_hypotheses (int): number of hypotheses
+        max_tries (int): re-sample an hypothesis this many times if it is invalid
+        inlier_threshold (float): inlier threshold in px
+        focal_length (float): focal length in px
+        ppoint_x (float): principal point x in px
+        ppoint_y (float): principal point y in px
+        generator (torch.Generator): random number generator
+
+    Returns:
+        tuple: (B, 3, 3) rotations, (B, 3) translations, the number of minimal sets drawn and the number of failed
+            P3P solves
+    """
+    device = coords.device
+    rotations = torch.eye(3, dtype=coords.dtype, device=device).repeat(num_hypotheses, 1, 1)
+    translations = coords.new_zeros(num_hypotheses, 3)
+    tries = 0
+    invalid_p3p = 0
+
+    pending = torch.arange(num_hypotheses, device=device)
+    for _ in range(max_tries):
+        if len(pending) == 0:
+            break
+        tries += len(pending)
+
+        idx = torch.randint(0, coords.shape[0], (len(pending), 4), generator=generator, device=device)
+        obj_pts = coords[idx]  # P, 4, 3
+        img_pts = sampling[idx]  # P, 4, 2
+
+        rays = torch.cat([(img_pts - img_pts.new_tensor([ppoint_x, ppoint_y])) / focal_length,
+                          torch.ones_like(img_pts[..., :1])], dim=-1)
+        bearings = rays / rays.norm(dim=-1, keepdim=True)
+
+        sol_rot, sol_trans, sol_valid = solve_p3p(bearings[:, :3], obj_pts[:, :3])
+
+        # select the solution which reprojects the 4th correspondence best
+        num_pending = len(pending)
+        fourth = project(sol_rot.reshape(-1, 3, 3), sol_trans.reshape(-1, 3),
+                         obj_pts[:, None, 3:].expand(-1, 4, -1, -1).reshape(-1, 1, 3),
+                         focal_length, ppoint_x, ppoint_y).view(num_pending, 4, 2)
+        fourth_err = (fourth - img_pts[:, None, 3]).norm(dim=-1)
+        fourth_err = torch.where(sol_valid, fourth_err, torch.full_like(fourth_err, float("inf")))
+        best = fourth_err.argmin(dim=1)
+
+        solved = sol_valid.any(dim=1)
+        invalid_p3p += int((~solved).sum())
+
+        arange = torch.arange(num_pending, device=device)
+        hyp_rot = torch.where(solved[:, None, None], sol_rot[arange, best], rotations[pending])
+        hyp_trans = torch.where(solved[:, None], sol_trans[arange, best], translations[pending])
+        rotations[pending] = hyp_rot
+        translations[pending] = hyp_trans
+
+        # check reconstruction, 4 sampled points should be reconstructed perfectly
+        reproj = project(hyp_rot, hyp_trans, obj_pts, focal_length, ppoint_x, ppoint_y)
+        accepted = solved & ((reproj - img_pts).norm(dim=-1) < inlier_threshold).all(dim=1)
+        pending = pending[~accepted]
+
+    return rotations, translations, tries, invalid_p3p
+
+
+def reprojection_errors(rotations, translations, coords, sampling, focal_length, ppoint_x, ppoint_y, max_reproj):
+    """Reprojection errors of all scene coordinates for a batch of poses, clamped to max_reproj.
+
+    Returns:
+        torch.Tensor: (B, H*W) reprojection errors in px
+    """
+    proj = project(rotations, translations, coords, focal_length, ppoint_x, ppoint_y)
+    return (proj - sampling).norm(dim=-1).clamp_max(max_reproj)
+
+
+def soft_inlier_scores(errors, inlier_threshold, inlier_alpha):
+    """Soft inlier counts of a batch of reprojection error images, see dsacstar::getHypScore."""
+    inlier_beta = 5 / inlier_threshold
+    return torch.sigmoid(-inlier_beta * (errors - inlier_threshold)).mean(dim=-1) * inlier_alpha
+
+
+def skew(v):
+    """(N, 3) vectors to (N, 3, 3) cross product matrices."""
+    zero = torch.zeros_like(v[:, 0])
+    return torch.stack([
+        torch.stack([zero, -v[:, 2], v[:, 1]], dim=-1),
+        torch.stack([v[:, 2], zero, -v[:, 0]], dim=-1),
+        torch.stack([-v[:, 1], v[:, 0], zero], dim=-1)], dim=1)
+
+
+def so3_exp(omega):
+    """Rotation matrix of an axis-angle vector (3,)."""
+    theta = omega.norm()
+    if theta < 1e-12:
+        return torch.eye(3, dtype=omega.dtype, device=omega.device) + skew(omega[None])[0]
+    k = skew((omega / theta)[None])[0]
+    return torch.eye(3, dtype=omega.dtype, device=omega.device) + torch.sin(theta) * k \
+        + (1 - torch.cos(theta)) * k @ k
+
+
+def solve_pnp_lm(rotation, translation, obj_pts, img_pts, focal_length, ppoint_x, ppoint_y,
+                 iterations=MAX_LM_ITERATIONS):
+    """Refine a pose on 2D-3D correspondences by minimizing the squared reprojection error (Levenberg-Marquardt).
+
+    Args:
+        rotation (torch.Tensor): (3, 3) initial rotation, scene to camera
+        translation (torch.Tensor): (3,) initial translation, scene to camera
+        obj_pts (torch.Tensor): (N, 3) scene points
+        img_pts (torch.Tensor): (N, 2) image points
+        iterations (int): maximum number of iterations
+
+    Returns:
+        tuple: refined (3, 3) rotation and (3,) translation
+    """
+    pp = obj_pts.new_tensor([ppoint_x, ppoint_y])
+    damping = 1e-3
+
+    def residuals(rot, trans):
+        cam = obj_pts @ rot.T + trans
+        return cam, (cam[:, :2] / cam[:, 2:] * focal_length + pp - img_pts).reshape(-1)
+
+    cam, res = residuals(rotation, translation)
+    cost = res.square().sum()
+
+    for _ in range(iterations):
+        # jacobean of the projection wrt. the camera coordinates
+        inv_z = 1 / cam[:, 2]
+        d_proj = cam.new_zeros(len(cam), 2, 3)
+        d_proj[:, 0, 0] = focal_length * inv_z
+        d_proj[:, 1, 1] = focal_length * inv_z
+        d_proj[:, :, 2] = -focal_length * cam[:, :2] * inv_z[:, None] ** 2
+
+        # camera coordinates wrt. a left-multiplied rotation update and the translation
+        d_cam = torch.cat([-skew(cam - translation), torch.eye(3, dtype=cam.dtype, device=cam.device).expand(len(cam), 3, 3)], dim=2)
+        jac = (d_proj @ d_cam).reshape(-1, 6)
+
+        jtj = jac.T @ jac
+        jtr = jac.T @ res
+
+        while True:
+            step = torch.linalg.solve(jtj + damping * torch.diag(jtj.diagonal()), -jtr)
+            new_rot = so3_exp(step[:3]) @ rotation
+            new_trans = translation + step[3:]
+            new_cam, new_res = residuals(new_rot, new_trans)
+            new_cost = new_res.square().sum()
+
+            if new_cost < cost or damping > 1e8:
+                break
+            damping *= 10
+
+        if not new_cost < cost:
+            break  # no further improvement
+
+        converged = (cost - new_cost) < 1e-10 * cost
+        rotation, translation, cam, res, cost = new_rot, new_trans, new_cam, new_res, new_cost
+        damping = max(damping / 10, 1e-7)
+
+        if converged:
+            break
+
+    return rotation, translation
+
+
+def forward_rgb(scene_coordinates, out_pose, ransac_hypotheses, inlier_threshold, focal_length, ppoint_x, ppoint_y,
+                inlier_alpha, max_reproj, sub_sampling, random_seed, max_hypotheses_tries,
+                adaptive_confidence=0., min_hypotheses=16, preemptive_subset=0, incremental_refinement=False,
+                verbose=False, profile=None):
+    """Estimate a camera pose based on a scene coordinate prediction, see dsacstar.forward_rgb.
+
+    adaptive_confidence, min_hypotheses, preemptive_subset and incremental_refinement are accepted for
+    compatibility with the C++ extension, but have no effect. All hypotheses are scored densely in one batch.
+
+    Args:
+        scene_coordinates (torch.Tensor): (1, 3, H, W) scene coordinate prediction
+        out_pose (torch.Tensor): (4, 4) output camera pose, camera to scene transformation
+        ransac_hypotheses (int): number of RANSAC hypotheses
+        inlier_threshold (float): inlier threshold in px
+        focal_length (float): focal length in px
+        ppoint_x (float): principal point x in px
+        ppoint_y (float): principal point y in px
+        inlier_alpha (float): alpha parameter for soft inlier counting
+        max_reproj (float): reprojection errors are clamped above this value (px)
+        sub_sampling (int): sub-sampling of the scene coordinate prediction wrt. the input image
+        random_seed (int): random seed for sampling hypotheses
+        max_hypotheses_tries (int): number of times to repeat sampling if a hypothesis is invalid
+        verbose (bool): print progress and timings
+        profile (dict, optional): filled with stage times (ms) and counters of this call, see PROFILE_KEYS
+
+    Returns:
+        int: number of inliers of the output pose
+    """
+    height, width = scene_coordinates.shape[2:]
+    device = scene_coordinates.device
+
+    coords = scene_coordinates[0].reshape(3, -1).T.double()
+    sampling = create_sampling(width, height, sub_sampling, device)
+    generator = torch.Generator(device=device).manual_seed(random_seed)
+
+    prof = dict.fromkeys(PROFILE_KEYS, 0)
+    total_start = start = time.time()
+
+    rotations, translations, prof["hypotheses_tried"], prof["invalid_p3p"] = sample_hypotheses(
+        coords, sampling, ransac_hypotheses, max_hypotheses_tries, inlier_threshold, focal_length, ppoint_x,
+        ppoint_y, generator)
+    prof["hypotheses"] = ransac_hypotheses
+    prof["sampling_ms"] = (time.time() - start) * 1000
+    start = time.time()
+
+    if verbose:
+        print(f"Sampled {ransac_hypotheses} hypotheses in {prof['sampling_ms'] / 1000}s.")
+
+    errors = reprojection_errors(
+        rotations, translations, coords, sampling, focal_length, ppoint_x, ppoint_y, max_reproj)
+    scores = soft_inlier_scores(errors, inlier_threshold, inlier_alpha)
+    prof["scoring_ms"] = (time.time() - start) * 1000
+    start = time.time()
+
+    hyp_idx = int(scores.argmax())
+    prof["selection_ms"] = (time.time() - start) * 1000
+    start = time.time()
+
+    if verbose:
+        print(f"Scored hypotheses in {prof['scoring_ms'] / 1000}s. Soft inlier count: {float(scores[hyp_idx])}")
+
+    # refine the winning hypothesis as long as the inlier count increases
+    rotation, translation = rotations[hyp_idx], translations[hyp_idx]
+    hyp_errors = errors[hyp_idx]
+    inlier_count = 0
+    best_inliers = 4
+
+    for _ in range(MAX_REF_STEPS):
+        inliers = hyp_errors < inlier_threshold
+        num_inliers = int(inliers.sum())
+        if num_inliers <= best_inliers:
+            break  # converged
+        best_inliers = num_inliers
+
+        rotation, translation = solve_pnp_lm(
+            rotation, translation, coords[inliers], sampling[inliers], focal_length, ppoint_x, ppoint_y)
+        inlier_count = num_inliers
+        prof["refinement_steps"] += 1
+
+        hyp_errors = reprojection_errors(
+            rotation[None], translation[None], coords, sampling, focal_length, ppoint_x, ppoint_y, max_reproj)[0]
+
+    prof["refinement_ms"] = (time.time() - start) * 1000
+
+    if verbose:
+        print(f"Refined winning pose in {prof['refinement_ms'] / 1000}s.")
+
+    # camera transformation is the inverted scene pose
+    scene_pose = torch.eye(4, dtype=torch.float64, device=device)
+    scene_pose[:3, :3] = rotation
+    scene_pose[:3, 3] = translation
+    out_pose.copy_(torch.linalg.inv(scene_pose))
+
+    prof["inlier_count"] = inlier_count
+    prof["total_ms"] = (time.time() - total_start) * 1000
+
+    with _stats_lock:
+        _stats["poses"] += 1
+        for key in PROFILE_KEYS:
+            _stats[key] += prof[key]
+
+    if profile is not None:
+        profile.update(prof)
+
+    return inlier_count
+
+
+def get_stats():
+    """Aggregate profile of all pose estimations since the module was loaded or the stats were reset.
+
+    Returns:
+        dict: number of estimated poses, summed stage times (ms) and summed counters
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    """Reset the aggregate profile of pose estimations."""
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
@@ -44,4 +44,49 @@ namespace dsacstar
 	typedef cv::Mat_<double> trans_t;
 	// ATen accessor type
 	typedef at::TensorAccessor<float, 4> coord_t;
+
+	// counters of hypothesis sampling
+	struct sample_stats_t
+	{
+		long tries = 0; // minimal sets drawn, including re-sampling of invalid hypotheses
+		long invalidP3P = 0; // minimal sets for which P3P failed
+
+		sample_stats_t& operator+=(const sample_stats_t& other)
+		{
+			tries += other.tries;
+			invalidP3P += other.invalidP3P;
+			return *this;
+		}
+	};
+
+	// wall times (ms) and counters of pose estimation calls, summed over images of a batch
+	struct profile_t
+	{
+		double samplingMs = 0; // includes scoring if hypotheses are sampled adaptively
+		double preemptiveMs = 0;
+		double scoringMs = 0;
+		double selectionMs = 0;
+		double refinementMs = 0;
+		double totalMs = 0;
+
+		long hypotheses = 0; // hypotheses sampled
+		sample_stats_t sampling;
+		long refinementSteps = 0; // accepted pose updates during refinement
+		long inlierCount = 0; // inliers of the output pose(s)
+
+		profile_t& operator+=(const profile_t& other)
+		{
+			samplingMs += other.samplingMs;
+			preemptiveMs += other.preemptiveMs;
+			scoringMs += other.scoringMs;
+			selectionMs += other.selectionMs;
+			refinementMs += other.refinementMs;
+			totalMs += other.totalMs;
+			hypotheses += other.hypotheses;
+			sampling += other.sampling;
+			refinementSteps += other.refinementSteps;
+			inlierCount += other.inlierCount;
+			return *this;
+		}
+	};
 }
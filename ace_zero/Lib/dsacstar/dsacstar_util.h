@@ -44,6 +44,7 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 #define EPS 0.00000001
 #define PI 3.1415926
+#define RAND_DOMAIN_PREEMPTIVE 1 // random stream domain of the scene coordinate order in pre-emptive scoring
 
 namespace dsacstar
 {
@@ -120,94 +121,91 @@ namespace dsacstar
 	}
 
 	/**
-	* @brief Samples a set of RANSAC camera pose hypotheses using PnP
-	* @param sceneCoordinates Scene coordinate prediction (1x3xHxW).
+	* @brief Samples a single RANSAC camera pose hypothesis using PnP
+	* @param sceneCoordinates Scene coordinate prediction (Nx3xHxW).
+	* @param batchIdx Index of the image in the batch to sample from.
 	* @param sampling Contains original image coordinate for each scene coordinate predicted.
 	* @param camMat Camera calibration matrix.
-	* @param ransacHypotheses RANSAC iterations.
-	* @param maxTries Repeat sampling an hypothesis if it is invalid
+	* @param maxTries Repeat sampling the hypothesis if it is invalid
 	* @param inlierThreshold RANSAC inlier threshold in px.
-	* @param hypotheses (output parameter) List of sampled pose hypotheses.
-	* @param sampledPoints (output parameter) Corresponding minimal set for each hypotheses, scene coordinate indices.
-	* @param imgPts (output parameter) Corresponding minimal set for each hypotheses, 2D image coordinates.
-	* @param objPts (output parameter) Corresponding minimal set for each hypotheses, 3D scene coordinates.
+	* @param rng Random number generator of this hypothesis.
+	* @param hypothesis (output parameter) Sampled pose hypothesis.
+	* @param sampledPoints (output parameter) Minimal set of the hypothesis, scene coordinate indices.
+	* @param imgPts (output parameter) Minimal set of the hypothesis, 2D image coordinates.
+	* @param objPts (output parameter) Minimal set of the hypothesis, 3D scene coordinates.
+	* @return Number of tries and P3P failures.
 	*/
-	inline void sampleHypotheses(
+	inline dsacstar::sample_stats_t sampleHypothesis(
 		dsacstar::coord_t& sceneCoordinates,
+		int batchIdx,
 		const cv::Mat_<cv::Point2i>& sampling,
 		const cv::Mat_<float>& camMat,
-		int ransacHypotheses,
 		unsigned maxTries,
 		float inlierThreshold,
-		std::vector<dsacstar::pose_t>& hypotheses,
-		std::vector<std::vector<cv::Point2i>>& sampledPoints,     
-		std::vector<std::vector<cv::Point2f>>& imgPts,
-		std::vector<std::vector<cv::Point3f>>& objPts)
+		CounterRand& rng,
+		dsacstar::pose_t& hypothesis,
+		std::vector<cv::Point2i>& sampledPoints,
+		std::vector<cv::Point2f>& imgPts,
+		std::vector<cv::Point3f>& objPts)
 	{
 		int imH = sceneCoordinates.size(2);
 		int imW = sceneCoordinates.size(3);
 
-		// keep track of the points each hypothesis is sampled from
-		sampledPoints.resize(ransacHypotheses);     
-		imgPts.resize(ransacHypotheses);
-		objPts.resize(ransacHypotheses);
-		hypotheses.resize(ransacHypotheses);
+		dsacstar::sample_stats_t stats;
 
-		// sample hypotheses
-		#pragma omp parallel for
-		for(unsigned h = 0; h < hypotheses.size(); h++)
 		for(unsigned t = 0; t < maxTries; t++)
 		{
-			int batchIdx = 0; // only batch size=1 supported atm
+			stats.tries++;
 
 			std::vector<cv::Point2f> projections;
-			imgPts[h].clear();
-			objPts[h].clear();
-			sampledPoints[h].clear();
+			imgPts.clear();
+			objPts.clear();
+			sampledPoints.clear();
 
 			for(int j = 0; j < 4; j++)
 			{
 				// 2D location in the subsampled image
-				int x = irand(0, imW);
-				int y = irand(0, imH);
+				int x = rng.irand(0, imW);
+				int y = rng.irand(0, imH);
 
 				// 2D location in the original RGB image
-				imgPts[h].push_back(sampling(y, x)); 
+				imgPts.push_back(sampling(y, x)); 
 				// 3D object coordinate
-				objPts[h].push_back(cv::Point3f(
+				objPts.push_back(cv::Point3f(
 					sceneCoordinates[batchIdx][0][y][x],
 					sceneCoordinates[batchIdx][1][y][x],
 					sceneCoordinates[batchIdx][2][y][x])); 
 				// 2D pixel location in the subsampled image
-				sampledPoints[h].push_back(cv::Point2i(x, y)); 
+				sampledPoints.push_back(cv::Point2i(x, y)); 
 			}
 
 			if(!dsacstar::safeSolvePnP(
-				objPts[h], 
-				imgPts[h], 
+				objPts, 
+				imgPts, 
 				camMat, 
 				cv::Mat(), 
-				hypotheses[h].first, 
-				hypotheses[h].second, 
+				hypothesis.first, 
+				hypothesis.second, 
 				false, 
 				cv::SOLVEPNP_P3P))
 			{
+				stats.invalidP3P++;
 				continue;
 			}
 
 			// check reconstruction, 4 sampled points should be reconstructed perfectly
 			cv::projectPoints(
-				objPts[h], 
-				hypotheses[h].first, 
-				hypotheses[h].second, 
+				objPts, 
+				hypothesis.first, 
+				hypothesis.second, 
 				camMat, 
 				cv::Mat(), 
 				projections);
 
 			bool foundOutlier = false;
-			for(unsigned j = 0; j < imgPts[h].size(); j++)
+			for(unsigned j = 0; j < imgPts.size(); j++)
 			{
-				if(cv::norm(imgPts[h][j] - projections[j]) < inlierThreshold)
+				if(cv::norm(imgPts[j] - projections[j]) < inlierThreshold)
 					continue;
 				foundOutlier = true;
 				break;
@@ -217,7 +215,76 @@ namespace dsacstar
 				continue;
 			else
 				break;			
-		}		
+		}
+
+		return stats;
+	}
+
+	/**
+	* @brief Samples a set of RANSAC camera pose hypotheses using PnP
+	* @param sceneCoordinates Scene coordinate prediction (Nx3xHxW).
+	* @param sampling Contains original image coordinate for each scene coordinate predicted.
+	* @param camMat Camera calibration matrix.
+	* @param ransacHypotheses RANSAC iterations.
+	* @param maxTries Repeat sampling an hypothesis if it is invalid
+	* @param inlierThreshold RANSAC inlier threshold in px.
+	* @param randomSeed Random seed, hypothesis h draws from stream h of this seed.
+	* @param hypotheses (output parameter) List of sampled pose hypotheses.
+	* @param sampledPoints (output parameter) Corresponding minimal set for each hypotheses, scene coordinate indices.
+	* @param imgPts (output parameter) Corresponding minimal set for each hypotheses, 2D image coordinates.
+	* @param objPts (output parameter) Corresponding minimal set for each hypotheses, 3D scene coordinates.
+	* @param batchIdx Index of the image in the batch to sample from.
+	* @return Number of tries and P3P failures, summed over hypotheses.
+	*/
+	inline dsacstar::sample_stats_t sampleHypotheses(
+		dsacstar::coord_t& sceneCoordinates,
+		const cv::Mat_<cv::Point2i>& sampling,
+		const cv::Mat_<float>& camMat,
+		int ransacHypotheses,
+		unsigned maxTries,
+		float inlierThreshold,
+		unsigned randomSeed,
+		std::vector<dsacstar::pose_t>& hypotheses,
+		std::vector<std::vector<cv::Point2i>>& sampledPoints,     
+		std::vector<std::vector<cv::Point2f>>& imgPts,
+		std::vector<std::vector<cv::Point3f>>& objPts,
+		int batchIdx = 0)
+	{
+		// keep track of the points each hypothesis is sampled from
+		sampledPoints.resize(ransacHypotheses);     
+		imgPts.resize(ransacHypotheses);
+		objPts.resize(ransacHypotheses);
+		hypotheses.resize(ransacHypotheses);
+
+		long tries = 0, invalidP3P = 0;
+
+		// sample hypotheses
+		#pragma omp parallel for reduction(+:tries, invalidP3P)
+		for(unsigned h = 0; h < hypotheses.size(); h++)
+		{
+			CounterRand rng(randomSeed, h);
+
+			dsacstar::sample_stats_t stats = dsacstar::sampleHypothesis(
+				sceneCoordinates,
+				batchIdx,
+				sampling,
+				camMat,
+				maxTries,
+				inlierThreshold,
+				rng,
+				hypotheses[h],
+				sampledPoints[h],
+				imgPts[h],
+				objPts[h]);
+
+			tries += stats.tries;
+			invalidP3P += stats.invalidP3P;
+		}
+
+		dsacstar::sample_stats_t stats;
+		stats.tries = tries;
+		stats.invalidP3P = invalidP3P;
+		return stats;
 	}
 
 //	/**
@@ -306,6 +373,34 @@ namespace dsacstar
 //		}
 //	}
 
+	/**
+	* @brief Calculate the soft inlier count of a single hypothesis.
+	* @param reproErrs Image of reprojection error of the pose hypothesis.
+	* @param inlierThreshold RANSAC inlier threshold.
+	* @param inlierAlpha Alpha parameter for soft inlier counting.
+	* @return Soft inlier count.
+	*/
+	inline double getHypScore(
+		const cv::Mat_<float>& reproErrs,
+		float inlierThreshold,
+		float inlierAlpha)
+	{
+		double score = 0;
+
+		// beta parameter for soft inlier counting
+		float inlierBeta = 5 / inlierThreshold;
+
+		for(int x = 0; x < reproErrs.cols; x++)
+		for(int y = 0; y < reproErrs.rows; y++)
+		{
+			double softThreshold = inlierBeta * (reproErrs(y, x) - inlierThreshold);
+			softThreshold = 1 / (1+std::exp(-softThreshold));
+			score += 1 - softThreshold;
+		}
+
+		return score * inlierAlpha / reproErrs.cols / reproErrs.rows;
+	}
+
 	/**
 	* @brief Calculate soft inlier counts.
 	* @param reproErrs Image of reprojection error for each pose hypothesis.
@@ -320,26 +415,143 @@ namespace dsacstar
 	{
 		std::vector<double> scores(reproErrs.size(), 0);
 
-		// beta parameter for soft inlier counting
-		float inlierBeta = 5 / inlierThreshold;
-
 		#pragma omp parallel for
 		for(unsigned h = 0; h < reproErrs.size(); h++)
-		for(int x = 0; x < reproErrs[h].cols; x++)
-		for(int y = 0; y < reproErrs[h].rows; y++)
+			scores[h] = dsacstar::getHypScore(reproErrs[h], inlierThreshold, inlierAlpha);
+
+		return scores;
+	}
+
+	/**
+	* @brief Calculate the number of RANSAC hypotheses needed to draw an all-inlier minimal set with a given confidence.
+	* @param inlierRatio Estimated ratio of inliers among all scene coordinates.
+	* @param confidence Desired probability of drawing at least one all-inlier minimal set.
+	* @param sampleSize Number of correspondences in a minimal set.
+	* @param maxHypotheses Upper bound of the returned number.
+	* @return Required number of hypotheses.
+	*/
+	inline int getRequiredHypotheses(
+		double inlierRatio,
+		double confidence,
+		int sampleSize,
+		int maxHypotheses)
+	{
+		double allInlierProb = std::pow(inlierRatio, sampleSize);
+
+		if(!(allInlierProb > EPS)) return maxHypotheses; // also catches NaN
+		if(allInlierProb >= 1 - EPS) return 1;
+
+		double required = std::ceil(std::log(1 - confidence) / std::log(1 - allInlierProb));
+		return (int) std::max(1.0, std::min(required, (double) maxHypotheses));
+	}
+
+	/**
+	* @brief Pinhole projection of scene coordinates under a fixed pose hypothesis.
+	*
+	* Holds the rotation matrix, translation and intrinsics in single precision, so that projecting
+	* a scene coordinate needs no allocation and can be vectorized by the compiler.
+	*/
+	struct PinholeProjector
+	{
+		float r00, r01, r02, r10, r11, r12, r20, r21, r22; // rotation matrix
+		float t0, t1, t2; // translation
+		float fx, fy, cx, cy; // intrinsics
+
+		/**
+		* @brief Constructor.
+		* @param hyp Pose hypothesis (axis-angle and translation, double precision).
+		* @param camMat Camera calibration matrix (single or double precision).
+		*/
+		PinholeProjector(const dsacstar::pose_t& hyp, const cv::Mat& camMat)
 		{
-			double softThreshold = inlierBeta * (reproErrs[h](y, x) - inlierThreshold);
-			softThreshold = 1 / (1+std::exp(-softThreshold));
-			scores[h] += 1 - softThreshold;
+			cv::Matx33d rot;
+			cv::Rodrigues(hyp.first, rot);
+
+			r00 = rot(0, 0); r01 = rot(0, 1); r02 = rot(0, 2);
+			r10 = rot(1, 0); r11 = rot(1, 1); r12 = rot(1, 2);
+			r20 = rot(2, 0); r21 = rot(2, 1); r22 = rot(2, 2);
+
+			t0 = hyp.second.at<double>(0);
+			t1 = hyp.second.at<double>(1);
+			t2 = hyp.second.at<double>(2);
+
+			cv::Mat_<double> K(camMat);
+			fx = K(0, 0); fy = K(1, 1);
+			cx = K(0, 2); cy = K(1, 2);
 		}
 
-		#pragma omp parallel for
-		for(unsigned h = 0; h < reproErrs.size(); h++)
+		/**
+		* @brief Reprojection error of a single scene coordinate.
+		* @param X, Y, Z Scene coordinate.
+		* @param px, py Image position of the scene coordinate.
+		* @param maxReproj Reprojection errors are clamped to this maximum value.
+		* @return Reprojection error in px.
+		*/
+		inline float reproErr(float X, float Y, float Z, float px, float py, float maxReproj) const
 		{
-			scores[h] *= inlierAlpha / reproErrs[h].cols / reproErrs[h].rows;
+			float camX = r00 * X + r01 * Y + r02 * Z + t0;
+			float camY = r10 * X + r11 * Y + r12 * Z + t1;
+			float camZ = r20 * X + r21 * Y + r22 * Z + t2;
+
+			// same convention as cv::projectPoints for points on the camera plane
+			float invZ = (camZ != 0) ? 1.f / camZ : 1.f;
+
+			float dx = px - (fx * camX * invZ + cx);
+			float dy = py - (fy * camY * invZ + cy);
+
+			return std::min(std::sqrt(dx * dx + dy * dy), maxReproj);
 		}
+	};
 
-		return scores;
+	/**
+	* @brief Calculate image of reprojection errors into a given buffer.
+	*
+	* Dedicated kernel for a pinhole camera without distortion. Projects directly from the scene
+	* coordinate tensor memory, row by row. The buffer is only (re-)allocated if its size does not
+	* match, so it can be reused across hypotheses and refinement steps.
+	*
+	* @param sceneCoordinates Scene coordinate prediction (Nx3xHxW).
+	* @param hyp Pose hypothesis to calculate the errors for.
+	* @param sampling Contains original image coordinate for each scene coordinate predicted.
+	* @param camMat Camera calibration matrix.
+	* @param maxReproj Reprojection errors are clamped to this maximum value.
+	* @param reproErrs (output parameter) Image of reprojection errors.
+	* @param batchIdx Index of the image in the batch to calculate the errors for.
+	*/
+	inline void projectReproErrs(
+		dsacstar::coord_t& sceneCoordinates,
+		const dsacstar::pose_t& hyp,
+		const cv::Mat_<cv::Point2i>& sampling,
+		const cv::Mat& camMat,
+		float maxReproj,
+		cv::Mat_<float>& reproErrs,
+		int batchIdx = 0)
+	{
+		reproErrs.create(sampling.size());
+
+		const dsacstar::PinholeProjector proj(hyp, camMat);
+		const int stride = sceneCoordinates.stride(3);
+
+		for(int y = 0; y < sampling.rows; y++)
+		{
+			const float* coordX = sceneCoordinates[batchIdx][0][y].data();
+			const float* coordY = sceneCoordinates[batchIdx][1][y].data();
+			const float* coordZ = sceneCoordinates[batchIdx][2][y].data();
+			const cv::Point2i* pts2D = sampling[y];
+			float* errs = reproErrs[y];
+
+			#pragma omp simd
+			for(int x = 0; x < sampling.cols; x++)
+			{
+				errs[x] = proj.reproErr(
+					coordX[x * stride],
+					coordY[x * stride],
+					coordZ[x * stride],
+					pts2D[x].x,
+					pts2D[x].y,
+					maxReproj);
+			}
+		}
 	}
 
 	/**
@@ -351,6 +563,8 @@ namespace dsacstar
 	* @param maxReproj Reprojection errors are clamped to this maximum value.
 	* @param jacobeanHyp Jacobean matrix with derivatives of the 6D pose wrt. the reprojection error (num pts x 6).
 	* @param calcJ Whether to calculate the jacobean matrix or not.
+	* @param batchIdx Index of the image in the batch to calculate the errors for.
+	* @param useKernel Use the dedicated pinhole kernel (projectReproErrs) instead of cv::projectPoints if no jacobean is needed.
 	* @return Image of reprojection errors.
 	*/
 	cv::Mat_<float> getReproErrs(
@@ -360,11 +574,27 @@ namespace dsacstar
 		const cv::Mat& camMat,
 		float maxReproj,
 	  	cv::Mat_<double>& jacobeanHyp,
-  		bool calcJ = false)
+  		bool calcJ = false,
+  		int batchIdx = 0,
+  		bool useKernel = true)
 	{
-		int batchIdx = 0; // only batch size=1 supported atm
+		cv::Mat_<float> reproErrs;
 
-		cv::Mat_<float> reproErrs = cv::Mat_<float>::zeros(sampling.size());
+		if(!calcJ && useKernel)
+		{
+			dsacstar::projectReproErrs(
+				sceneCoordinates,
+				hyp,
+				sampling,
+				camMat,
+				maxReproj,
+				reproErrs,
+				batchIdx);
+
+			return reproErrs;
+		}
+
+		reproErrs = cv::Mat_<float>::zeros(sampling.size());
 
 		std::vector<cv::Point3f> points3D;
 		std::vector<cv::Point2f> projections;	
@@ -445,6 +675,227 @@ namespace dsacstar
 		return reproErrs;    
 	}
 
+	/**
+	* @brief Samples and scores RANSAC hypotheses until the best hypothesis is found with the given confidence.
+	*
+	* Hypotheses are drawn in chunks. After each chunk, the soft inlier ratio of the best hypothesis so far is used
+	* to estimate how many hypotheses are needed to draw an all-inlier minimal set with the given confidence.
+	* Sampling stops as soon as that number (but at least minHypotheses) has been reached.
+	*
+	* @param sceneCoordinates Scene coordinate prediction (Nx3xHxW).
+	* @param sampling Contains original image coordinate for each scene coordinate predicted.
+	* @param camMat Camera calibration matrix.
+	* @param minHypotheses Minimum number of hypotheses to draw.
+	* @param maxHypotheses Maximum number of hypotheses to draw.
+	* @param confidence Desired probability of having drawn an all-inlier minimal set when stopping.
+	* @param maxTries Repeat sampling an hypothesis if it is invalid
+	* @param inlierThreshold RANSAC inlier threshold in px.
+	* @param inlierAlpha Alpha parameter for soft inlier counting.
+	* @param maxReproj Reprojection errors are clamped to this maximum value.
+	* @param randomSeed Random seed, hypothesis h draws from stream h of this seed.
+	* @param hypotheses (output parameter) List of sampled pose hypotheses.
+	* @param sampledPoints (output parameter) Corresponding minimal set for each hypotheses, scene coordinate indices.
+	* @param imgPts (output parameter) Corresponding minimal set for each hypotheses, 2D image coordinates.
+	* @param objPts (output parameter) Corresponding minimal set for each hypotheses, 3D scene coordinates.
+	* @param reproErrs (output parameter) Image of reprojection errors for each hypothesis.
+	* @param scores (output parameter) Soft inlier count for each hypothesis.
+	* @param batchIdx Index of the image in the batch to sample from.
+	* @return Number of tries and P3P failures, summed over hypotheses.
+	*/
+	inline dsacstar::sample_stats_t sampleHypothesesAdaptive(
+		dsacstar::coord_t& sceneCoordinates,
+		const cv::Mat_<cv::Point2i>& sampling,
+		const cv::Mat_<float>& camMat,
+		int minHypotheses,
+		int maxHypotheses,
+		float confidence,
+		unsigned maxTries,
+		float inlierThreshold,
+		float inlierAlpha,
+		float maxReproj,
+		unsigned randomSeed,
+		std::vector<dsacstar::pose_t>& hypotheses,
+		std::vector<std::vector<cv::Point2i>>& sampledPoints,
+		std::vector<std::vector<cv::Point2f>>& imgPts,
+		std::vector<std::vector<cv::Point3f>>& objPts,
+		std::vector<cv::Mat_<float>>& reproErrs,
+		std::vector<double>& scores,
+		int batchIdx = 0)
+	{
+		minHypotheses = std::max(1, std::min(minHypotheses, maxHypotheses));
+
+		// draw one hypothesis per thread in each chunk after the initial minHypotheses
+		int chunkSize = omp_get_max_threads();
+
+		int numHypotheses = 0;
+		int requiredHypotheses = maxHypotheses;
+		double bestInlierRatio = 0;
+		long tries = 0, invalidP3P = 0;
+
+		while(numHypotheses < std::max(minHypotheses, requiredHypotheses))
+		{
+			int chunkEnd = (numHypotheses == 0) ? minHypotheses : numHypotheses + chunkSize;
+			chunkEnd = std::min(chunkEnd, maxHypotheses);
+
+			hypotheses.resize(chunkEnd);
+			sampledPoints.resize(chunkEnd);
+			imgPts.resize(chunkEnd);
+			objPts.resize(chunkEnd);
+			reproErrs.resize(chunkEnd);
+			scores.resize(chunkEnd);
+
+			#pragma omp parallel for reduction(+:tries, invalidP3P)
+			for(int h = numHypotheses; h < chunkEnd; h++)
+			{
+				CounterRand rng(randomSeed, h);
+
+				dsacstar::sample_stats_t stats = dsacstar::sampleHypothesis(
+					sceneCoordinates,
+					batchIdx,
+					sampling,
+					camMat,
+					maxTries,
+					inlierThreshold,
+					rng,
+					hypotheses[h],
+					sampledPoints[h],
+					imgPts[h],
+					objPts[h]);
+
+				tries += stats.tries;
+				invalidP3P += stats.invalidP3P;
+
+				cv::Mat_<double> jacobeanDummy;
+
+				reproErrs[h] = dsacstar::getReproErrs(
+					sceneCoordinates,
+					hypotheses[h],
+					sampling,
+					camMat,
+					maxReproj,
+					jacobeanDummy,
+					false,
+					batchIdx);
+
+				scores[h] = dsacstar::getHypScore(
+					reproErrs[h],
+					inlierThreshold,
+					inlierAlpha);
+			}
+
+			// soft inlier counts are inlier ratios scaled by alpha
+			for(int h = numHypotheses; h < chunkEnd; h++)
+				bestInlierRatio = std::max(bestInlierRatio, scores[h] / inlierAlpha);
+
+			numHypotheses = chunkEnd;
+
+			// a P3P minimal set consists of 4 correspondences (3 for solving, 1 for disambiguation)
+			requiredHypotheses = dsacstar::getRequiredHypotheses(
+				bestInlierRatio,
+				confidence,
+				4,
+				maxHypotheses);
+		}
+
+		dsacstar::sample_stats_t stats;
+		stats.tries = tries;
+		stats.invalidP3P = invalidP3P;
+		return stats;
+	}
+
+	/**
+	* @brief Pre-emptively score RANSAC hypotheses on growing random subsets of scene coordinates.
+	*
+	* In the spirit of pre-emptive RANSAC (Nister, ICCV03), all hypotheses are scored on a small random subset of
+	* scene coordinates first. The worse half of hypotheses is dropped, and the remaining hypotheses are scored on
+	* the next, twice as large subset. This is repeated until only numSurvivors hypotheses remain or all scene
+	* coordinates have been used. Scores accumulate over subsets, so survivors are ranked by all points seen so far.
+	*
+	* @param sceneCoordinates Scene coordinate prediction (Nx3xHxW).
+	* @param hypotheses List of pose hypotheses to score.
+	* @param sampling Contains original image coordinate for each scene coordinate predicted.
+	* @param camMat Camera calibration matrix.
+	* @param initialSubset Number of scene coordinates in the first subset.
+	* @param numSurvivors Stop when this many hypotheses remain.
+	* @param inlierThreshold RANSAC inlier threshold.
+	* @param maxReproj Reprojection errors are clamped to this maximum value.
+	* @param randomSeed Random seed for the order of scene coordinates.
+	* @param batchIdx Index of the image in the batch the hypotheses belong to.
+	* @return Indices of surviving hypotheses, best first.
+	*/
+	inline std::vector<int> preemptiveScoring(
+		dsacstar::coord_t& sceneCoordinates,
+		const std::vector<dsacstar::pose_t>& hypotheses,
+		const cv::Mat_<cv::Point2i>& sampling,
+		const cv::Mat_<float>& camMat,
+		int initialSubset,
+		int numSurvivors,
+		float inlierThreshold,
+		float maxReproj,
+		unsigned randomSeed,
+		int batchIdx = 0)
+	{
+		int numPts = sampling.rows * sampling.cols;
+
+		// random order in which scene coordinates are visited, separate from the hypothesis streams
+		CounterRand rng(randomSeed, batchIdx, RAND_DOMAIN_PREEMPTIVE);
+
+		std::vector<int> ptOrder(numPts);
+		for(int i = 0; i < numPts; i++) ptOrder[i] = i;
+		for(int i = numPts - 1; i > 0; i--) std::swap(ptOrder[i], ptOrder[rng.irand(0, i + 1)]);
+
+		std::vector<int> survivors(hypotheses.size());
+		for(unsigned h = 0; h < hypotheses.size(); h++) survivors[h] = h;
+
+		std::vector<double> partialScores(hypotheses.size(), 0);
+
+		// beta parameter for soft inlier counting
+		float inlierBeta = 5 / inlierThreshold;
+
+		int blockStart = 0;
+		int blockSize = std::max(1, initialSubset);
+
+		while((int) survivors.size() > numSurvivors && blockStart < numPts)
+		{
+			int blockEnd = std::min(blockStart + blockSize, numPts);
+
+			#pragma omp parallel for
+			for(unsigned s = 0; s < survivors.size(); s++)
+			{
+				int h = survivors[s];
+				const dsacstar::PinholeProjector proj(hypotheses[h], camMat);
+
+				for(int i = blockStart; i < blockEnd; i++)
+				{
+					int x = ptOrder[i] % sampling.cols;
+					int y = ptOrder[i] / sampling.cols;
+
+					float err = proj.reproErr(
+						sceneCoordinates[batchIdx][0][y][x],
+						sceneCoordinates[batchIdx][1][y][x],
+						sceneCoordinates[batchIdx][2][y][x],
+						sampling(y, x).x,
+						sampling(y, x).y,
+						maxReproj);
+
+					double softThreshold = inlierBeta * (err - inlierThreshold);
+					softThreshold = 1 / (1+std::exp(-softThreshold));
+					partialScores[h] += 1 - softThreshold;
+				}
+			}
+
+			// keep the better half of hypotheses
+			std::stable_sort(survivors.begin(), survivors.end(),
+				[&partialScores](int a, int b) { return partialScores[a] > partialScores[b]; });
+			survivors.resize(std::max(numSurvivors, (int) (survivors.size() + 1) / 2));
+
+			blockStart = blockEnd;
+			blockSize *= 2;
+		}
+
+		return survivors;
+	}
+
 //	/**
 //	 * @brief Calculate an image of 3D distance errors for between scene coordinates and camera coordinates, given a pose.
 //	 * @param hyp Pose estimate.
@@ -518,8 +969,10 @@ namespace dsacstar
 	* @param maxReproj Reprojection errors are clamped to this maximum value.
 	* @param hypothesis (output parameter) Refined pose.
 	* @param inlierMap (output parameter) 2D image indicating which scene coordinate are (final) inliers.
+	* @param batchIdx Index of the image in the batch the hypothesis belongs to.
+	* @return Number of accepted pose updates.
 	*/
-	inline void refineHyp(
+	inline unsigned refineHyp(
 		dsacstar::coord_t& sceneCoordinates,
 		const cv::Mat_<float>& reproErrs,
 		const cv::Mat_<cv::Point2i>& sampling,
@@ -528,13 +981,14 @@ namespace dsacstar
 		unsigned maxRefSteps,
 		float maxReproj,
 		dsacstar::pose_t& hypothesis,
-		cv::Mat_<int>& inlierMap)
+		cv::Mat_<int>& inlierMap,
+		int batchIdx = 0)
 	{
 		cv::Mat_<float> localReproErrs = reproErrs.clone();
-		int batchIdx = 0; // only batch size=1 supported atm
 
 		// refine as long as inlier count increases 
 		unsigned bestInliers = 4; 
+		unsigned numUpdates = 0;
 
 		// refine current hypothesis
 		for(unsigned rStep = 0; rStep < maxRefSteps; rStep++)
@@ -582,18 +1036,157 @@ namespace dsacstar
 
 			hypothesis = hypUpdate;
 			inlierMap = localInlierMap;
+			numUpdates++;
 
-			// recalculate pose errors
-			cv::Mat_<double> jacobeanDummy;
+			// recalculate pose errors, re-using the error buffer
+			dsacstar::projectReproErrs(
+				sceneCoordinates,
+				hypothesis, 
+				sampling, 
+				camMat,
+				maxReproj,
+				localReproErrs,
+				batchIdx);
+		}
 
-			localReproErrs = dsacstar::getReproErrs(
+		return numUpdates;
+	}
+
+	/**
+	* @brief Refine a pose hypothesis incrementally by iteratively re-fitting it to all inliers.
+	*
+	* Same as refineHyp, but inlier correspondences are kept across refinement steps and only
+	* correspondences that enter or leave the inlier set are added or removed. Each step starts
+	* iterative PnP from the previous pose, and refinement also stops when the pose changes
+	* by less than the given rotation and translation thresholds.
+	*
+	* @param sceneCoordinates Scene coordinate prediction (Nx3xHxW).
+	* @param reproErrs Original reprojection errors of the pose hypothesis, used to collect the first set of inliers.
+	* @param sampling Contains original image coordinate for each scene coordinate predicted.
+	* @param camMat Camera calibration matrix.
+	* @param inlierThreshold RANSAC inlier threshold.
+	* @param maxRefSteps Maximum refinement iterations (re-calculating inlier and refitting).
+	* @param maxReproj Reprojection errors are clamped to this maximum value.
+	* @param convRot Refinement converged if the rotation changes less than this (degree).
+	* @param convTrans Refinement converged if the translation changes less than this (scene units).
+	* @param hypothesis (output parameter) Refined pose.
+	* @param inlierMap (output parameter) 2D image indicating which scene coordinate are (final) inliers.
+	* @param batchIdx Index of the image in the batch the hypothesis belongs to.
+	* @return Number of accepted pose updates.
+	*/
+	inline unsigned refineHypIncremental(
+		dsacstar::coord_t& sceneCoordinates,
+		const cv::Mat_<float>& reproErrs,
+		const cv::Mat_<cv::Point2i>& sampling,
+		const cv::Mat_<float>& camMat,
+		float inlierThreshold,
+		unsigned maxRefSteps,
+		float maxReproj,
+		float convRot,
+		float convTrans,
+		dsacstar::pose_t& hypothesis,
+		cv::Mat_<int>& inlierMap,
+		int batchIdx = 0)
+	{
+		cv::Mat_<float> localReproErrs = reproErrs.clone();
+
+		// inlier correspondences, and for each scene coordinate its position in these lists (-1 if outlier)
+		std::vector<cv::Point2f> localImgPts;
+		std::vector<cv::Point3f> localObjPts;
+		std::vector<int> localSources;
+		cv::Mat_<int> inlierSlots(sampling.size(), -1);
+
+		// refine as long as inlier count increases 
+		unsigned bestInliers = 4; 
+		unsigned numUpdates = 0;
+
+		// refine current hypothesis
+		for(unsigned rStep = 0; rStep < maxRefSteps; rStep++)
+		{
+			// update inliers
+			for(int y = 0; y < sampling.rows; y++)
+			for(int x = 0; x < sampling.cols; x++)
+			{
+				bool isInlier = localReproErrs(y, x) < inlierThreshold;
+				int slot = inlierSlots(y, x);
+
+				if(isInlier && slot < 0)
+				{
+					// new inlier, append
+					inlierSlots(y, x) = localImgPts.size();
+					localImgPts.push_back(sampling(y, x));
+					localObjPts.push_back(cv::Point3f(
+						sceneCoordinates[batchIdx][0][y][x],
+						sceneCoordinates[batchIdx][1][y][x],
+						sceneCoordinates[batchIdx][2][y][x]));
+					localSources.push_back(y * sampling.cols + x);
+				}
+				else if(!isInlier && slot >= 0)
+				{
+					// lost inlier, replace by the last inlier
+					int last = localSources.back();
+					localImgPts[slot] = localImgPts.back();
+					localObjPts[slot] = localObjPts.back();
+					localSources[slot] = last;
+					inlierSlots(last / sampling.cols, last % sampling.cols) = slot;
+					inlierSlots(y, x) = -1;
+
+					localImgPts.pop_back();
+					localObjPts.pop_back();
+					localSources.pop_back();
+				}
+			}
+
+			if(localImgPts.size() <= bestInliers)
+				break; // converged
+			bestInliers = localImgPts.size();
+
+			// recalculate pose, starting from the current one
+			dsacstar::pose_t hypUpdate;
+			hypUpdate.first = hypothesis.first.clone();
+			hypUpdate.second = hypothesis.second.clone();
+
+			if(!dsacstar::safeSolvePnP(
+				localObjPts, 
+				localImgPts, 
+				camMat, 
+				cv::Mat(), 
+				hypUpdate.first, 
+				hypUpdate.second, 
+				true, 
+				cv::SOLVEPNP_ITERATIVE))
+				break; //abort if PnP fails
+
+			// measure pose change
+			cv::Matx33d rotOld, rotNew;
+			cv::Rodrigues(hypothesis.first, rotOld);
+			cv::Rodrigues(hypUpdate.first, rotNew);
+
+			double cosDelta = (cv::trace(rotNew * rotOld.t()) - 1) / 2;
+			double deltaRot = std::acos(std::max(-1.0, std::min(1.0, cosDelta))) * 180 / PI;
+			double deltaTrans = cv::norm(hypUpdate.second, hypothesis.second);
+
+			hypothesis = hypUpdate;
+			numUpdates++;
+
+			cv::Mat inlierMask = inlierSlots >= 0;
+			inlierMask.convertTo(inlierMap, CV_32S, 1.0 / 255);
+
+			if(deltaRot < convRot && deltaTrans < convTrans)
+				break; // converged
+
+			// recalculate pose errors, re-using the error buffer
+			dsacstar::projectReproErrs(
 				sceneCoordinates,
 				hypothesis, 
 				sampling, 
 				camMat,
 				maxReproj,
-				jacobeanDummy);
-		}			
+				localReproErrs,
+				batchIdx);
+		}
+
+		return numUpdates;
 	}
 
 //	/**
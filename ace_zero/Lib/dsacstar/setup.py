@@ -6,7 +6,7 @@ opencv_inc_dir = '' # directory containing OpenCV header files
 opencv_lib_dir = '' # directory containing OpenCV library files
 
 #if not explicitly provided, we try to locate OpenCV in the current Conda environment
-conda_env = os.environ['CONDA_PREFIX']
+conda_env = os.environ.get('CONDA_PREFIX', '')
 
 if len(conda_env) > 0 and len(opencv_inc_dir) == 0 and len(opencv_lib_dir) == 0:
 	print("Detected active conda environment:", conda_env)
@@ -20,6 +20,7 @@ if len(conda_env) > 0 and len(opencv_inc_dir) == 0 and len(opencv_lib_dir) == 0:
 
 if len(opencv_inc_dir) == 0:
 	print("Error: You have to provide an OpenCV include directory. Edit this file.")
+	print("Without OpenCV, use the pure PyTorch implementation in dsacstar_torch.py instead.")
 	exit()
 if len(opencv_lib_dir) == 0:
 	print("Error: You have to provide an OpenCV library directory. Edit this file.")
@@ -1,68 +1,74 @@
 #include "thread_rand.h"
+#include <algorithm>
 #include <omp.h>
 
-std::vector<std::mt19937> ThreadRand::generators;
+std::deque<std::mt19937> ThreadRand::generators;
 bool ThreadRand::initialised = false;
 
+void ThreadRand::addGenerators(unsigned seed, unsigned minCount)
+{
+    unsigned nThreads = std::max((unsigned) omp_get_max_threads(), minCount);
+
+    for(unsigned i = generators.size(); i < nThreads; i++)
+	generators.push_back(std::mt19937(i+seed));
+
+    initialised = true;
+}
+
 void ThreadRand::forceInit(unsigned seed)
 {
-    initialised = false;
-    init(seed);
+    #pragma omp critical(thread_rand_init)
+    {
+	generators.clear();
+	addGenerators(seed);
+    }
 }
 
 void ThreadRand::init(unsigned seed)
 {
-    #pragma omp critical
+    #pragma omp critical(thread_rand_init)
     {
-	if(!initialised)
-	{
-	    unsigned nThreads = omp_get_max_threads();
-	    
-	    for(unsigned i = 0; i < nThreads; i++)
-	    {    
-		generators.push_back(std::mt19937());
-		generators[i].seed(i+seed);
-	    }
-
-	    initialised = true;
-	}    
+	// the number of threads can grow after the first initialisation (omp_set_num_threads)
+	if(!initialised || generators.size() < (unsigned) omp_get_max_threads())
+	    addGenerators(seed);
     }
 }
 
-int ThreadRand::irand(int min, int max, int tid)
+std::mt19937& ThreadRand::generator(int tid)
 {
-    std::uniform_int_distribution<int> dist(min, max);
-
     unsigned threadID = omp_get_thread_num();
     if(tid >= 0) threadID = tid;
-    
-    if(!initialised) init();
-  
-    return dist(ThreadRand::generators[threadID]);
+
+    std::mt19937* gen;
+
+    // size and elements are only accessed under the lock, another thread may be appending generators.
+    // Appending to a deque keeps references to the existing generators valid, so the draw itself needs no lock
+    #pragma omp critical(thread_rand_init)
+    {
+	if(!initialised || threadID >= generators.size())
+	    addGenerators(1305, threadID + 1);
+	gen = &generators[threadID];
+    }
+
+    return *gen;
+}
+
+int ThreadRand::irand(int min, int max, int tid)
+{
+    std::uniform_int_distribution<int> dist(min, max);
+    return dist(generator(tid));
 }
 
 double ThreadRand::drand(double min, double max, int tid)
 {
     std::uniform_real_distribution<double> dist(min, max);
-    
-    unsigned threadID = omp_get_thread_num();
-    if(tid >= 0) threadID = tid;
-
-    if(!initialised) init();
-
-    return dist(ThreadRand::generators[threadID]);
+    return dist(generator(tid));
 }
 
 double ThreadRand::dgauss(double mean, double stdDev, int tid)
 {
     std::normal_distribution<double> dist(mean, stdDev);
-    
-    unsigned threadID = omp_get_thread_num();
-    if(tid >= 0) threadID = tid;
-
-    if(!initialised) init();
-
-    return dist(ThreadRand::generators[threadID]);
+    return dist(generator(tid));
 }
 
 int irand(int incMin, int excMax, int tid)
@@ -83,4 +89,38 @@ int igauss(int mean, int stdDev, int tid)
 double dgauss(double mean, double stdDev, int tid)
 {
     return ThreadRand::dgauss(mean, stdDev, tid);
-}
\ No newline at end of file
+}
+
+namespace
+{
+    // SplitMix64 finalizer, a bijective 64 bit mixing function
+    uint64_t mix64(uint64_t x)
+    {
+	x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ull;
+	x = (x ^ (x >> 27)) * 0x94D049BB133111EBull;
+	return x ^ (x >> 31);
+    }
+}
+
+CounterRand::CounterRand(unsigned seed, unsigned stream, unsigned domain)
+    : key(mix64(mix64(((uint64_t) seed << 32) | stream) + domain)), counter(0)
+{
+}
+
+uint64_t CounterRand::next()
+{
+    return mix64(key + 0x9E3779B97F4A7C15ull * ++counter);
+}
+
+int CounterRand::irand(int incMin, int excMax)
+{
+    // scale 32 random bits to the range (Lemire), bias is negligible for image sized ranges
+    uint64_t range = (uint64_t) (excMax - incMin);
+    return incMin + (int) (((next() >> 32) * range) >> 32);
+}
+
+double CounterRand::drand(double incMin, double excMax)
+{
+    // 53 random bits fill the mantissa of a double in [0, 1)
+    return incMin + (next() >> 11) * (1.0 / 9007199254740992.0) * (excMax - incMin);
+}
@@ -33,6 +33,8 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #pragma once
 
 #include <random>
+#include <cstdint>
+#include <deque>
 
 /** Classes and methods for generating random numbers in multi-threaded programs. */
 
@@ -77,6 +79,8 @@ public:
   /**
    * @brief Re-Initialize the object with the given seed.
    * 
+   * Must not run concurrently with the other methods, it destroys the generators in use.
+   * 
    * @param seed Seed to initialize the random number generators (seed is incremented by one for each generator).
    * @return void
    */
@@ -85,8 +89,10 @@ public:
   /**
    * @brief List of random number generators. One for each thread.
    * 
+   * A deque, so that appending generators for new threads keeps references to the existing ones valid.
+   * Access it under the thread_rand_init critical section only, see generator.
    */
-  static std::vector<std::mt19937> generators;
+  static std::deque<std::mt19937> generators;
 
   /**
    * @brief Initialize class with the given seed.
@@ -105,6 +111,23 @@ private:
    * @brief True if the class has been initialized already
    */
   static bool initialised;  
+
+  /**
+   * @brief Append generators until there is one for each thread. Call in a critical section only.
+   *
+   * @param seed Seed of the first generator, incremented by one for each further generator.
+   * @param minCount Minimum number of generators, e.g. for an explicit thread ID beyond the number of threads.
+   * @return void
+   */
+  static void addGenerators(unsigned seed, unsigned minCount = 0);
+
+  /**
+   * @brief Returns the generator of a thread, initialising it if necessary.
+   *
+   * @param tid ID of the thread, or -1 for the calling thread.
+   * @return std::mt19937& Generator of the thread, stays valid until forceInit.
+   */
+  static std::mt19937& generator(int tid);
 };
 
 /**
@@ -153,3 +176,58 @@ int igauss(int mean, int stdDev, int tid = -1);
    * @return double Random double value.
    */
 double dgauss(double mean, double stdDev, int tid = -1);
+
+/**
+ * @brief Counter-based random number generator.
+ *
+ * Each number is a hash of (seed, stream, domain, draw index). There is no shared state, so
+ * independent instances can be used concurrently, and the numbers of a stream do not depend on
+ * thread scheduling or on other calls running in the same process. Typically, one instance is
+ * created per call and task, e.g. with the hypothesis index as stream.
+ */
+class CounterRand
+{
+public:
+  /**
+   * @brief Create a generator for one random stream.
+   *
+   * @param seed Random seed of the call.
+   * @param stream Index of the stream, e.g. the hypothesis index.
+   * @param domain Separates streams used for different purposes with the same index.
+   */
+  CounterRand(unsigned seed, unsigned stream, unsigned domain = 0);
+
+  /**
+   * @brief Returns a random integer (uniform distribution).
+   *
+   * @param incMin Minimum value of the random integer (inclusive).
+   * @param excMax Maximum value of the random integer (exclusive).
+   * @return int Random integer value.
+   */
+  int irand(int incMin, int excMax);
+
+  /**
+   * @brief Returns a random double value (uniform distribution).
+   *
+   * @param incMin Minimum value of the random double (inclusive).
+   * @param excMax Maximum value of the random double (exclusive).
+   * @return double Random double value.
+   */
+  double drand(double incMin, double excMax);
+
+private:
+  /**
+   * @brief Returns the next 64 random bits and advances the draw index.
+   */
+  uint64_t next();
+
+  /**
+   * @brief Hash of seed, stream and domain.
+   */
+  uint64_t key;
+
+  /**
+   * @brief Index of the last draw.
+   */
+  uint64_t counter;
+};
@@ -1,57 +1,145 @@
 import os
 import cv2
 from tqdm import tqdm
+from typing import Iterator, Tuple, Union
 
+import numpy as np
 
-def videoToImages(
-    video_file_path: str,
-    save_image_folder_path: str,
-    down_sample_scale: int=1,
+
+def resizeFrame(
+    frame: np.ndarray,
     scale: float=1,
-    show_image: bool=False,
-    print_progress: bool=False,
-) -> bool:
+    image_resolution: Union[int, None]=None,
+) -> np.ndarray:
+    '''
+    shrink frame by scale, or to a short side of image_resolution if it is given.
+    the scale path keeps the truncated size and default interpolation of the original videoToImages,
+    so existing image folders stay reproducible. the image_resolution path rounds the size and
+    shrinks with area interpolation.
+    '''
+    if image_resolution is not None:
+        scale = min(frame.shape[0], frame.shape[1]) / image_resolution
+        if scale == 1:
+            return frame
+
+        width = int(round(frame.shape[1] / scale))
+        height = int(round(frame.shape[0] / scale))
+
+        # area interpolation avoids aliasing when shrinking
+        interpolation = cv2.INTER_AREA if scale > 1 else cv2.INTER_LINEAR
+        return cv2.resize(frame, (width, height), interpolation=interpolation)
+
+    if scale == 1:
+        return frame
+
+    return cv2.resize(
+        frame, (int(frame.shape[1] / scale), int(frame.shape[0] / scale))
+    )
+
+def openVideo(video_file_path: str, func_name: str) -> Union[cv2.VideoCapture, None]:
     if not os.path.exists(video_file_path):
-        print('[ERROR][video::videoToImages]')
+        print('[ERROR][video::' + func_name + ']')
         print("\t video file not exist!")
         print('\t video_file_path:', video_file_path)
-        return False
-
-    if save_image_folder_path[-1] != "/":
-        save_image_folder_path += "/"
-
-    os.makedirs(save_image_folder_path, exist_ok=True)
+        return None
 
     cap = cv2.VideoCapture(video_file_path)
 
     if not cap.isOpened():
-        print('[ERROR][video::videoToImages]')
+        print('[ERROR][video::' + func_name + ']')
         print("\t video file can not open!")
         print('\t video_file_path:', video_file_path)
-        return False
+        cap.release()
+        return None
+
+    return cap
 
-    total_image_num = int(cap.get(7))
+def iterateFrames(
+    cap: cv2.VideoCapture,
+    down_sample_scale: int=1,
+    scale: float=1,
+    image_resolution: Union[int, None]=None,
+    print_progress: bool=False,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    '''
+    stream the frames of an opened video, see videoToFrames. releases cap when done.
+    '''
+    total_image_num = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
     for_data = range(total_image_num)
     if print_progress:
-        print("[INFO][video::videoToImages]")
-        print("\t start convert video to images...")
         for_data = tqdm(for_data)
-    for image_idx in for_data:
-        status, frame = cap.read()
-        if not status:
-            break
 
-        image_idx += 1
+    try:
+        for image_idx in for_data:
+            # grab() only demuxes and decodes, the costly conversion happens in retrieve()
+            if not cap.grab():
+                break
+
+            image_idx += 1
+
+            if image_idx % down_sample_scale != 0:
+                continue
 
-        if image_idx % down_sample_scale != 0:
-            continue
+            status, frame = cap.retrieve()
+            if not status:
+                break
 
-        if scale != 1:
-            frame = cv2.resize(
-                frame, (int(frame.shape[1] / scale), int(frame.shape[0] / scale))
-            )
+            yield image_idx, resizeFrame(frame, scale, image_resolution)
+    finally:
+        cap.release()
+
+def videoToFrames(
+    video_file_path: str,
+    down_sample_scale: int=1,
+    scale: float=1,
+    image_resolution: Union[int, None]=None,
+    print_progress: bool=False,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    '''
+    yield (image_idx, frame) for every down_sample_scale-th frame, image_idx starts at 1.
+    frames are BGR, shrunk by scale, or to a short side of image_resolution if it is given (see resizeFrame).
+    skipped frames are only grabbed, not retrieved, and nothing is written to disk.
+    '''
+    cap = openVideo(video_file_path, 'videoToFrames')
+    if cap is None:
+        return
+
+    if print_progress:
+        print("[INFO][video::videoToFrames]")
+        print("\t start streaming video frames...")
+
+    yield from iterateFrames(cap, down_sample_scale, scale, image_resolution, print_progress)
+
+def videoToImages(
+    video_file_path: str,
+    save_image_folder_path: str,
+    down_sample_scale: int=1,
+    scale: float=1,
+    show_image: bool=False,
+    print_progress: bool=False,
+    image_resolution: Union[int, None]=None,
+) -> bool:
+    cap = openVideo(video_file_path, 'videoToImages')
+    if cap is None:
+        return False
+
+    if save_image_folder_path[-1] != "/":
+        save_image_folder_path += "/"
+
+    os.makedirs(save_image_folder_path, exist_ok=True)
+
+    if print_progress:
+        print("[INFO][video::videoToImages]")
+        print("\t start convert video to images...")
 
+    for image_idx, frame in iterateFrames(
+        cap,
+        down_sample_scale,
+        scale,
+        image_resolution,
+        print_progress,
+    ):
         if show_image:
             cv2.imshow("image", frame)
             cv2.waitKey(1)
@@ -61,7 +149,6 @@ def videoToImages(
         )
         cv2.imwrite(save_image_file_path, frame)
 
-    cap.release()
     if show_image:
         cv2.destroyAllWindows()
     return True
@@ -0,0 +1,4 @@
+from ace_zero.Demo.video_to_frames import demo as demo_video_to_frames
+
+if __name__ == '__main__':
+    demo_video_to_frames()